@@ -0,0 +1,144 @@
+# Compressed data files.
+#
+# download/ is mostly the same numbers over and over.  Each
+# prevalence_history file repeats the whole history, and so on.  It
+# compresses very well.  compact.py compresses the files in place, e.g.
+#
+#   incidence_20230301.csv  ->  incidence_20230301.csv.gz
+#
+# and the scripts read them as if nothing had happened:
+#
+#   archive.glob(indir, prefix + '*.csv')  like indir.glob(), plus compressed
+#   archive.csv_name(path)                 'incidence_20230301.csv'
+#   archive.open_data(path, mode)          like open(), decompressing if needed
+#   archive.map_data(f)                    the whole file, to rfind() in
+#   archive.read_tail(f, n)                the last n bytes of the file
+#
+# instrument.open_input() uses open_data(), so most scripts don't need to
+# know about any of this.
+#
+# Formats:
+#
+#   .gz    gzip.  Fast, and 2-5x smaller.
+#   .xz    Smaller, but slower to read.
+#   .zst   Zstandard.  Fast and small, but needs the zstandard package
+#          (pip install zstandard).
+#   .blocks  Not compressed, but a list of blocks in a store shared by all
+#          the files in the directory, see history_store.py.
+#
+# The scripts which read from the end of the file (publish-date-8.py,
+# split-region.py) mmap the uncompressed files.  A compressed file can't be
+# mmapped, or read backwards, so it is decompressed into memory instead.
+# Decompressing is quick compared to reading the disk, and the files are a
+# few MB at most.
+
+import gzip
+import io
+import lzma
+import mmap
+import os
+from pathlib import Path
+
+SUFFIXES = ['.gz', '.xz', '.zst', '.blocks']
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def compression(path):
+    """The compression suffix of path, e.g. '.gz', or '' if none."""
+    name = os.fspath(path)
+    for suffix in SUFFIXES:
+        if name.endswith(suffix):
+            return suffix
+    return ''
+
+def csv_name(path):
+    """The name of the file, without the compression suffix."""
+    name = Path(path).name
+    suffix = compression(name)
+    return name[:len(name) - len(suffix)]
+
+def glob(indir, pattern):
+    """indir.glob(pattern), including compressed versions of the files.
+    If a file is there both compressed and not, e.g. because compact.py
+    was interrupted, only the uncompressed one is returned."""
+    found = {}
+    for suffix in [''] + SUFFIXES:
+        for path in Path(indir).glob(pattern + suffix):
+            found.setdefault(path.with_name(csv_name(path)), path)
+    return list(found.values())
+
+def find(path):
+    """The path of the file, or of a compressed version of it, or None."""
+    path = Path(path)
+    for suffix in [''] + SUFFIXES:
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            return candidate
+    return None
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('.zst files need the zstandard package '
+                          '(pip install zstandard)') from None
+    return zstandard
+
+def open_data(path, mode='r', suffix=None, **kwargs):
+    """open(path, mode, **kwargs), decompressing if the name ends with
+    .gz, .xz or .zst.  Text mode by default, like open().
+
+    suffix overrides the name, e.g. for a temporary file."""
+    if suffix is None:
+        suffix = compression(path)
+    if not suffix:
+        return open(path, mode, **kwargs)
+    if 'b' not in mode and 't' not in mode:
+        # gzip.open() etc. default to binary
+        mode += 't'
+    if suffix == '.gz':
+        return gzip.open(path, mode, **kwargs)
+    if suffix == '.xz':
+        return lzma.open(path, mode, **kwargs)
+    if suffix == '.blocks':
+        import history_store
+        f = history_store.open_snapshot(path)
+        if 'b' not in mode:
+            f = io.TextIOWrapper(f, **kwargs)
+        return f
+    return zstandard().open(path, mode, **kwargs)
+
+def _is_plain(f):
+    return isinstance(f, (io.BufferedReader, io.FileIO))
+
+def map_data(f):
+    """The whole of a file opened with open_data(path, 'rb'), as something
+    which supports rfind() and slicing.  An mmap if the file is not
+    compressed, otherwise the decompressed bytes."""
+    if _is_plain(f):
+        return mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+    return f.read()
+
+def read_tail(f, n):
+    """The rest of a file opened with open_data(path, 'rb'), or at least
+    the last n bytes of it.  Returns (data, True if data is all of the
+    rest)."""
+    if _is_plain(f):
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(start, size - n))
+        return (f.read(), size - n <= start)
+
+    # Compressed.  Read it all, keeping the end.
+    tail = b''
+    whole = True
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        tail += chunk
+        if len(tail) > n:
+            whole = False
+            tail = tail[-n:]
+    return (tail, whole)
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+#
+# Benchmark the scripts on synthetic data.
+#
+# The real archive is ~1GB and not in this repository.  So this generates
+# fake data files which look like the ZOE files (same headers, same quirks),
+# runs each script on them, and shows how long it took, rows per second,
+# and peak memory usage (RSS).
+#
+#   ./bench.py                    # default scale
+#   ./bench.py --snapshots 200    # more daily files
+#   ./bench.py --only jump,changes
+#
+# The data is written to a temporary directory, unless you give --dir.
+# The values are random, but consistent enough that the checks in the
+# scripts pass.  In particular prevalence_history is calculated from
+# incidence, so check_p_from_i.py does the full amount of work.
+
+import argparse
+import csv
+import datetime
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import prevalence_from_incidence
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+ENGLAND_REGIONS = [
+    'East Midlands', 'East of England', 'London', 'North East',
+    'North West', 'South East', 'South West', 'West Midlands',
+    'Yorkshire and The Humber']
+NATIONS = ['Wales', 'Scotland', 'Northern Ireland']
+REGIONS = ENGLAND_REGIONS + NATIONS
+
+POPULATION = {
+    'East Midlands': 4804149, 'East of England': 6201214,
+    'London': 8908081, 'North East': 2657909, 'North West': 7292093,
+    'South East': 9133625, 'South West': 5599735,
+    'West Midlands': 5900757, 'Yorkshire and The Humber': 5479615,
+    'Wales': 3138631, 'Scotland': 5438100, 'Northern Ireland': 1881641}
+
+# Headers by method version.  v3 has the same incidence header as v2,
+# and v5 and v6 have the same header as v4.
+INCIDENCE_HEADERS = [
+    # (first file date, header)
+    ('20200101', ',date,region,pop_mid,pop_low,pop_up,mil_mid,mil_low,mil_up'),
+    ('20201025', ',date,region,pop_mid,pop_low,pop_up,100k_mid,100k_low,100k_up'),
+    ('20210717', ',date,region,tested,tested_positive,population,active_users,'
+                 'newly_sick,covid_in_pop,covid_in_pop_lo,covid_in_pop_up,'
+                 'covid_in_100k,covid_in_100k_lolim,covid_in_100k_uplim,'
+                 'covid_in_mil,covid_in_mil_lolim,covid_in_mil_uplim'),
+]
+INCIDENCE_HISTORY_HEADERS = [
+    ('20200101', 'date,region,covid_in_pop,covid_in_pop_lolim,covid_in_pop_uplim,'
+                 'covid_in_100k,covid_in_100k_lolim,covid_in_100k_uplim'),
+    ('20210722', 'date,region,covid_in_pop,covid_in_pop_lo,covid_in_pop_up,'
+                 'covid_in_100k,covid_in_100k_lolim,covid_in_100k_uplim'),
+]
+PREVALENCE_HISTORY_HEADERS = [
+    ('20200101', 'date,region,active_cases'),
+    ('20220211', 'date,region,active_cases,active_cases_lolim,active_cases_uplim'),
+]
+# Note the newlines inside the quoted headers.
+INCIDENCE_TABLE_HEADER = (
+    'region,# total tests,# +ve tests,population,# active users,'
+    '# newly sick users,"est. daily\ncases","est. daily\ncases\n95% lower lim.",'
+    '"est. daily\ncases\n95% upper lim.","est. daily\ncases/million",'
+    '"est. daily\ncases/million\n95% lower lim.",'
+    '"est. daily\ncases/million\n95% upper lim."')
+MAP_HEADER = ',{code},{name},respondent,population,active_cases,percentage'
+NEWLY_SICK_HEADER = 'date,region,perc_users'
+TREND_FIELDS = [
+    'date', 'region', 'UTLA19CD', 'lad16cd', 'age_group', 'imd', 'gender',
+    'respondent_count', 'unhealthy_count', 'unhealthy_unk_count',
+    'predicted_covid_positive_count', 'predicted_covid_positive_prob',
+    'population', 'corrected_covid_positive', 'corrected_covid_positive_prob',
+    'factor', 'factor_prob']
+AGE_GROUPS = ['0-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65-74', '75+']
+IMDS = ['1', '2', '3']
+
+FIRST_DATE = datetime.date(2020, 5, 12)
+
+
+def header_for(headers, name):
+    result = None
+    for (since, header) in headers:
+        if name >= since:
+            result = header
+    return result
+
+def ymd(date):
+    return f'{date.year:04}{date.month:02}{date.day:02}'
+
+def read_recovery():
+    """The recovery model used by prevalence_from_incidence.py."""
+    return [1 - float(s)
+            for s in prevalence_from_incidence.RECOVERY_STR.split('\n')]
+
+
+class Generator:
+    def __init__(self, workdir, args):
+        self.workdir = Path(workdir)
+        self.args = args
+        self.random = random.Random(args.seed)
+        # dataset -> number of rows written
+        self.rows = {}
+        self.recovery = read_recovery()
+
+    def open(self, subdir, filename):
+        d = self.workdir / subdir
+        d.mkdir(parents=True, exist_ok=True)
+        return open(d / filename, 'w', newline='')
+
+    def count(self, dataset, n):
+        self.rows[dataset] = self.rows.get(dataset, 0) + n
+
+    def snapshot_dates(self):
+        last = datetime.date.fromisoformat(self.args.last)
+        return [last - datetime.timedelta(days=i)
+                for i in reversed(range(self.args.snapshots))]
+
+    def series(self, ndays):
+        # One smooth random walk per region, in new cases per day.
+        series = {}
+        for region in REGIONS:
+            level = POPULATION[region] * self.random.uniform(0.0005, 0.005)
+            values = []
+            for _ in range(ndays):
+                level *= math.exp(self.random.gauss(0, 0.03))
+                values.append(level)
+            series[region] = values
+        return series
+
+    def prevalence(self, incidences):
+        n = len(self.recovery)
+        return [sum(incidences[i - j] * self.recovery[j] for j in range(n))
+                for i in range(n - 1, len(incidences))]
+
+    def generate(self):
+        self.generate_series()
+        self.generate_maps()
+        self.generate_trend()
+
+    def generate_series(self):
+        snapshots = self.snapshot_dates()
+        last = snapshots[-1]
+        ndays = (last - FIRST_DATE).days
+        base = self.series(ndays)
+
+        for snapshot in snapshots:
+            # As in check_p_from_i.py
+            name = ymd(snapshot)
+            offset = 4 if name < '20211217' else 2
+            incidence_name = ymd(snapshot - datetime.timedelta(days=offset))
+            length = (snapshot - FIRST_DATE).days - offset
+            dates = [(FIRST_DATE + datetime.timedelta(days=i)).isoformat()
+                     for i in range(length)]
+
+            # Each snapshot revises the series a little.
+            series = {}
+            for (region, values) in base.items():
+                series[region] = [v * (1 + self.random.gauss(0, 0.002))
+                                  for v in values[:length]]
+            england = [sum(series[r][i] for r in ENGLAND_REGIONS)
+                       for i in range(length)]
+            uk = [england[i] + sum(series[r][i] for r in NATIONS)
+                  for i in range(length)]
+
+            self.write_incidence(incidence_name, dates, series, england, uk)
+            self.write_incidence_history(name, dates, series, england)
+            self.write_prevalence_history(name, dates, series)
+            self.write_newly_sick_table(name, dates[-self.args.history_days:])
+            if incidence_name >= '20210721':
+                self.write_incidence_table(incidence_name, series, england)
+
+    def write_incidence(self, name, dates, series, england, uk):
+        header = header_for(INCIDENCE_HEADERS, name)
+        ncols = header.count(',') - 2
+        all_series = dict(series)
+        all_series['England'] = england
+        all_series['UK'] = uk
+        with self.open('download/incidence', f'incidence_{name}.csv') as f:
+            f.write(header + '\n')
+            i = 0
+            for (d, date) in enumerate(dates):
+                for (region, values) in all_series.items():
+                    v = values[d]
+                    if ncols == 6:
+                        extra = [v, v * 0.8, v * 1.2, v * 1e6 / 6e7,
+                                 v * 0.8e6 / 6e7, v * 1.2e6 / 6e7]
+                        row = extra
+                    else:
+                        pop = POPULATION.get(region) or sum(
+                            POPULATION[r] for r in
+                            (ENGLAND_REGIONS if region == 'England' else REGIONS))
+                        row = [1000.0, 25.0, float(pop), 85000.0, 6000.0,
+                               v, v * 0.8, v * 1.2,
+                               v * 1e5 / pop, v * 0.8e5 / pop, v * 1.2e5 / pop,
+                               v * 1e6 / pop, v * 0.8e6 / pop, v * 1.2e6 / pop]
+                    f.write(','.join([str(i), date, region] +
+                                     [repr(x) for x in row]) + '\n')
+                    i += 1
+        self.count('incidence', len(dates) * len(all_series))
+
+    def write_incidence_history(self, name, dates, series, england):
+        header = header_for(INCIDENCE_HISTORY_HEADERS, name)
+        all_series = dict(series)
+        all_series['England'] = england
+        with self.open('download/incidence_history',
+                       f'incidence_history_{name}.csv') as f:
+            f.write(header + '\n')
+            for (d, date) in enumerate(dates):
+                for (region, values) in all_series.items():
+                    v = values[d]
+                    f.write(f'{date},{region},{v!r},{v*0.8!r},{v*1.2!r},'
+                            f'{v/10!r},{v*0.08!r},{v*0.12!r}\n')
+        self.count('incidence_history', len(dates) * len(all_series))
+
+    def write_prevalence_history(self, name, dates, series):
+        header = header_for(PREVALENCE_HISTORY_HEADERS, name)
+        cols = header.count(',') - 1
+        prevalences = {region: self.prevalence(values)
+                       for (region, values) in series.items()}
+        eaten = len(self.recovery) - 1
+        with self.open('download/prevalence_history',
+                       f'prevalence_history_{name}.csv') as f:
+            f.write(header + '\n')
+            for (d, date) in enumerate(dates[eaten:]):
+                for region in sorted(prevalences):
+                    v = prevalences[region][d]
+                    row = [v, v * 0.95, v * 1.05][:cols]
+                    f.write(f'{date},{region},' +
+                            ','.join(repr(x) for x in row) + '\n')
+        self.count('prevalence_history',
+                   (len(dates) - eaten) * len(prevalences))
+
+    def write_newly_sick_table(self, name, dates):
+        with self.open('download/newly_sick_table',
+                       f'newly_sick_table_{name}.csv') as f:
+            f.write(NEWLY_SICK_HEADER + '\n')
+            for date in dates:
+                for region in REGIONS:
+                    f.write(f'{date},{region},{self.random.uniform(0.5, 3)!r}\n')
+        self.count('newly_sick_table', len(dates) * len(REGIONS))
+
+    def write_incidence_table(self, name, series, england):
+        with self.open('download-sample/incidence table',
+                       f'incidence table_{name}.csv') as f:
+            f.write(INCIDENCE_TABLE_HEADER + '\n')
+            all_series = dict(series)
+            all_series['England'] = england
+            for region in sorted(all_series):
+                cases = round(all_series[region][-1])
+                if region == 'England':
+                    pop = sum(POPULATION[r] for r in ENGLAND_REGIONS)
+                else:
+                    pop = POPULATION[region]
+                per_mil = round(cases * 1e6 / pop)
+                f.write(f'{region},1000,100,{pop},20000,1500,{cases},'
+                        f'{round(cases*0.8)},{round(cases*1.2)},{per_mil},'
+                        f'{round(per_mil*0.8)},{round(per_mil*1.2)}\n')
+        self.count('incidence table', len(series) + 1)
+
+    def geography(self):
+        # (region, utla, lad) triples, with realistic numbers of each.
+        # A few LADs belong to more than one UTLA, as in the real data.
+        rnd = random.Random(self.args.seed)
+        utlas = [f'E{10000000 + i}' for i in range(self.args.utla)]
+        lads = []
+        for (i, utla) in enumerate(utlas):
+            region = REGIONS[i % len(REGIONS)]
+            lads.append((region, utla, f'E{60000000 + len(lads)}'))
+        while len(lads) < self.args.lad:
+            (region, utla, _) = lads[rnd.randrange(len(utlas))]
+            lads.append((region, utla, f'E{60000000 + len(lads)}'))
+        for i in range(min(3, len(lads) - 1)):
+            # Another UTLA in the same region shares this LAD.
+            (region, utla, lad) = lads[i]
+            for (region2, utla2, _) in lads:
+                if region2 == region and utla2 != utla:
+                    lads.append((region, utla2, lad))
+                    break
+        return lads
+
+    def generate_maps(self):
+        lads = self.geography()
+        utlas = sorted(set((utla for (_, utla, _) in lads)))
+        for snapshot in self.snapshot_dates():
+            name = ymd(snapshot)
+            for (kind, code, name_field, codes) in [
+                    ('utla', 'UTLA19CD', 'UTLA19NM', utlas),
+                    ('lad', 'lad16cd', 'lad16nm', sorted(set(lad for (_, _, lad) in lads)))]:
+                with self.open(f'download/{kind}_prevalence_map',
+                               f'{kind}_prevalence_map_{name}.csv') as f:
+                    f.write(MAP_HEADER.format(code=code, name=name_field) + '\n')
+                    for (i, c) in enumerate(codes):
+                        respondent = self.random.randint(50, 3000)
+                        population = self.random.randint(50000, 1500000)
+                        active = population * self.random.uniform(0.001, 0.05)
+                        percent = '' if respondent < 750 else repr(active / population * 100)
+                        f.write(f'{i},{c},Name {c},{respondent},{float(population)},'
+                                f'{active!r},{percent}\n')
+                self.count(f'{kind}_prevalence_map', len(codes))
+
+    def generate_trend(self):
+        lads = self.geography()
+        strata = []
+        for (region, utla, lad) in lads:
+            for imd in IMDS:
+                lsoa_count = self.random.randint(1, 40)
+                for age_group in AGE_GROUPS:
+                    population = self.random.randint(500, 20000)
+                    strata.append((region, utla, lad, age_group, imd,
+                                   lsoa_count, population))
+
+        last = self.snapshot_dates()[-1]
+        name = f'corrected_prevalence_region_trend_{ymd(last)}.csv'
+        self.trend_path = self.workdir / 'download/corrected_prevalence' / name
+        rnd = self.random
+        with self.open('download/corrected_prevalence', name) as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(TREND_FIELDS)
+            for day in reversed(range(self.args.trend_days)):
+                date = ymd(last - datetime.timedelta(days=1 + day))
+                factor = {r: rnd.uniform(0.5, 2) for r in REGIONS}
+                factor_prob = {r: rnd.uniform(0.5, 2) for r in REGIONS}
+                for (region, utla, lad, age_group, imd, lsoa_count, population) in strata:
+                    # The rules checked by prevalence_digest.parse_values().
+                    respondent = rnd.randint(0, population // 50)
+                    unhealthy = rnd.randint(0, respondent // 5)
+                    unhealthy_unk = unhealthy
+                    predicted = rnd.randint(0, unhealthy_unk)
+                    f_r = factor[region]
+                    fp_r = factor_prob[region]
+                    if unhealthy_unk == 0:
+                        (ccp, ccp_prob, pcp_prob) = ('', '', 0.0)
+                    elif predicted == 0:
+                        (ccp, ccp_prob, pcp_prob) = (0.0, 0.0, 0.0)
+                    else:
+                        ccp = f_r * predicted * population / respondent
+                        ccp_prob = ccp / fp_r
+                        pcp_prob = ccp_prob * respondent / population
+                    writer.writerow([date, region, utla, lad, age_group, imd,
+                                     lsoa_count, respondent, unhealthy,
+                                     unhealthy_unk, predicted, pcp_prob,
+                                     population, ccp, ccp_prob, f_r, fp_r])
+        self.count('corrected_prevalence', self.args.trend_days * len(strata))
+
+
+def entry_points(gen):
+    rows = gen.rows
+    def total(*datasets):
+        return sum(rows.get(d, 0) for d in datasets)
+    trend = str(gen.trend_path)
+    return [
+        # (name, command, input rows)
+        ('changes', ['changes.py'],
+            total('incidence', 'prevalence_history', 'incidence_history',
+                  'utla_prevalence_map', 'lad_prevalence_map',
+                  'incidence table')),
+        ('jump', ['jump.py'],
+            total('incidence', 'incidence_history', 'prevalence_history',
+                  'newly_sick_table')),
+        ('publish-date-8', ['publish-date-8.py'], total('incidence')),
+        ('prevalence_from_incidence', ['prevalence_from_incidence.py'],
+            total('incidence', 'incidence_history')),
+        # Reads each prevalence_history file twice, plus the outputs of
+        # prevalence_from_incidence.py.
+        ('check_p_from_i', ['check_p_from_i.py'],
+            total('prevalence_history') * 2),
+        ('prevalence_digest', ['prevalence_digest.py', trend],
+            total('corrected_prevalence')),
+        ('prevalence_digest --shards', ['prevalence_digest.py', '--shards', '8', trend],
+            total('corrected_prevalence')),
+    ]
+
+
+def run(workdir, command):
+    """Run a script.  Returns (seconds, peak RSS in MB)."""
+    script = SCRIPT_DIR / command[0]
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        p = subprocess.Popen([sys.executable, str(script)] + command[1:],
+                             cwd=workdir,
+                             stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4() gives us the resource usage of this one child.
+        (_, status, rusage) = os.wait4(p.pid, 0)
+        elapsed = time.perf_counter() - start
+        p.returncode = os.waitstatus_to_exitcode(status)
+        if p.returncode != 0:
+            stderr.seek(0)
+            sys.stderr.write(stderr.read().decode('utf-8', 'replace'))
+            raise Exception(f'{command[0]} failed with exit code {p.returncode}')
+    # ru_maxrss is in kilobytes on Linux.
+    return (elapsed, rusage.ru_maxrss / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scripts on synthetic ZOE-shaped data.')
+    parser.add_argument('--dir', help='Where to generate data and run the '
+                        'scripts.  Default: a temporary directory.')
+    parser.add_argument('--snapshots', type=int, default=30,
+                        help='Number of daily files of each kind (default: 30)')
+    parser.add_argument('--last', default='2023-03-01',
+                        help='Date of the last daily file (default: 2023-03-01)')
+    parser.add_argument('--history-days', type=int, default=300,
+                        help='Days in each newly_sick_table file (default: 300)')
+    parser.add_argument('--trend-days', type=int, default=30,
+                        help='Days in the corrected_prevalence trend file (default: 30)')
+    parser.add_argument('--utla', type=int, default=216,
+                        help='Number of UTLAs (default: 216)')
+    parser.add_argument('--lad', type=int, default=391,
+                        help='Number of LADs (default: 391)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', help='Comma-separated list of entry points to run')
+    parser.add_argument('--csv', help='Also write the results to this CSV file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='nova-bench-') as tmpdir:
+        workdir = Path(args.dir or tmpdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+
+        print(f'Generating data in {workdir} ...')
+        start = time.perf_counter()
+        gen = Generator(workdir, args)
+        gen.generate()
+        print(f'Generated in {time.perf_counter() - start:.1f}s')
+        for (dataset, n) in gen.rows.items():
+            print(f'  {dataset}: {n} rows')
+        print()
+
+        # Several scripts skip work if their output already exists.
+        shutil.rmtree(workdir / 'out', ignore_errors=True)
+
+        only = args.only.split(',') if args.only else None
+        results = []
+        print(f'{"entry point":<28} {"seconds":>8} {"rows/s":>10} {"peak MB":>8}')
+        for (name, command, rows) in entry_points(gen):
+            if only and name not in only:
+                continue
+            (elapsed, rss) = run(workdir, command)
+            rate = rows / elapsed
+            print(f'{name:<28} {elapsed:>8.2f} {rate:>10.0f} {rss:>8.1f}')
+            results.append([name, rows, elapsed, rate, rss])
+
+        if args.csv:
+            with open(args.csv, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['entry point', 'rows', 'seconds', 'rows/s', 'peak MB'])
+                writer.writerows(results)
+
+if __name__ == '__main__':
+    main()
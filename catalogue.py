@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#
+# Find all the versions of a ZOE data file, e.g. incidence_*.csv.
+#
+# Usually there is one file per day, e.g. incidence_20230315.csv.  But when
+# ZOE re-uploaded a file, or I was not sure which version I had, I saved
+# more than one, with some extra text after the date.  The names are not
+# consistent:
+#
+#   incidence_20230315-1800.csv                   time (local)
+#   incidence table_20220227-2100Z.csv            time (UTC)
+#   incidence_20230315-morning.csv                just a note
+#   incidence_20230501-08T0900.csv                upload day and time
+#   incidence_20230501-upload-08T13:10Z.csv       upload day and time (UTC)
+#   incidence_20230629-20230704-1230Z.csv         upload date and time (UTC)
+#   incidence_20230709-20230716T0715Z.csv         upload date and time (UTC)
+#   prevalence_history_20230706-20230710T-0735Z.csv  the same (sic)
+#   incidence_20230702-20230704.csv               upload date
+#   incidence_20230704-download-20230708.csv      download date
+#   incidence_20230709-download-2023-06-12.csv    download date (sic)
+#   incidence_20230127-overwritten-maybe-v6.csv   just a note
+#
+# Sorting the names does not put them in order, e.g. "-1800" sorts before
+# "-morning".  So this parses each name into the nominal date, the upload
+# time (if known), and the rest (the "variant").  Versions of the same day
+# are ordered by upload time.  Versions with no time come first: a plain
+# name is the first version we downloaded, and sync.py gives any later
+# version a name with the upload time.
+#
+# Upload times are naive datetimes.  Some are UTC and some are local time;
+# this does not try to tell the difference.  A download date is used as the
+# upload time, because it is the best we know.
+
+import datetime
+import re
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+import archive
+
+# path: the Path
+# name: the name without the prefix and .csv, e.g. "20230315-1800"
+# date: the nominal date, as a datetime.date
+# upload: upload time as a datetime.datetime, or None if not known
+# variant: the rest of the name, e.g. "morning", "download", or ""
+Snapshot = namedtuple('Snapshot', ('path', 'name', 'date', 'upload', 'variant'))
+
+_DATE = re.compile(r'(\d{4})(\d{2})(\d{2})')
+
+# (regex for the text after the date, variant).  The regexes have named
+# groups for whichever parts of the upload time they include.
+_FORMS = [
+    (r'', ''),
+    (r'-(?P<H>\d{2})(?P<M>\d{2})Z?', ''),
+    (r'-(?P<d>\d{2})T(?P<H>\d{2}):?(?P<M>\d{2})Z?', ''),
+    (r'-upload-(?P<d>\d{2})T(?P<H>\d{2}):?(?P<M>\d{2})Z?', ''),
+    (r'-(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})(?:-|T-?)(?P<H>\d{2})(?P<M>\d{2})Z?', ''),
+    (r'-(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})', ''),
+    (r'-download-(?P<Y>\d{4})-?(?P<m>\d{2})-?(?P<d>\d{2})', 'download'),
+]
+_FORMS = [(re.compile(regex), variant) for (regex, variant) in _FORMS]
+
+
+def _upload_time(date, groups):
+    year = int(groups.get('Y') or date.year)
+    month = int(groups.get('m') or date.month)
+    day = int(groups.get('d') or date.day)
+    if 'Y' not in groups and day < date.day:
+        # Only the day was given, and it is in the next month.
+        (year, month) = (year + month // 12, month % 12 + 1)
+    hour = int(groups.get('H') or 0)
+    minute = int(groups.get('M') or 0)
+    return datetime.datetime(year, month, day, hour, minute)
+
+def parse_name(name):
+    """Parse a name like "20230501-upload-08T13:10Z".
+
+    Returns (date, upload, variant).  Raises ValueError if the name does
+    not start with a date.
+    """
+    m = _DATE.match(name)
+    if not m:
+        raise ValueError(f'no date at start of name: {name!r}')
+    date = datetime.date(*map(int, m.groups()))
+    rest = name[m.end():]
+    for (regex, variant) in _FORMS:
+        m = regex.fullmatch(rest)
+        if m:
+            groups = {k: v for (k, v) in m.groupdict().items() if v}
+            if not groups:
+                return (date, None, variant)
+            return (date, _upload_time(date, groups), variant)
+    # Just a note, e.g. "-morning"
+    return (date, None, rest.lstrip('-'))
+
+def make_snapshot(path, prefix):
+    """The Snapshot for one file, e.g. prefix='incidence_'."""
+    path = Path(path)
+    name = archive.csv_name(path)[len(prefix):-len('.csv')]
+    (date, upload, variant) = parse_name(name)
+    return Snapshot(path, name, date, upload, variant)
+
+def sort_key(snapshot):
+    return (snapshot.date,
+            snapshot.upload is not None,
+            snapshot.upload or datetime.datetime.min,
+            snapshot.name)
+
+
+class Catalogue:
+    """All the files indir/prefix*.csv, in order.  Some may be compressed,
+    e.g. prefix*.csv.gz, see archive.py."""
+
+    def __init__(self, indir, prefix):
+        self.indir = Path(indir)
+        self.prefix = prefix
+        snapshots = [make_snapshot(path, prefix)
+                     for path in archive.glob(self.indir, prefix + '*.csv')]
+        snapshots.sort(key=sort_key)
+
+        # Every version, in order
+        self.snapshots = snapshots
+        # date -> list of versions
+        self.by_date = {}
+        # name -> Snapshot
+        self.by_name = {}
+        for snapshot in snapshots:
+            self.by_date.setdefault(snapshot.date, []).append(snapshot)
+            self.by_name[snapshot.name] = snapshot
+        # The last version of each day
+        self.final = [versions[-1] for versions in self.by_date.values()]
+
+    def __iter__(self):
+        return iter(self.snapshots)
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def dates(self):
+        return list(self.by_date)
+
+    def versions(self, date):
+        """All versions for the date, or [] if there are none."""
+        return self.by_date.get(date, [])
+
+    def latest(self, date):
+        """The final version for the date, or None."""
+        versions = self.by_date.get(date)
+        return versions[-1] if versions else None
+
+    def is_final(self, snapshot):
+        return self.by_date[snapshot.date][-1] is snapshot
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: ./catalogue.py DIR PREFIX")
+        print()
+        print("e.g. ./catalogue.py download/incidence incidence_")
+        sys.exit(2)
+    catalogue = Catalogue(sys.argv[1], sys.argv[2])
+    for snapshot in catalogue:
+        upload = snapshot.upload.isoformat(' ', 'minutes') if snapshot.upload else ''
+        final = '*' if catalogue.is_final(snapshot) else ''
+        print(f'{snapshot.date}  {upload:16}  {final:1}  {snapshot.name}')
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
-import os
 from pathlib import Path
-import csv
 import datetime
 
+from catalogue import Catalogue
+import fastcsv
+import instrument
+import prefetch
+import schema
+
 # https://www.mikulskibartosz.name/wilson-score-in-python-example/
 from math import sqrt
 def wilson(p, n, z = 1.96):
@@ -16,25 +20,44 @@ def wilson(p, n, z = 1.96):
     upper_bound = (centre_adjusted_probability + z*adjusted_standard_deviation) / denominator
     return (lower_bound, upper_bound)
 
+def track_all(catalogue, tracker, outfile):
+    """Send each snapshot in the catalogue to the tracker, then write the
+    name of the last one."""
+    next(tracker)
+    name = None
+    snapshots = list(catalogue)
+    files = prefetch.open_ahead([snapshot.path for snapshot in snapshots])
+    for (snapshot, (path, infile)) in zip(snapshots, files):
+        tracker.send((snapshot, infile))
+        name = snapshot.name
+    if name is not None:
+        outfile.write(f'{name}\n')
+
+# The trackers below are generators.  Send them (snapshot, open file) one
+# at a time, in order.  They write a paragraph to outfile, for each
+# snapshot which is different from the one before.  So you can keep one
+# running, and send it each new file as it arrives (see watch.py).
+
 def changes_map(indir, prefix, outfile):
-    paths = list(indir.glob(prefix + '*.csv'))
-    paths.sort()
-    prefix_len = len(prefix)
+    track_all(Catalogue(indir, prefix), track_map(outfile), outfile)
 
+def track_map(outfile):
     prev_head = None
     prev_fields = None
     prev_region_count = None
-    for path in paths:
+    while True:
+        (snapshot, infile) = yield
+        path = snapshot.path
+        name = snapshot.name
         print(path)
-        name = path.name[prefix_len:-4]
-        with path.open() as f:
+        with instrument.input_file(path), infile as f:
             head = f.readline()
             assert head
             head = head.rstrip()
             assert head
             f.seek(0)
 
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             fields = read.fieldnames
             assert fields
             row = next(read, None)
@@ -46,9 +69,10 @@ def changes_map(indir, prefix, outfile):
             f.seek(0)
 
             region_count = 0
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             for row in read:
                 region_count += 1
+            instrument.count('rows_parsed', region_count)
             f.seek(0)
 
         change = False
@@ -69,30 +93,29 @@ def changes_map(indir, prefix, outfile):
         if change:
             outfile.write('\n')
 
-    outfile.write(f'{name}\n')
-
 def changes_table(indir, prefix, outfile):
-    paths = list(indir.glob(prefix + '*.csv'))
-    paths.sort()
-    prefix_len = len(prefix)
+    track_all(Catalogue(indir, prefix), track_table(outfile), outfile)
 
+def track_table(outfile):
     prev_head = None
     prev_fields = None
     prev_regions = None
     prev_UK_pop = None
     prev_wilson_ci_p = None
     prev_wilson_ci_cases = None
-    for path in paths:
+    while True:
+        (snapshot, infile) = yield
+        path = snapshot.path
+        name = snapshot.name
         print(path)
-        name = path.name[prefix_len:-4]
-        with path.open() as f:
+        with instrument.input_file(path), infile as f:
             head = f.readline()
             assert head
             head = head.rstrip()
             assert head
             f.seek(0)
 
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             fields = read.fieldnames
             assert fields
             row = next(read, None)
@@ -103,16 +126,16 @@ def changes_table(indir, prefix, outfile):
             heads = head.split(',')
             f.seek(0)
 
-            def get_region(row):
-                return row.get('region') or row.get('nhser19nm')
+            region_field = schema.field_name(fields, 'region')
+            assert region_field
 
             regions = []
             UK_pop = 0
             EN_pop = 0
             EN_pop_file = 0
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             for row in read:
-                region = get_region(row)
+                region = row[region_field]
                 assert region
                 assert region not in regions
                 regions.append(region)
@@ -127,6 +150,7 @@ def changes_table(indir, prefix, outfile):
                     UK_pop += pop
                 else:
                     EN_pop += pop
+            instrument.count('rows_parsed', len(regions))
             regions.sort()
             regions_set = set(regions)
             f.seek(0)
@@ -142,9 +166,9 @@ def changes_table(indir, prefix, outfile):
                 wilson_ci_p = True
                 wilson_ci_cases = True
 
-                read = csv.DictReader(f)
+                read = fastcsv.DictReader(f)
                 for row in read:
-                    region = get_region(row)
+                    region = row[region_field]
                     tests = row.get('# total tests')
                     if tests == 'N/A':
                         continue
@@ -234,13 +258,10 @@ def changes_table(indir, prefix, outfile):
         if change:
             outfile.write('\n')
 
-    outfile.write(f'{name}\n')
-
 def changes(indir, prefix, outfile):
-    paths = list(indir.glob(prefix + '*.csv'))
-    paths.sort()
-    prefix_len = len(prefix)
+    track_all(Catalogue(indir, prefix), track_changes(outfile), outfile)
 
+def track_changes(outfile):
     prev_head = None
     prev_fields = None
     prev_start = None
@@ -253,17 +274,19 @@ def changes(indir, prefix, outfile):
     prev_uk_lo_quirk = None
     prev_uk_up_quirk = None
     prev_value_fraction = None
-    for path in paths:
+    while True:
+        (snapshot, infile) = yield
+        path = snapshot.path
+        name = snapshot.name
         print(path)
-        name = path.name[prefix_len:-4]
-        with path.open() as f:
+        with instrument.input_file(path), infile as f:
             head = f.readline()
             assert head
             head = head.rstrip()
             assert head
             f.seek(0)
 
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             fields = read.fieldnames
             assert fields
             row = next(read, None)
@@ -273,7 +296,7 @@ def changes(indir, prefix, outfile):
             f.seek(0)
 
             regions = []
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             row = next(read, None)
             assert row
             date = row.get('date')
@@ -286,31 +309,16 @@ def changes(indir, prefix, outfile):
                 row = next(read, None)
                 assert row
                 date = row.get('date')
+            # Only the rows for the first date are looked at
+            instrument.count('rows_parsed', len(regions))
             regions.sort()
             regions_set = set(regions)
             f.seek(0)
 
-            read = csv.DictReader(f)
-            mid_field = 'pop_mid'
-            if mid_field not in fields:
-                mid_field = 'covid_in_pop'
-            if mid_field not in fields:
-                mid_field = 'active_cases'
-
-            lo_field = 'pop_low'
-            if lo_field not in fields:
-                lo_field = 'covid_in_pop_lo'
-            if lo_field not in fields:
-                lo_field = 'covid_in_pop_lolim'
-            if lo_field not in fields:
-                lo_field = None
-            up_field = 'pop_up'
-            if up_field not in fields:
-                up_field = 'covid_in_pop_up'
-            if up_field not in fields:
-                up_field = 'covid_in_pop_uplim'
-            if up_field not in fields:
-                up_field = None
+            read = fastcsv.DictReader(f)
+            mid_field = schema.field_name(fields, 'mid')
+            lo_field = schema.field_name(fields, 'lo')
+            up_field = schema.field_name(fields, 'up')
 
             if 'UK' in regions or 'England' in regions:
                 uk_maybe_weighted = True
@@ -411,7 +419,7 @@ def changes(indir, prefix, outfile):
             f.seek(0)
 
             value_fraction = None
-            read = csv.DictReader(f)
+            read = fastcsv.DictReader(f)
             row = next(read, None)
             assert row
             date = row.get('date')
@@ -434,10 +442,7 @@ def changes(indir, prefix, outfile):
 
             assert f.readline().rstrip() == head
             heads = head.split(',')
-            date_field = 0
-            if not heads[0]:
-                date_field = 1
-            assert heads[date_field] == 'date'
+            [date_field] = schema.resolve(heads, ['date'], path)
 
             # Optimized inner loop :)
             for line in f:
@@ -448,10 +453,7 @@ def changes(indir, prefix, outfile):
             last_date = last_date.split('-')
             last_date = map(int, last_date)
             last_date = datetime.date(*last_date)
-            name_date = [name[:4], name[4:6], name[6:8]]
-            name_date = map(int, name_date)
-            name_date = datetime.date(*name_date)
-            offset = (name_date - last_date).days
+            offset = (snapshot.date - last_date).days
 
         change = False
         if fields != prev_fields:
@@ -506,31 +508,34 @@ def changes(indir, prefix, outfile):
         if change:
             outfile.write('\n')
 
-    outfile.write(f'{name}\n')
+def main(outdir='out/changes/'):
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
 
-outdir = Path('out/changes/')
-outdir.mkdir(parents=True, exist_ok=True)
+    indir = Path('download/utla_prevalence_map/')
+    with open(outdir / 'utla_prevalence_map.txt', 'w') as outfile:
+        changes_map(indir, 'utla_prevalence_map_', outfile)
 
-indir = Path('download/utla_prevalence_map/')
-with open(outdir / 'utla_prevalence_map.txt', 'w') as outfile:
-    changes_map(indir, 'utla_prevalence_map_', outfile)
+    indir = Path('download/lad_prevalence_map/')
+    with open(outdir / 'lad_prevalence_map.txt', 'w') as outfile:
+        changes_map(indir, 'lad_prevalence_map_', outfile)
 
-indir = Path('download/lad_prevalence_map/')
-with open(outdir / 'lad_prevalence_map.txt', 'w') as outfile:
-    changes_map(indir, 'lad_prevalence_map_', outfile)
+    indir = Path('download-sample/incidence table/')
+    with open(outdir / 'incidence table.txt', 'w') as outfile:
+        changes_table(indir, 'incidence table_', outfile)
 
-indir = Path('download-sample/incidence table/')
-with open(outdir / 'incidence table.txt', 'w') as outfile:
-    changes_table(indir, 'incidence table_', outfile)
+    indir = Path('download/incidence/')
+    with open(outdir / 'incidence.txt', 'w') as outfile:
+        changes(indir, 'incidence_', outfile)
 
-indir = Path('download/incidence/')
-with open(outdir / 'incidence.txt', 'w') as outfile:
-    changes(indir, 'incidence_', outfile)
+    indir = Path('download/prevalence_history/')
+    with open(outdir / 'prevalence_history.txt', 'w') as outfile:
+        changes(indir, 'prevalence_history_', outfile)
 
-indir = Path('download/prevalence_history/')
-with open(outdir / 'prevalence_history.txt', 'w') as outfile:
-    changes(indir, 'prevalence_history_', outfile)
+    indir = Path('download/incidence_history/')
+    with open(outdir / 'incidence_history.txt', 'w') as outfile:
+        changes(indir, 'incidence_history_', outfile)
 
-indir = Path('download/incidence_history/')
-with open(outdir / 'incidence_history.txt', 'w') as outfile:
-    changes(indir, 'incidence_history_', outfile)
+if __name__ == '__main__':
+    instrument.init()
+    main()
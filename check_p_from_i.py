@@ -3,22 +3,25 @@
 # This takes a minute or so on first run.
 # Successive runs are quicker, as we only check new files.
 
-import csv
 import datetime
 import errno
 import os
 import numpy as np
 from pathlib import Path
+import archive
+import fastcsv
+import instrument
 
 def read_prevalence(infile):
     regions = {}
     dates = []
 
-    csv_in = csv.DictReader(infile)
-    for row in csv_in:
-        region = row['region']
-        date = row['date']
-        prevalence = float(row.get('active_cases'))
+    columns = fastcsv.read_columns(infile, ['date', 'region'],
+                                   floats=['active_cases'])
+    instrument.count('rows_parsed', len(columns['date']))
+    for (date, region, prevalence) in zip(columns['date'],
+                                          columns['region'],
+                                          columns['active_cases'].tolist()):
         v = regions.get(region, None)
         if v is None:
             v = []
@@ -72,122 +75,143 @@ def check_prevalence_from_incidence(official_file, check_file,
         l = min(len(official_prevalence), len(check_prevalence))
         for i in range(-1, -1 - (l - skip), -1):
             if official_prevalence[i - skip]:
+                n += 1
                 diff = abs(official_prevalence[i - skip] - check_prevalence[i])
                 if diff > tolerance:
                     print ('CHECK FAILED', (check_path, check_dates[i],
                            region, check_prevalence[i], official_prevalence[i - skip]))
+                    instrument.count('rows_validated', n)
                     return False
+    instrument.count('rows_validated', n)
     return True
 
 
+# prevalence csv does not match incidence csv on these dates:
+MISMATCHES = [
+    # incidence csv changed method one day before prevalence csv
+    '20210511',
+    # A weird pattern in incidence, which was removed after a short time.
+    # Maybe prevalence wasn't regenerated.
+    '20220708',
+    # The data files start being updated before 9 AM.
+    # So perhaps there were some teething problem.
+    '20220725',
+    # incidence files published on this day were retroactively overwritten
+    # on 2023-02-02.  With big changes, seemingly because it was using the
+    # method v6 introduced on 2023-02-03.  Accidents happen.
+    '20230129',
+    # incidence file was revised significantly in the afternoon,
+    # but they failed to regenerate the prevalence file.
+    '20230317',
+    # incidence file revised in the afternoon, to remove large jump.
+    '20230320',
+    # files uploaded outside usual sequence - prevalence on 2023-05-08,
+    # corresponding incidence on 2023-05-09.  data could have changed.
+    '20230505',
+]
+
 # Skip already-checked files
-os.makedirs('out', exist_ok=True)
-try:
-    with open('out/check_p_from_i.txt') as check_file:
-        checked = set((line.rstrip() for line in check_file.readlines()))
-except OSError as e:
-    if e.errno != errno.ENOENT:
-        raise
-    checked = set()
-
-checkdir = Path('out/prevalence_from_incidence_/')
-
-# Iterate on prevalence_history, because prevalence_history_DATE.csv
-# goes back further than incidence_DATE.csv
-indir = Path('download/prevalence_history/')
-prefix = 'prevalence_history_'
-paths = list(indir.glob(prefix + '*.csv'))
-paths.sort()
-paths.reverse()
-for path in paths:
-    datename = path.name[len(prefix):-4]
-
-    # prevalence csv does not match incidence csv on these dates:
-    mismatches = [
-        # incidence csv changed method one day before prevalence csv
-        '20210511',
-        # A weird pattern in incidence, which was removed after a short time.
-        # Maybe prevalence wasn't regenerated.
-        '20220708',
-        # The data files start being updated before 9 AM.
-        # So perhaps there were some teething problem.
-        '20220725',
-        # incidence files published on this day were retroactively overwritten
-        # on 2023-02-02.  With big changes, seemingly because it was using the
-        # method v6 introduced on 2023-02-03.  Accidents happen.
-        '20230129',
-        # incidence file was revised significantly in the afternoon,
-        # but they failed to regenerate the prevalence file.
-        '20230317',
-        # incidence file revised in the afternoon, to remove large jump.
-        '20230320',
-        # files uploaded outside usual sequence - prevalence on 2023-05-08,
-        # corresponding incidence on 2023-05-09.  data could have changed.
-        '20230505',
-    ]
-    if datename in mismatches:
-       continue
-
-    # offset between dates in filenames
-    if datename < '20211217':
-        offset = -4
-    else:
-        offset = -2
+def read_checked(path='out/check_p_from_i.txt'):
+    try:
+        with open(path) as check_file:
+            return set((line.rstrip() for line in check_file.readlines()))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return set()
+
+def write_checked(checked, path='out/check_p_from_i.txt'):
+    with open(path, 'w') as check_file:
+        for c in sorted(checked):
+            check_file.write(c)
+            check_file.write('\n')
+
+def check_incidence(checked, indir, checkdir):
+    """Check prevalence_from_incidence_/ against prevalence_history.
+    Adds the files which pass to checked."""
+    # Iterate on prevalence_history, because prevalence_history_DATE.csv
+    # goes back further than incidence_DATE.csv
+    prefix = 'prevalence_history_'
+    paths = archive.glob(indir, prefix + '*.csv')
+    paths.sort()
+    paths.reverse()
+    for path in paths:
+        datename = archive.csv_name(path)[len(prefix):-4]
+        if datename in MISMATCHES:
+           continue
+
+        # offset between dates in filenames
+        if datename < '20211217':
+            offset = -4
+        else:
+            offset = -2
 
-    date = [int(d) for d in [datename[:-4], datename[-4:-2], datename[-2:]]]
-    date = datetime.date(*date)
-    date = date + datetime.timedelta(days=offset)
-    date = f'{date.year:04}{date.month:02}{date.day:02}'
+        date = [int(d) for d in [datename[:-4], datename[-4:-2], datename[-2:]]]
+        date = datetime.date(*date)
+        date = date + datetime.timedelta(days=offset)
+        date = f'{date.year:04}{date.month:02}{date.day:02}'
 
-    # incidence was rounded to nearest whole number
-    if date >= '20200903' and date < '20210717':
-        tolerance = 15
-    else:
-        tolerance = 1e-8
-
-    check_name = date + '.csv'
-    check_path = checkdir / check_name
-    if str(check_path) in checked:
-        continue
-
-    with (path.open() as official_file,
-          check_path.open() as check_file):
-        if check_prevalence_from_incidence(official_file, check_file,
-                                           str(check_path), datename, tolerance):
-            checked.add(str(check_path))
-
-
-checkdir = Path('out/prevalence_from_incidence_history_/')
-
-indir = Path('download/prevalence_history/')
-prefix = 'prevalence_history_'
-paths = list(indir.glob(prefix + '*.csv'))
-paths.sort()
-paths.reverse()
-for path in paths:
-    datename = path.name[len(prefix):-4]
-
-    # incidence history csv changed method one day after prevalence csv
-    # so they do not match.
-    if datename == '20210721':
-        continue
-
-    # incidence history csv was not changed for method v3
-    if datename >= '20210512' and datename < '20210721':
-        continue
-
-    check_name = f'{datename}.csv'
-    check_path = checkdir / check_name
-    if str(check_path) in checked:
-        continue
-
-    with (path.open() as official_file,
-          check_path.open() as check_file):
-        if check_prevalence_from_incidence(official_file, check_file,
-                                           str(check_path), datename, 1e-8):
-            checked.add(str(check_path))
-
-with open('out/check_p_from_i.txt', 'w') as check_file:
-    for c in sorted(checked):
-        check_file.write(c)
-        check_file.write('\n')
+        # incidence was rounded to nearest whole number
+        if date >= '20200903' and date < '20210717':
+            tolerance = 15
+        else:
+            tolerance = 1e-8
+
+        check_name = date + '.csv'
+        check_path = checkdir / check_name
+        if str(check_path) in checked:
+            continue
+        # Not calculated yet, e.g. the incidence file is not downloaded yet.
+        if not check_path.exists():
+            continue
+
+        with (instrument.open_input(path) as official_file,
+              check_path.open() as check_file):
+            if check_prevalence_from_incidence(official_file, check_file,
+                                               str(check_path), datename, tolerance):
+                checked.add(str(check_path))
+
+def check_incidence_history(checked, indir, checkdir):
+    """Check prevalence_from_incidence_history_/ against prevalence_history.
+    Adds the files which pass to checked."""
+    prefix = 'prevalence_history_'
+    paths = archive.glob(indir, prefix + '*.csv')
+    paths.sort()
+    paths.reverse()
+    for path in paths:
+        datename = archive.csv_name(path)[len(prefix):-4]
+
+        # incidence history csv changed method one day after prevalence csv
+        # so they do not match.
+        if datename == '20210721':
+            continue
+
+        # incidence history csv was not changed for method v3
+        if datename >= '20210512' and datename < '20210721':
+            continue
+
+        check_name = f'{datename}.csv'
+        check_path = checkdir / check_name
+        if str(check_path) in checked:
+            continue
+        if not check_path.exists():
+            continue
+
+        with (instrument.open_input(path) as official_file,
+              check_path.open() as check_file):
+            if check_prevalence_from_incidence(official_file, check_file,
+                                               str(check_path), datename, 1e-8):
+                checked.add(str(check_path))
+
+def main():
+    os.makedirs('out', exist_ok=True)
+    checked = read_checked()
+    indir = Path('download/prevalence_history/')
+    check_incidence(checked, indir, Path('out/prevalence_from_incidence_/'))
+    check_incidence_history(checked, indir,
+                            Path('out/prevalence_from_incidence_history_/'))
+    write_checked(checked)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -1,103 +1,351 @@
 #!/usr/bin/env python3
+#
+# Check the output of prevalence_digest.py against the official ZOE map.
+#
+# utla_8d_average.csv should match utla_prevalence_map_*.csv.  The last
+# date in the digest matches the map published with the same date as the
+# input file.  Assuming the same offset, every earlier date in the digest
+# is checked against the map published that many days earlier - if we
+# have it.  The older maps were calculated from older input files, which
+# ZOE may have revised since, so don't be too surprised by mismatches
+# there.
+#
+# Every mismatch is written to out/check_pd/<digest>/utla.csv, with the
+# values from both sides.  A summary is printed.  The exit status is 1 if
+# there were any mismatches.
+#
+# ./check_pd.py --lad also checks the LAD maps.  See LAD_SHIFTS below.
+# LAD mismatches count towards the exit status too, for one shift.
+#
+# And... don't assume this particular program is Quality.  I'm using it, feel
+# free to run it, but don't trust.  Verify.
+
 import csv
-import mmap
-from collections import namedtuple
+import sys
 from pathlib import Path
 
-# FIXME: it's not very helpful to just show a backtrace when a check fails.
-# And... don't assume this particular program is Quality.  I'm using it, feel
-# free to run it, but don't trust.  Verify.
+import numpy as np
 
-MapRow = namedtuple('MapRow', ('respondent', 'population', 'active_cases', 'percent'))
+import archive
+from catalogue import Catalogue, parse_name
+import instrument
 
-def check_prevalence_digest(official_file, check_file):
-    official = {}
-    o_csv = csv.DictReader(official_file)
-    for row in o_csv:
-        utla = row['UTLA19CD']
+# Looks like the threshold for 'Not enough contributors' is 750.
+#
+# Detail: the threshold is applied *before* respondent_count is
+# rounded to a whole number.  respondent_count can be fractional
+# because the map is based on a rolling average.
+THRESHOLD = 750
 
-        population_float = float(row['population'])
-        population = int(population_float)
-        assert population == population_float
+TOLERANCE = 1e-8
 
-        percent_str = row['percentage']
-        if percent_str == '':
-            percent = None
-        else:
-            percent = float(percent_str)
-
-        row = MapRow(
-            int(row['respondent']),
-            population,
-            float(row['active_cases']),
-            percent)
-        official[utla] = row
-
-    # You *could* do this efficiently
-    # without mmap, but why bother?
-    def reversed_lines(infile):
-        data = mmap.mmap(infile.fileno(), 0, prot=mmap.PROT_READ)
-        j = len(data)
-        i = data.rfind(b'\n', 0, j)
-        yield data[i+1:j].decode('ascii')
-        while i >= 0:
-            j = i
-            i = data.rfind(b'\n', 0, j)
-            yield data[i+1:j+1].decode('ascii')
-    def reversed_lines1(infile):
-        # header line
-        buf = next(infile)
-        # yield header line + reversed lines, without repeating header line
-        for line in reversed_lines(infile):
-            yield buf
-            buf = line
-
-    c_csv = csv.DictReader(reversed_lines1(check_file))
-    last_date = None
-    for row in c_csv:
-        date = row['date']
-        if last_date == None:
-            last_date = date
-        if date != last_date:
-            continue
-        date_prev = date
+REPORT_FIELDS = ['map', 'digest_date', 'code', 'check', 'digest', 'official']
+
+
+def read_columns(path, fields):
+    """Read the named columns of a CSV file, as lists of strings."""
+    with archive.open_data(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        indexes = [header.index(field) for field in fields]
+        columns = [[] for field in fields]
+        for row in reader:
+            for (column, i) in zip(columns, indexes):
+                column.append(row[i])
+    instrument.count('rows_parsed', len(columns[0]) if columns else 0)
+    return columns
+
+def to_float(column):
+    return np.array([float(x) if x != '' else np.nan for x in column])
+
+def to_date(column):
+    return np.array([f'{d[:4]}-{d[4:6]}-{d[6:8]}' for d in column],
+                    dtype='datetime64[D]')
+
+
+class Average:
+    """A rolling average from prevalence_digest, e.g. utla_8d_average.csv.
+
+    Rows are sorted by date then code.  rows(date) finds the rows for one
+    date.
+    """
+
+    def __init__(self, path, code_field):
+        (codes, dates, population, respondent, active_cases) = read_columns(
+            path, [code_field, 'date', 'population', 'respondent_count',
+                   'corrected_covid_positive'])
+        codes = np.array(codes)
+        dates = to_date(dates)
+        order = np.lexsort((codes, dates))
+        self.codes = codes[order]
+        self.dates = dates[order]
+        self.population = to_float(population)[order]
+        self.respondent = to_float(respondent)[order]
+        self.active_cases = to_float(active_cases)[order]
+
+        (self.unique_dates, self.starts) = np.unique(self.dates,
+                                                     return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.dates))
+
+    def rows(self, date):
+        """Returns a slice, or None if there are no rows for the date."""
+        i = np.searchsorted(self.unique_dates, date)
+        if i == len(self.unique_dates) or self.unique_dates[i] != date:
+            return None
+        return slice(self.starts[i], self.ends[i])
+
+    def last_date(self):
+        """The last date, or None if there are no rows."""
+        if not len(self.unique_dates):
+            return None
+        return self.unique_dates[-1]
+
+
+class Map:
+    """One utla_prevalence_map file, sorted by code."""
+
+    def __init__(self, snapshot, code_field):
+        (codes, respondent, population, active_cases, percent) = read_columns(
+            snapshot.path, [code_field, 'respondent', 'population',
+                            'active_cases', 'percentage'])
+        codes = np.array(codes)
+        order = np.argsort(codes)
+        self.snapshot = snapshot
+        self.codes = codes[order]
+        self.respondent = np.array([int(x) for x in respondent])[order]
+        self.population = to_float(population)[order]
+        self.active_cases = to_float(active_cases)[order]
+        self.percent = to_float(percent)[order]
 
-        utla = row['UTLA19CD']
-        official_row = official[utla]
 
-        population_float = float(row['population'])
-        population = int(population_float)
-        assert population == population_float
-        assert population == official_row.population
+def read_maps(official_dir, prefix, code_field):
+    return [Map(snapshot, code_field)
+            for snapshot in Catalogue(official_dir, prefix)]
 
-        respondent_count = float(row['respondent_count'])
-        assert round(respondent_count) == official_row.respondent
+def check_map(average, rows, official, threshold):
+    """Compare one date of the average with one map.
 
-        # Looks like the threshold for 'Not enough contributors' is 750.
-        #
-        # Detail: the threshold is applied *before* respondent_count is
-        # rounded to a whole number.  respondent_count can be fractional
-        # because the map is based on a rolling average.
-        assert (official_row.percent == None) == (respondent_count < 750)
+    Returns (number of codes checked, list of mismatches).  Each mismatch
+    is (code, check, digest value, official value).
+    """
+    codes = average.codes[rows]
+    population = average.population[rows]
+    respondent = average.respondent[rows]
+    active_cases = average.active_cases[rows]
 
-        corrected_covid_positive = float(row['corrected_covid_positive'])
-        assert abs(corrected_covid_positive - official_row.active_cases) < 1e-8
+    # Join on the code
+    pos = np.searchsorted(codes, official.codes)
+    pos = np.minimum(pos, len(codes) - 1)
+    found = codes[pos] == official.codes
+    in_map = np.isin(codes, official.codes)
 
+    mismatches = []
+    for code in official.codes[~found]:
+        mismatches.append((code, 'missing from digest', '', ''))
+    for code in codes[~in_map]:
+        mismatches.append((code, 'missing from map', '', ''))
 
-official_dir = Path('download/utla_prevalence_map/')
+    pos = pos[found]
+    map_codes = official.codes[found]
+    checks = [
+        ('population',
+         population[pos], official.population[found],
+         (population[pos] != np.floor(population[pos])) |
+         (population[pos] != official.population[found])),
+        ('respondent',
+         respondent[pos], official.respondent[found],
+         np.round(respondent[pos]) != official.respondent[found]),
+        ('active_cases',
+         active_cases[pos], official.active_cases[found],
+         ~(np.abs(active_cases[pos] - official.active_cases[found]) < TOLERANCE)),
+    ]
+    if threshold is not None:
+        checks.append(
+            ('not enough contributors',
+             respondent[pos], official.percent[found],
+             np.isnan(official.percent[found]) != (respondent[pos] < threshold)))
 
-# I haven't run prevalence_digest for all dates.
-# The input files are big and it takes time.
-indir = Path('out/prevalence_digest/')
-prefix = 'corrected_prevalence_region_trend_'
-paths = list(indir.glob(prefix + '*/'))
-paths.sort()
-for path in paths:
-    date = path.name[len(prefix):]
-    official_path = official_dir / f'utla_prevalence_map_{date}.csv'
+    for (check, digest_values, official_values, bad) in checks:
+        for i in np.nonzero(bad)[0]:
+            mismatches.append((map_codes[i], check,
+                               digest_values[i], official_values[i]))
+    return (len(map_codes), mismatches)
+
+def check_average(average, maps, name_date, threshold, report, shift=0):
+    """Check every date of the average against the maps.
+
+    With shift=N, each map is compared with the digest N days later.
+
+    Returns (number of mismatches, number of rows checked).
+    """
+    last_date = average.last_date()
+    if last_date is None:
+        print('  no rows, not checked')
+        return (0, 0)
+    # Map date = digest date + offset
+    offset = np.datetime64(name_date, 'D') - last_date
+    shift = np.timedelta64(shift, 'D')
+
+    mismatch_count = 0
+    checked_maps = 0
+    checked_rows = 0
+    for official in maps:
+        snapshot = official.snapshot
+        digest_date = np.datetime64(snapshot.date, 'D') - offset + shift
+        rows = average.rows(digest_date)
+        if rows is None:
+            continue
+        (count, mismatches) = check_map(average, rows, official, threshold)
+        checked_maps += 1
+        checked_rows += count
+        mismatch_count += len(mismatches)
+        if mismatches:
+            print(f'  {snapshot.path.name} vs {digest_date}: '
+                  f'{len(mismatches)} mismatches')
+        for (code, check, digest_value, official_value) in mismatches:
+            report.writerow([snapshot.name, str(digest_date).replace('-', ''),
+                             code, check, digest_value, official_value])
+    print(f'  {checked_maps} maps, {checked_rows} rows checked, '
+          f'{mismatch_count} mismatches')
+    instrument.count('rows_validated', checked_rows)
+    return (mismatch_count, checked_rows)
+
+
+# LAD mode.  lad_14d_average.csv is compared with lad_prevalence_map_*.csv.
+#
+# The app shows the 14-day average, but shifted back, and then it adds 6
+# further days (see write_lad() in prevalence_digest.py).  So each map is
+# checked against the digest at the same offset as the UTLAs (shift 0),
+# and against the digest 6 days later (shift 6).  The last 6 days can't
+# be checked with shift 6, because the digest doesn't go that far.
+#
+# The reports for both shifts are written.  The shift which counts
+# towards the exit status is the one with the lowest rate of mismatches,
+# over all the digests, unless you choose one with --lad-shift.  A tie
+# goes to shift 0.
+#
+# I don't know if the 750 respondent threshold applies to LADs, so that is
+# not checked.
+LAD_SHIFTS = [0, 6]
+
+
+def check_digest(path, prefix, utla_maps, lad_maps=None):
+    """Check one out/prevalence_digest/ directory.  Also check the LADs, if
+    lad_maps is given.
+
+    Returns (number of UTLA mismatches, LAD results).  The LAD results are
+    a dict: shift -> (number of mismatches, number of rows checked).  It is
+    empty without lad_maps.
+    """
+    (name_date, _, _) = parse_name(path.name[len(prefix):])
+    outdir = Path('out/check_pd') / path.name
+    outdir.mkdir(parents=True, exist_ok=True)
 
     check_path = path / 'utla_8d_average.csv'
     print(check_path)
-    with (official_path.open() as official_file,
-          check_path.open() as check_file):
-        check_prevalence_digest(official_file, check_file)
+    with (instrument.input_file(check_path),
+          open(outdir / 'utla.csv', 'w', newline='') as f):
+        average = Average(check_path, 'UTLA19CD')
+        report = csv.writer(f)
+        report.writerow(REPORT_FIELDS)
+        (mismatch_count, _) = check_average(average, utla_maps, name_date,
+                                            THRESHOLD, report)
+
+    lad_results = {}
+    if lad_maps is None:
+        return (mismatch_count, lad_results)
+    check_path = path / 'lad_14d_average.csv'
+    with instrument.input_file(check_path):
+        average = Average(check_path, 'LAD16CD')
+    for shift in LAD_SHIFTS:
+        print(f'{check_path} (shift {shift})')
+        filename = 'lad.csv' if shift == 0 else f'lad_shift{shift}.csv'
+        with open(outdir / filename, 'w', newline='') as f:
+            report = csv.writer(f)
+            report.writerow(REPORT_FIELDS)
+            lad_results[shift] = check_average(average, lad_maps, name_date,
+                                               None, report, shift=shift)
+    return (mismatch_count, lad_results)
+
+def choose_shift(lad_totals):
+    """The shift with the lowest rate of mismatches.  lad_totals is
+    shift -> [mismatches, rows checked]."""
+    def rate(shift):
+        (mismatches, rows) = lad_totals[shift]
+        return mismatches / rows if rows else float('inf')
+    return min(LAD_SHIFTS, key=rate)
+
+def usage():
+    print("Usage: ./check_pd.py [--lad [--lad-shift N]]")
+    print()
+    print("Check out/prevalence_digest/*/utla_8d_average.csv against")
+    print("download/utla_prevalence_map/.  With --lad, also check")
+    print("lad_14d_average.csv against download/lad_prevalence_map/.")
+    print("Mismatches are written to out/check_pd/")
+    print()
+    print("--lad-shift N: count the LAD mismatches for shift N in the exit")
+    print(f"               status ({' or '.join(map(str, LAD_SHIFTS))}).  "
+          "Default: the shift with")
+    print("               the fewest mismatches.")
+    sys.exit(2)
+
+def main():
+    args = sys.argv[1:]
+    lad = False
+    lad_shift = None
+    while args:
+        arg = args.pop(0)
+        if arg == '--lad':
+            lad = True
+        elif arg == '--lad-shift' and args and args[0].isdigit():
+            lad_shift = int(args.pop(0))
+            if lad_shift not in LAD_SHIFTS:
+                usage()
+        else:
+            usage()
+    if lad_shift is not None and not lad:
+        usage()
+
+    with instrument.stage('read maps'):
+        utla_maps = read_maps(Path('download/utla_prevalence_map/'),
+                              'utla_prevalence_map_', 'UTLA19CD')
+        lad_maps = None
+        if lad:
+            lad_maps = read_maps(Path('download/lad_prevalence_map/'),
+                                 'lad_prevalence_map_', 'lad16cd')
+
+    # I haven't run prevalence_digest for all dates.
+    # The input files are big and it takes time.
+    indir = Path('out/prevalence_digest/')
+    prefix = 'corrected_prevalence_region_trend_'
+    paths = list(indir.glob(prefix + '*/'))
+    paths.sort()
+
+    mismatch_count = 0
+    # shift -> [mismatches, rows checked], over all the digests
+    lad_totals = {shift: [0, 0] for shift in LAD_SHIFTS}
+    for path in paths:
+        (utla_mismatches, lad_results) = check_digest(path, prefix, utla_maps,
+                                                      lad_maps)
+        mismatch_count += utla_mismatches
+        for (shift, (mismatches, rows)) in lad_results.items():
+            lad_totals[shift][0] += mismatches
+            lad_totals[shift][1] += rows
+
+    if lad:
+        for shift in LAD_SHIFTS:
+            (mismatches, rows) = lad_totals[shift]
+            print(f'LAD shift {shift}: {rows} rows checked, '
+                  f'{mismatches} mismatches')
+        if lad_shift is None:
+            lad_shift = choose_shift(lad_totals)
+            print(f'Using LAD shift {lad_shift}, which has the fewest '
+                  f'mismatches')
+        mismatch_count += lad_totals[lad_shift][0]
+
+    if mismatch_count:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
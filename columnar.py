@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# Export the CSV files in out/ to a columnar format, for loading into
+# notebooks etc.  The CSV files stay as they are, for the spreadsheets.
+#
+#   ./columnar.py                            # everything in out/
+#   ./columnar.py out/prevalence_digest/     # just these
+#
+# If pyarrow is installed, each table is written as an Arrow IPC file
+# (out/columnar/.../<name>.arrow), which can be memory-mapped:
+#
+#   pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+#
+# or with --parquet, as a Parquet file.  Without pyarrow, each table is
+# written as a directory of NumPy .npy files, one per column
+# (out/columnar/.../<name>.npy/).  load() below reads them, with
+# numpy.load(mmap_mode='r').  A single .npz file can't be memory-mapped,
+# which would defeat the point.
+#
+# Column types are guessed from the values:
+#
+#   int      if every value is an integer
+#   float    if every value is a number.  Empty values become NaN.
+#   date     if the column name has 'date' in it, and every value looks
+#            like 20230301 or 2023-03-01
+#   string   otherwise.  Stored as a dictionary: integer codes, plus the
+#            list of distinct values (regions, UTLA codes...).
+#
+# Tables are only re-exported if the CSV file is newer.
+
+import csv
+import os
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import instrument
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+OUT_DIR = Path('out')
+COLUMNAR_DIR = OUT_DIR / 'columnar'
+
+SCHEMA_FIELDS = ['name', 'type', 'file']
+
+_DATE = re.compile(r'\d{4}-?\d{2}-?\d{2}')
+
+
+def read_csv(path):
+    """Returns (header, columns), where columns are lists of strings."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = [[] for field in header]
+        for row in reader:
+            # Short rows, e.g. England and UK in region.csv
+            row += [''] * (len(header) - len(row))
+            for (column, value) in zip(columns, row):
+                column.append(value)
+    return (header, columns)
+
+def _is_date(name, values):
+    if 'date' not in name.lower():
+        return False
+    return all(_DATE.fullmatch(value) for value in values)
+
+def convert(name, values):
+    """Returns (type, array).  For strings, array is (codes, categories)."""
+    if values and _is_date(name, values):
+        values = [v.replace('-', '') for v in values]
+        return ('date', np.array([f'{v[:4]}-{v[4:6]}-{v[6:8]}' for v in values],
+                                 dtype='datetime64[D]'))
+    try:
+        return ('int', np.array([int(v) for v in values], dtype=np.int64))
+    except ValueError:
+        pass
+    try:
+        return ('float', np.array([float(v) if v != '' else np.nan
+                                   for v in values], dtype=np.float64))
+    except ValueError:
+        pass
+
+    categories = {}
+    codes = [categories.setdefault(v, len(categories)) for v in values]
+    code_type = np.int8 if len(categories) < 128 else np.int32
+    return ('string', (np.array(codes, dtype=code_type),
+                       np.array(list(categories), dtype=str)))
+
+def read_table(path):
+    (header, columns) = read_csv(path)
+    return [(name,) + convert(name, values)
+            for (name, values) in zip(header, columns)]
+
+
+def write_npy(table, outpath):
+    outpath.mkdir(parents=True, exist_ok=True)
+    schema = []
+    for (i, (name, kind, array)) in enumerate(table):
+        filename = f'{i}.npy'
+        if kind == 'string':
+            (codes, categories) = array
+            np.save(outpath / filename, codes)
+            np.save(outpath / f'{i}.categories.npy', categories)
+        else:
+            np.save(outpath / filename, array)
+        schema.append([name, kind, filename])
+    # The schema is written last, so load() won't see a half-written table.
+    with open(outpath / 'schema.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SCHEMA_FIELDS)
+        writer.writerows(schema)
+
+def load(path, decode=True):
+    """Load a table written by write_npy().  Returns a dict of columns.
+
+    Numeric columns are memory-mapped.  String columns are decoded, unless
+    decode=False, in which case you get (codes, categories).
+    """
+    path = Path(path)
+    columns = {}
+    with open(path / 'schema.csv', newline='') as f:
+        for row in csv.DictReader(f):
+            array = np.load(path / row['file'], mmap_mode='r')
+            if row['type'] == 'string':
+                categories = np.load(path / row['file'].replace('.npy', '.categories.npy'))
+                array = categories[array] if decode else (array, categories)
+            columns[row['name']] = array
+    return columns
+
+def to_arrow(table):
+    arrays = []
+    for (name, kind, array) in table:
+        if kind == 'string':
+            (codes, categories) = array
+            arrays.append(pyarrow.DictionaryArray.from_arrays(
+                codes, pyarrow.array(categories)))
+        elif kind == 'float':
+            # NaN is how we read empty values, so make them null.
+            arrays.append(pyarrow.array(array, mask=np.isnan(array)))
+        else:
+            arrays.append(pyarrow.array(array))
+    return pyarrow.Table.from_arrays(arrays, names=[t[0] for t in table])
+
+def write_arrow(table, outpath):
+    tmp = outpath.with_name(outpath.name + '.tmp')
+    with pyarrow.OSFile(str(tmp), 'wb') as f:
+        arrow_table = to_arrow(table)
+        with pyarrow.ipc.new_file(f, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+    tmp.replace(outpath)
+
+def write_parquet(table, outpath):
+    tmp = outpath.with_name(outpath.name + '.tmp')
+    pyarrow.parquet.write_table(to_arrow(table), str(tmp))
+    tmp.replace(outpath)
+
+
+def export(csv_path, out_dir=OUT_DIR, columnar_dir=COLUMNAR_DIR, fmt=None):
+    """Export one CSV file.  Returns the output path, or None if it was
+    already up to date."""
+    if fmt is None:
+        fmt = 'arrow' if pyarrow else 'npy'
+    try:
+        relative = Path(csv_path).relative_to(out_dir)
+    except ValueError:
+        relative = Path(Path(csv_path).name)
+    outpath = columnar_dir / relative.with_suffix('.' + fmt)
+    check_path = outpath / 'schema.csv' if fmt == 'npy' else outpath
+    if (check_path.exists() and
+            check_path.stat().st_mtime >= os.stat(csv_path).st_mtime):
+        return None
+
+    with instrument.input_file(csv_path):
+        table = read_table(csv_path)
+        outpath.parent.mkdir(parents=True, exist_ok=True)
+        if fmt == 'npy':
+            write_npy(table, outpath)
+        elif fmt == 'arrow':
+            write_arrow(table, outpath)
+        else:
+            write_parquet(table, outpath)
+    return outpath
+
+def csv_files(paths, columnar_dir=COLUMNAR_DIR):
+    for path in paths:
+        path = Path(path)
+        if path.is_file():
+            yield path
+            continue
+        for csv_path in sorted(path.rglob('*.csv')):
+            # Don't export our own schema files
+            if columnar_dir in csv_path.parents:
+                continue
+            yield csv_path
+
+
+def main():
+    args = sys.argv[1:]
+    fmt = None
+    if args and args[0] in ['--parquet', '--npy']:
+        fmt = args[0][2:]
+        args = args[1:]
+    if (args and args[0].startswith('-')) or (fmt == 'parquet' and not pyarrow):
+        print("Usage: ./columnar.py [--parquet | --npy] [PATH...]")
+        print()
+        print("Export CSV files in out/ (or PATH) to out/columnar/.")
+        print("Arrow IPC files if pyarrow is installed, otherwise .npy columns.")
+        print("--parquet needs pyarrow.")
+        sys.exit(2)
+
+    count = 0
+    for csv_path in csv_files(args or [OUT_DIR]):
+        outpath = export(csv_path, fmt=fmt)
+        if outpath:
+            print(outpath)
+            count += 1
+    print(f'{count} tables exported')
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
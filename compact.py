@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Compress the files in download/, in place.  The scripts read them just
+# the same, see archive.py.
+#
+#   ./compact.py                        # download/.../*.csv -> *.csv.gz
+#   ./compact.py --format zst           # -> *.csv.zst (pip install zstandard)
+#   ./compact.py download/incidence/    # just these
+#
+# Each file is compressed to a temporary name, decompressed again and
+# checked against the original, and only then renamed.  The original is
+# removed after that.  The compressed file keeps the modification time of
+# the original.  If it is interrupted, just run it again.  Where both
+# versions exist, the scripts use the uncompressed one.
+#
+# download/manifest.csv is left alone, so sync.py still knows what it has
+# downloaded.  pipeline.py will re-run everything once, because the names
+# of the input files have changed.
+
+import gzip
+import hashlib
+import lzma
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import archive
+import instrument
+import sync
+
+FORMATS = ['gz', 'xz', 'zst']
+
+CHUNK_SIZE = 1024 * 1024
+
+def compressor(path, fmt, level=None):
+    """open(path, 'wb'), compressing as fmt."""
+    if fmt == 'gz':
+        return gzip.open(path, 'wb', compresslevel=level or 9)
+    if fmt == 'xz':
+        return lzma.open(path, 'wb', preset=level or 6)
+    zstandard = archive.zstandard()
+    return zstandard.open(path, 'wb',
+                          cctx=zstandard.ZstdCompressor(level=level or 19))
+
+def copy(infile, outfile=None):
+    """Copy infile to outfile, if any.  Returns the sha1 of the data."""
+    h = hashlib.sha1()
+    while True:
+        chunk = infile.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        h.update(chunk)
+        if outfile is not None:
+            outfile.write(chunk)
+    return h.hexdigest()
+
+def compact_file(path, fmt, level=None):
+    """Compress path to path.<fmt>, and remove path.  Returns the new
+    path."""
+    path = Path(path)
+    dest = path.with_name(f'{path.name}.{fmt}')
+    tmp = path.with_name(f'.{dest.name}.tmp')
+    st = path.stat()
+    try:
+        with open(path, 'rb') as infile, compressor(tmp, fmt, level) as outfile:
+            digest = copy(infile, outfile)
+        with archive.open_data(tmp, 'rb', suffix='.' + fmt) as check:
+            if copy(check) != digest:
+                raise Exception(f'{tmp}: does not match {path}')
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    os.remove(path)
+    return dest
+
+def find_files(dirs):
+    """The uncompressed CSV files in dirs, and in their subdirectories."""
+    paths = []
+    for d in dirs:
+        for path in sorted(Path(d).rglob('*.csv')):
+            if path.name == sync.MANIFEST:
+                continue
+            # Hidden files, and anything in a hidden directory, e.g. the
+            # index in .blocks/ (history_store.py)
+            if any(part.startswith('.')
+                   for part in path.relative_to(d).parts):
+                continue
+            paths.append(path)
+    return paths
+
+def compact(dirs, fmt='gz', level=None, jobs=None, dry_run=False):
+    paths = find_files(dirs)
+    if dry_run:
+        for path in paths:
+            print(path)
+        return paths
+
+    def task(path):
+        size = path.stat().st_size
+        with instrument.input_file(path):
+            dest = compact_file(path, fmt, level)
+        return (path, size, dest.stat().st_size)
+
+    before = 0
+    after = 0
+    # zlib and lzma release the GIL while they work
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        for (path, size, compressed) in pool.map(task, paths):
+            print(f'{path}: {size} -> {compressed}')
+            before += size
+            after += compressed
+    if paths:
+        print(f'{len(paths)} files: {before // 1024**2} MB -> '
+              f'{after // 1024**2} MB')
+    return paths
+
+
+def usage():
+    print("Usage: ./compact.py [--format gz|xz|zst] [--level N] [--jobs N]"
+          " [--dry-run] [DIR...]")
+    print()
+    print("Compress the CSV files in DIR (default: download/) in place.")
+    print("The scripts read the compressed files just the same.")
+    sys.exit(2)
+
+def main():
+    args = sys.argv[1:]
+    fmt = 'gz'
+    level = None
+    jobs = None
+    dry_run = False
+    while args and args[0].startswith('--'):
+        if args[0] == '--format' and len(args) > 1 and args[1] in FORMATS:
+            fmt = args[1]
+            args = args[2:]
+        elif args[0] == '--level' and len(args) > 1:
+            level = int(args[1])
+            args = args[2:]
+        elif args[0] == '--jobs' and len(args) > 1:
+            jobs = int(args[1])
+            args = args[2:]
+        elif args[0] == '--dry-run':
+            dry_run = True
+            args = args[1:]
+        else:
+            usage()
+    if fmt == 'zst':
+        # Fail now, rather than once per file
+        archive.zstandard()
+    compact(args or [sync.DOWNLOAD_DIR], fmt, level, jobs, dry_run)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
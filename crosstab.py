@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Add up corrected_prevalence_*_trend_*.csv by any combination of the key
+# fields, e.g. region x age group:
+#
+#   ./crosstab.py corrected_prevalence_region_trend_20230301.csv region,age_group
+#
+# prevalence_digest.py only produces a fixed set of totals: region, age,
+# imd, age x imd, UTLA and LAD.  As noted there, ZOE don't seem to
+# stratify P_S by both region and age at the same time.  If you want to
+# look at it yourself, this is how.
+#
+# You can ask for several combinations at once.  The input is read (and
+# checked, using prevalence_digest.parse_file) only once.  Every total is
+# per date, so you don't need to include date.
+#
+# Output files are written to out/crosstab/<input name>/, one per
+# combination, e.g. region_age_group.csv.  As well as the totals of the
+# value fields, including '+ symptom_based', each row has:
+#
+#   + response_rate                 respondent_count / population
+#   + defined_population_fraction   see utla_defined_pop in prevalence_digest
+#   + covid_rate                    corrected_covid_positive / population
+#
+# The 'gender' field is not added up, because it is the number of LSOAs.
+# factor and factor_prob are not added up either: each row keeps the value
+# from the first input row in its group (see add_values).  That is only
+# the factor for the whole group when the group is inside the strata that
+# ZOE used (region, for the region_trend file).
+
+import csv
+import os
+import sys
+
+import archive
+import instrument
+from prevalence_digest import (KEY_FIELDS, VALUE_FIELDS, add_values,
+                               parse_file, POPULATION, RESPONDENT_COUNT,
+                               UNHEALTHY_UNK_COUNT, CORRECTED_COVID_POSITIVE)
+
+# Combinations to use if none are given.
+DEFAULT_GROUPS = [
+    ('region', 'age_group'),
+    ('region', 'imd'),
+    ('age_group', 'imd'),
+]
+
+DERIVED_FIELDS = ['+ response_rate', '+ defined_population_fraction',
+                  '+ covid_rate']
+
+
+class Crosstab:
+    def __init__(self, groups):
+        for group in groups:
+            for field in group:
+                if field not in KEY_FIELDS or field == 'date':
+                    raise ValueError(f'not a key field: {field}')
+        self.groups = [tuple(group) for group in groups]
+        self._indexes = [[KEY_FIELDS.index(field) for field in group]
+                         for group in self.groups]
+        # One for each group: (date, key...) -> values
+        self.totals = [{} for group in self.groups]
+        # One for each group: (date, key...) -> defined population
+        self.defined_pop = [{} for group in self.groups]
+        self.value_fields = VALUE_FIELDS
+
+    def add(self, keys, values):
+        defined = values[UNHEALTHY_UNK_COUNT] > 0
+        population = values[POPULATION]
+
+        date = keys.date
+        for (indexes, totals, defined_pop) in zip(self._indexes, self.totals,
+                                                  self.defined_pop):
+            key = (date,) + tuple([keys[i] for i in indexes])
+            v = totals.get(key)
+            if v is None:
+                totals[key] = list(values)
+                defined_pop[key] = population if defined else 0
+            else:
+                add_values(v, values)
+                if defined:
+                    defined_pop[key] += population
+
+    def add_file(self, infile):
+        rows = 0
+        for (keys, _, values) in parse_file(infile):
+            self.add(keys, values)
+            rows += 1
+        instrument.count('rows_parsed', rows)
+
+    def write(self, outdir):
+        os.makedirs(outdir, exist_ok=True)
+        for (group, totals, defined_pop) in zip(self.groups, self.totals,
+                                                self.defined_pop):
+            filename = os.path.join(outdir, '_'.join(group) + '.csv')
+            with open(filename, 'w') as outfile:
+                csv_out = csv.writer(outfile)
+                csv_out.writerow(['date'] + list(group) + self.value_fields +
+                                 DERIVED_FIELDS)
+                for (key, values) in totals.items():
+                    population = values[POPULATION]
+                    if population:
+                        derived = [values[RESPONDENT_COUNT] / population,
+                                   defined_pop[key] / population,
+                                   values[CORRECTED_COVID_POSITIVE] / population]
+                    else:
+                        derived = ['', '', '']
+                    csv_out.writerow(list(key) + values + derived)
+
+
+def usage():
+    print("Usage: ./crosstab.py input.csv [FIELD,FIELD... ...]")
+    print()
+    print("Add up corrected_prevalence_*_trend_*.csv by combinations of")
+    print(f"{', '.join(KEY_FIELDS[1:])}.")
+    default = ' '.join(','.join(group) for group in DEFAULT_GROUPS)
+    print(f"Default: {default}")
+    print("Output files are written to out/crosstab/")
+    sys.exit(2)
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0].startswith('-'):
+        usage()
+    filename = args[0]
+    groups = [arg.split(',') for arg in args[1:]] or DEFAULT_GROUPS
+    try:
+        crosstab = Crosstab(groups)
+    except ValueError as e:
+        print(e)
+        usage()
+
+    name = archive.csv_name(filename)
+    if name.endswith('.csv'):
+        name = name[:-len('.csv')]
+    with instrument.open_input(filename) as infile:
+        crosstab.add_file(infile)
+    with instrument.stage('write'):
+        crosstab.write(os.path.join('out/crosstab', name))
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
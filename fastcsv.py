@@ -0,0 +1,110 @@
+# Read the ZOE CSV files quickly, but safely.
+#
+# The ZOE files are simple CSV: no quotes, and no commas inside values.  So
+# each row is just line.split(','), which is faster than the csv module (see
+# the performance log in prevalence.England.py).  But that is only right
+# while there are no quotes.  The headers of "incidence table_*.csv" have
+# quoted names with newlines in them, and who knows what ZOE will do next.
+#
+# So each line is checked for a '"', which is cheap.  At the first line
+# which has one, the rest of the file is handed over to the csv module.
+# Every line before that was a whole row, so the csv module starts at the
+# start of a row, and gets the same answer as if it had read the whole file.
+#
+#   for row in fastcsv.reader(f):            like csv.reader(f)
+#   for row in fastcsv.DictReader(f):        like csv.DictReader(f)
+#
+#   columns = fastcsv.read_columns(f, ['date', 'region'],
+#                                  floats=['active_cases'])
+#
+# read_columns() reads whole columns at once.  The float columns are
+# converted straight into numpy arrays, without a Python float per value.
+# numpy parses the numbers exactly as float() does, so the results are the
+# same.  (But if you add them up with numpy, the total can differ in the
+# last digit, so do that the same way the old code did.)
+#
+# f is a text file, e.g. from instrument.open_input().
+
+import csv
+import io
+import itertools
+from operator import itemgetter
+
+import numpy as np
+
+
+def reader(f, maxsplit=-1):
+    """Like csv.reader(f), for the default dialect.  With maxsplit, each
+    line is only split maxsplit times, like str.split(), so the last value
+    is the rest of the line.  That saves time if you only want the first
+    few columns.  (Once the csv module takes over, rows are split in
+    full.)"""
+    for line in f:
+        if '"' in line:
+            yield from csv.reader(itertools.chain([line], f))
+            return
+        line = line.rstrip('\r\n')
+        yield line.split(',', maxsplit) if line else []
+
+class DictReader:
+    """Like csv.DictReader(f).  Missing values are None, and extra values
+    are in a list under the key None."""
+
+    def __init__(self, f):
+        self.reader = reader(f)
+        self.fieldnames = next(self.reader, None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.reader)
+        while not row:
+            row = next(self.reader)
+        fieldnames = self.fieldnames
+        d = dict(zip(fieldnames, row))
+        n = len(fieldnames)
+        if len(row) > n:
+            d[None] = row[n:]
+        elif len(row) < n:
+            for key in fieldnames[len(row):]:
+                d[key] = None
+        return d
+
+def index(header, fields):
+    """The index of each of fields in header.  A missing field is a
+    KeyError."""
+    try:
+        return [header.index(field) for field in fields]
+    except ValueError:
+        missing = [field for field in fields if field not in header]
+        raise KeyError(missing[0]) from None
+
+def read_columns(f, fields, floats=(), resolve=index):
+    """Read whole columns of f.  Returns a dict: field -> list of strings,
+    or a numpy float64 array for the fields in floats.  An empty or bad
+    number is a ValueError.
+
+    resolve(header, names) returns the index of each name in header.  By
+    default the names must be in the header.  Columns after the last one
+    asked for are not split up."""
+    names = list(fields) + list(floats)
+    data = f.read()
+    if '"' in data:
+        rows = [row for row in csv.reader(io.StringIO(data, newline=''))
+                if row]
+        indexes = resolve(rows[0] if rows else [], names)
+        rows = rows[1:]
+    else:
+        lines = data.splitlines()
+        indexes = resolve(lines[0].split(',') if lines else [], names)
+        maxsplit = max(indexes, default=-1) + 1
+        rows = [line.split(',', maxsplit) for line in lines[1:] if line]
+
+    columns = {}
+    for (name, i) in zip(names, indexes):
+        column = list(map(itemgetter(i), rows))
+        if name in floats:
+            column = np.array(column, dtype=np.float64)
+        columns[name] = column
+    return columns
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+#
+# The geography of the ZOE data: regions, UTLAs, LADs, and how they fit
+# together.  Built from the corrected_prevalence trend files and the maps,
+# and saved in out/geography/.  No other script reads it yet; it is for
+# looking things up, e.g. which LADs are in more than one UTLA.
+#
+#   ./geography.py corrected_prevalence_region_trend_20230301.csv
+#
+# The trend files have one row per stratum:
+#
+#   (date, region, UTLA19CD, lad16cd, age_group, imd)
+#
+# A "cell" here is (UTLA, LAD, imd), without age group or date.  Each
+# cell has a number of LSOAs (the misnamed 'gender' column, see
+# prevalence_digest.py) and a population.  Note ZOE data says there are
+# 3 LADs that belong to more than one UTLA, so a LAD can have cells in
+# more than one UTLA.
+#
+# Each code gets an integer id, which does not change when the index is
+# updated with more files.
+#
+# Output files in out/geography/:
+#
+#   regions.csv   id, region
+#   utlas.csv     id, UTLA19CD, name, region_id, population
+#   lads.csv      id, lad16cd, name, population
+#   cells.csv     utla_id, lad_id, imd, lsoa_count, population
+#
+# The UTLA and LAD populations are from the latest map.  The cell
+# populations are from the last date in the trend file(s), summed over
+# age groups.  The names are from the maps.  If there is no map, they are
+# empty.
+
+import csv
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import archive
+from catalogue import Catalogue
+import instrument
+
+GEOGRAPHY_DIR = 'out/geography/'
+
+UTLA_FIELDS = ['id', 'UTLA19CD', 'name', 'region_id', 'population']
+LAD_FIELDS = ['id', 'lad16cd', 'name', 'population']
+CELL_FIELDS = ['utla_id', 'lad_id', 'imd', 'lsoa_count', 'population']
+
+
+class Codes:
+    """Names <-> integer ids, in order of first appearance."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.id(name)
+
+    def id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.ids[name] = i
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Geography:
+    def __init__(self):
+        self.regions = Codes()
+        self.utlas = Codes()
+        self.lads = Codes()
+        # utla id -> region id
+        self.utla_region = {}
+        # id -> name, population.  From the maps.
+        self.utla_name = {}
+        self.utla_population = {}
+        self.lad_name = {}
+        self.lad_population = {}
+        # (utla id, lad id, imd) -> [lsoa_count, population]
+        self.cells = {}
+
+    def add_trend(self, infile):
+        """Add the cells from a corrected_prevalence_*_trend_*.csv file."""
+        header = infile.readline().rstrip('\r\n').split(',')
+        fields = ['date', 'region', 'UTLA19CD', 'lad16cd', 'age_group', 'imd',
+                  'gender', 'population']
+        indexes = [header.index(field) for field in fields]
+        maxsplit = max(indexes) + 1
+
+        # (region, utla, lad, age_group, imd) -> (lsoa_count, population)
+        # The latest value of each.
+        strata = {}
+        for line in infile:
+            row = line.split(',', maxsplit)
+            (date, region, utla, lad, age_group, imd,
+             lsoa_count, population) = [row[i] for i in indexes]
+            strata[(region, utla, lad, age_group, imd)] = (lsoa_count, population)
+
+        cells = {}
+        for ((region, utla, lad, age_group, imd),
+             (lsoa_count, population)) in strata.items():
+            region_id = self.regions.id(region)
+            utla_id = self.utlas.id(utla)
+            lad_id = self.lads.id(lad)
+            prev_region = self.utla_region.setdefault(utla_id, region_id)
+            if prev_region != region_id:
+                sys.exit(f'UTLA {utla} is in more than one region')
+
+            key = (utla_id, lad_id, int(imd))
+            lsoa_count = int(float(lsoa_count))
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [lsoa_count, float(population)]
+            else:
+                if cell[0] != lsoa_count:
+                    sys.exit(f'Inconsistent LSOA count for {(utla, lad, imd)}')
+                cell[1] += float(population)
+        # A later file replaces the cells it has.
+        self.cells.update(cells)
+
+    def add_map(self, infile, code_field):
+        """Add the names and populations from a utla or lad prevalence map."""
+        name_field = {'UTLA19CD': 'UTLA19NM', 'lad16cd': 'lad16nm'}[code_field]
+        for row in csv.DictReader(infile):
+            code = row[code_field]
+            if code_field == 'UTLA19CD':
+                i = self.utlas.id(code)
+                self.utla_name[i] = row[name_field]
+                self.utla_population[i] = float(row['population'])
+            else:
+                i = self.lads.id(code)
+                self.lad_name[i] = row[name_field]
+                self.lad_population[i] = float(row['population'])
+
+    def save(self, path=GEOGRAPHY_DIR):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        def write(filename, fields, rows):
+            # Write a temporary file and rename it, so an interrupted save
+            # does not leave a mixture of old and new files.
+            tmp = path / (filename + '.tmp')
+            with tmp.open('w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                writer.writerows(rows)
+            tmp.replace(path / filename)
+
+        write('regions.csv', ['id', 'region'], enumerate(self.regions.names))
+        write('utlas.csv', UTLA_FIELDS,
+              ([i, code, self.utla_name.get(i, ''), self.utla_region.get(i, ''),
+                self.utla_population.get(i, '')]
+               for (i, code) in enumerate(self.utlas.names)))
+        write('lads.csv', LAD_FIELDS,
+              ([i, code, self.lad_name.get(i, ''),
+                self.lad_population.get(i, '')]
+               for (i, code) in enumerate(self.lads.names)))
+        write('cells.csv', CELL_FIELDS,
+              ([utla_id, lad_id, imd, lsoa_count, population]
+               for ((utla_id, lad_id, imd), (lsoa_count, population))
+               in sorted(self.cells.items())))
+
+    @classmethod
+    def load(cls, path=GEOGRAPHY_DIR):
+        """Load a saved index.  An empty Geography if there isn't one."""
+        path = Path(path)
+        geo = cls()
+        if not (path / 'regions.csv').exists():
+            return geo
+
+        def read(filename):
+            with (path / filename).open(newline='') as f:
+                return list(csv.DictReader(f))
+
+        for row in read('regions.csv'):
+            assert geo.regions.id(row['region']) == int(row['id'])
+        for row in read('utlas.csv'):
+            i = geo.utlas.id(row['UTLA19CD'])
+            assert i == int(row['id'])
+            if row['region_id'] != '':
+                geo.utla_region[i] = int(row['region_id'])
+            if row['name']:
+                geo.utla_name[i] = row['name']
+            if row['population'] != '':
+                geo.utla_population[i] = float(row['population'])
+        for row in read('lads.csv'):
+            i = geo.lads.id(row['lad16cd'])
+            assert i == int(row['id'])
+            if row['name']:
+                geo.lad_name[i] = row['name']
+            if row['population'] != '':
+                geo.lad_population[i] = float(row['population'])
+        for row in read('cells.csv'):
+            geo.cells[(int(row['utla_id']), int(row['lad_id']), int(row['imd']))] = [
+                int(row['lsoa_count']), float(row['population'])]
+        return geo
+
+    # Arrays, for use with numpy.
+
+    def utla_region_ids(self):
+        """region id for each UTLA id.  -1 if not known."""
+        return np.array([self.utla_region.get(i, -1)
+                         for i in range(len(self.utlas))], dtype=np.int32)
+
+    def cell_arrays(self):
+        """Returns (utla_id, lad_id, imd, lsoa_count, population) arrays,
+        one element per cell."""
+        keys = sorted(self.cells)
+        return (np.array([k[0] for k in keys], dtype=np.int32),
+                np.array([k[1] for k in keys], dtype=np.int32),
+                np.array([k[2] for k in keys], dtype=np.int8),
+                np.array([self.cells[k][0] for k in keys], dtype=np.int32),
+                np.array([self.cells[k][1] for k in keys], dtype=np.float64))
+
+    def shared_lads(self):
+        """LAD ids which have cells in more than one UTLA."""
+        utlas = {}
+        for (utla_id, lad_id, imd) in self.cells:
+            utlas.setdefault(lad_id, set()).add(utla_id)
+        return sorted(lad_id for (lad_id, s) in utlas.items() if len(s) > 1)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1].startswith('-'):
+        print("Usage: ./geography.py corrected_prevalence_*_trend_*.csv...")
+        print()
+        print("Update out/geography/ from the trend files, and the latest")
+        print("maps in download/utla_prevalence_map/ and lad_prevalence_map/.")
+        sys.exit(2)
+
+    geo = Geography.load()
+    for filename in sys.argv[1:]:
+        print(filename)
+        with instrument.open_input(filename) as infile:
+            geo.add_trend(infile)
+    for (kind, code_field) in [('utla', 'UTLA19CD'), ('lad', 'lad16cd')]:
+        catalogue = Catalogue(f'download/{kind}_prevalence_map/',
+                              f'{kind}_prevalence_map_')
+        if catalogue.final:
+            with archive.open_data(catalogue.final[-1].path) as infile:
+                geo.add_map(infile, code_field)
+    geo.save()
+
+    (utla_ids, lad_ids, imds, lsoa_counts, populations) = geo.cell_arrays()
+    print(f'{len(geo.regions)} regions, {len(geo.utlas)} UTLAs, '
+          f'{len(geo.lads)} LADs, {len(utla_ids)} cells, '
+          f'{int(lsoa_counts.sum())} LSOAs')
+    for lad_id in geo.shared_lads():
+        utlas = sorted(set(geo.utlas.names[u]
+                           for u in utla_ids[lad_ids == lad_id]))
+        print(f'LAD {geo.lads.names[lad_id]} is in UTLAs {", ".join(utlas)}')
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+#
+# Keep each distinct block of rows once, across all the versions of a
+# history file.
+#
+#   ./history_store.py add download/prevalence_history/
+#   ./history_store.py diff download/prevalence_history/prevalence_history_20230713*.csv*
+#   ./history_store.py stats download/prevalence_history/
+#
+# A block is a run of rows with the same date, e.g. the rows for every
+# region on 2021-05-04.  "add" moves each file X.csv into the store, and
+# leaves X.csv.blocks in its place: the date and hash of each block, in
+# order.  The blocks themselves are compressed and appended to .blocks/pack
+# in the same directory, once each, and .blocks/index.csv says where they
+# are.
+# archive.open_data() reads X.csv.blocks as the original file, byte for
+# byte, so the scripts don't notice the difference.
+#
+# "diff" compares the list of blocks, so it only needs to look at the rows
+# for the dates which changed.  It works on the original files too.
+#
+# How much this saves depends on how much ZOE change.  Unfortunately, at
+# the moment they recalculate the whole history every day, and almost every
+# row changes in the last few digits.  In my copy, two days in a row have
+# less than 1% of rows in common.  So for now, compact.py saves more space
+# than this does.  This does save on repeated downloads of the same file,
+# and "diff" is useful for seeing what was revised.
+#
+# Only one "add" should run at a time.
+
+import csv
+import hashlib
+import io
+import os
+import sys
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+import archive
+import instrument
+
+STORE_DIR = '.blocks'
+SUFFIX = '.blocks'
+
+# Where a block is in the pack, and its size before compression
+Location = namedtuple('Location', ('offset', 'length', 'size'))
+
+
+def split_blocks(data):
+    """Split the contents of a CSV file into [(date, bytes)].  The first
+    block is the header line, with date ''.  Joining the blocks gives back
+    the original data."""
+    lines = data.splitlines(keepends=True)
+    if not lines:
+        return []
+    blocks = [('', lines[0])]
+    header = lines[0].rstrip(b'\r\n').split(b',')
+    if b'date' not in header:
+        if len(lines) > 1:
+            blocks.append(('', b''.join(lines[1:])))
+        return blocks
+    date_field = header.index(b'date')
+
+    key = None
+    run = []
+    for line in lines[1:]:
+        row = line.split(b',', date_field + 1)
+        k = row[date_field] if len(row) > date_field else b''
+        if k != key:
+            if run:
+                blocks.append((key.decode('utf-8'), b''.join(run)))
+            key = k
+            run = []
+        run.append(line)
+    if run:
+        blocks.append((key.decode('utf-8'), b''.join(run)))
+    return blocks
+
+def block_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class Store:
+    """The blocks for the files in one directory."""
+
+    def __init__(self, indir):
+        self.path = Path(indir) / STORE_DIR
+        self.pack_path = self.path / 'pack'
+        self.index_path = self.path / 'index.csv'
+        self._index = None
+        self._index_version = None
+
+    def index(self):
+        """hash -> Location.  Reloaded if another process added to it."""
+        try:
+            st = self.index_path.stat()
+        except FileNotFoundError:
+            return {}
+        version = (st.st_size, st.st_mtime_ns)
+        if self._index is None or self._index_version != version:
+            index = {}
+            with open(self.index_path, newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) == 4:
+                        index[row[0]] = Location(*map(int, row[1:]))
+            self._index = index
+            self._index_version = version
+        return self._index
+
+    def get(self, hashes):
+        """The data of each block, joined together."""
+        index = self.index()
+        parts = []
+        with open(self.pack_path, 'rb') as pack:
+            for h in hashes:
+                location = index[h]
+                pack.seek(location.offset)
+                parts.append(zlib.decompress(pack.read(location.length)))
+        return b''.join(parts)
+
+    def put(self, blocks):
+        """Add the blocks which are not here already.  Returns the number of
+        bytes added to the pack."""
+        index = self.index()
+        new = {}
+        for (_, data) in blocks:
+            h = block_hash(data)
+            if h not in index and h not in new:
+                new[h] = data
+        if not new:
+            return 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        rows = []
+        added = 0
+        with open(self.pack_path, 'ab') as pack:
+            pack.seek(0, os.SEEK_END)
+            for (h, data) in new.items():
+                compressed = zlib.compress(data, 9)
+                rows.append([h, pack.tell(), len(compressed), len(data)])
+                pack.write(compressed)
+                added += len(compressed)
+            pack.flush()
+            os.fsync(pack.fileno())
+        # The index is written last.  If we are interrupted before that,
+        # there is some junk at the end of the pack, but nothing is lost.
+        with open(self.index_path, 'a', newline='') as f:
+            csv.writer(f).writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        return added
+
+
+def read_list(path):
+    """The [(date, hash)] in a .blocks file."""
+    with open(path, newline='') as f:
+        return [(row[0], row[1]) for row in csv.reader(f)]
+
+def block_list(path):
+    """The [(date, hash)] of any version of a file: a .blocks file, or the
+    original, compressed or not."""
+    if archive.compression(path) == SUFFIX:
+        return read_list(path)
+    with archive.open_data(path, 'rb') as f:
+        return [(key, block_hash(data))
+                for (key, data) in split_blocks(f.read())]
+
+def open_snapshot(path):
+    """The original file, from a .blocks file, as an in-memory binary
+    file."""
+    path = Path(path)
+    hashes = [h for (_, h) in read_list(path)]
+    return io.BytesIO(Store(path.parent).get(hashes))
+
+def add_file(path, store=None, keep=False):
+    """Move one file into the store.  Returns (size of file, bytes added to
+    the store)."""
+    path = Path(path)
+    if store is None:
+        store = Store(path.parent)
+    with archive.open_data(path, 'rb') as f:
+        data = f.read()
+    blocks = split_blocks(data)
+    added = store.put(blocks)
+
+    dest = path.with_name(archive.csv_name(path) + SUFFIX)
+    tmp = path.with_name(f'.{dest.name}.tmp')
+    with open(tmp, 'w', newline='') as f:
+        csv.writer(f).writerows([key, block_hash(block)]
+                                for (key, block) in blocks)
+    try:
+        with open_snapshot(tmp) as check:
+            if check.read() != data:
+                raise Exception(f'{tmp}: does not match {path}')
+        st = path.stat()
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, dest)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    if not keep:
+        os.remove(path)
+    return (len(data), added)
+
+def add(indir, keep=False):
+    """Move all the CSV files in indir into the store, oldest first."""
+    store = Store(indir)
+    paths = sorted(path for path in archive.glob(indir, '*.csv')
+                   if archive.compression(path) != SUFFIX)
+    total = 0
+    added = 0
+    for path in paths:
+        with instrument.input_file(path):
+            (size, n) = add_file(path, store, keep)
+        print(f'{path}: {size} bytes, {n} new')
+        total += size
+        added += n
+    return (total, added)
+
+
+# What changed for one date, between two versions
+Change = namedtuple('Change', ('date', 'old', 'new'))
+
+def diff(path_a, path_b):
+    """The dates where path_b has different rows to path_a, as a list of
+    Change(date, old hashes, new hashes).  For .blocks files, only the
+    lists of blocks are read."""
+    def by_date(blocks):
+        dates = {}
+        for (key, h) in blocks[1:]:
+            dates.setdefault(key, []).append(h)
+        return dates
+    a = by_date(block_list(path_a))
+    b = by_date(block_list(path_b))
+    changes = [Change(key, a.get(key, []), hashes)
+               for (key, hashes) in b.items() if a.get(key) != hashes]
+    changes.extend(Change(key, hashes, [])
+                   for (key, hashes) in a.items() if key not in b)
+    changes.sort(key=lambda change: change.date)
+    return changes
+
+def _block_reader(path):
+    """A function which returns the lines in a list of blocks."""
+    if archive.compression(path) == SUFFIX:
+        store = Store(Path(path).parent)
+        return lambda hashes: store.get(hashes).splitlines()
+    with archive.open_data(path, 'rb') as f:
+        blocks = {block_hash(data): data
+                  for (_, data) in split_blocks(f.read())}
+    return lambda hashes: b''.join(blocks[h] for h in hashes).splitlines()
+
+def diff_rows(path_a, path_b):
+    """For each date which changed, yields (date, rows only in path_a,
+    rows only in path_b).  Rows are bytes, without the newline."""
+    changes = diff(path_a, path_b)
+    if not changes:
+        return
+    lines_a = _block_reader(path_a)
+    lines_b = _block_reader(path_b)
+    for change in changes:
+        old = lines_a(change.old)
+        new = lines_b(change.new)
+        old_set = set(old)
+        new_set = set(new)
+        yield (change.date,
+               [line for line in old if line not in new_set],
+               [line for line in new if line not in old_set])
+
+def stats(indir):
+    """(size of the original files, size of the store, number of files)."""
+    paths = archive.glob(indir, '*.csv')
+    store = Store(indir)
+    index = store.index()
+    total = 0
+    for path in paths:
+        if archive.compression(path) == SUFFIX:
+            total += sum(index[h].size for (_, h) in read_list(path))
+        else:
+            with archive.open_data(path, 'rb') as f:
+                total += len(f.read())
+    stored = store.pack_path.stat().st_size if index else 0
+    return (total, stored, len(paths))
+
+
+def usage():
+    print("Usage: ./history_store.py add [--keep] DIR...")
+    print("       ./history_store.py diff [--rows] FILE1 FILE2")
+    print("       ./history_store.py stats DIR...")
+    print()
+    print("add:   move the CSV files in DIR into DIR/.blocks/, keeping each")
+    print("       distinct block of rows once.  Each file is replaced by")
+    print("       FILE.csv.blocks, which the scripts can still read.")
+    print("       --keep: don't remove the original files.")
+    print("diff:  the dates which changed between two versions of a file.")
+    print("       --rows: and the rows.")
+    print("stats: how much space the store saves.")
+    sys.exit(2)
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        usage()
+    command = args[0]
+    args = args[1:]
+    if command == 'add':
+        keep = False
+        if args and args[0] == '--keep':
+            keep = True
+            args = args[1:]
+        if not args:
+            usage()
+        for indir in args:
+            (total, added) = add(indir, keep)
+            print(f'{indir}: {total} bytes, {added} added to the store')
+    elif command == 'diff' and args:
+        rows = False
+        if args[0] == '--rows':
+            rows = True
+            args = args[1:]
+        if len(args) != 2:
+            usage()
+        n = 0
+        for (date, old, new) in diff_rows(args[0], args[1]):
+            print(f'{date}: {len(old)} rows removed, {len(new)} rows added')
+            if rows:
+                for line in old:
+                    print('-' + line.decode('utf-8'))
+                for line in new:
+                    print('+' + line.decode('utf-8'))
+            n += 1
+        print(f'{n} dates changed')
+    elif command == 'stats' and args:
+        for indir in args:
+            (total, stored, n) = stats(indir)
+            print(f'{indir}: {n} files, {total} bytes of data, '
+                  f'{stored} bytes in the store')
+    else:
+        usage()
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -2,18 +2,20 @@
 import sys
 import csv
 
+import instrument
+import schema
+
 def england(file_in, file_out):
     england = dict()
 
-    csv_in = csv.DictReader(file_in)
-    for row in csv_in:
+    csv_in = schema.reader(file_in, ['date', 'region', 'mid'])
+    for (date, region, incidence) in csv_in:
         # Note: input file will already include England.
         # However we output the sum of English regions;
         # in some versions of ZOE this will be different.
-        if row['region'] in ['England', 'Wales', 'Scotland', 'Northern Ireland', 'UK']:
+        if region in ['England', 'Wales', 'Scotland', 'Northern Ireland', 'UK']:
             continue
-        date = row['date']
-        incidence = float(row.get('pop_mid') or row.get('covid_in_pop'))
+        incidence = float(incidence)
         england[date] = england.get(date, 0) + incidence
 
     csv_out = csv.writer(file_out)
@@ -22,8 +24,14 @@ def england(file_in, file_out):
     for date in dates:
         csv_out.writerow([date, england[date]])
 
-if len(sys.argv) != 1:
-    sys.exit("Usage: incidence.England.py < input.csv > output.csv")
-file_in = sys.stdin
-file_out = sys.stdout
-england(file_in, file_out)
+def main():
+    if len(sys.argv) != 1:
+        sys.exit("Usage: incidence.England.py < input.csv > output.csv")
+    file_in = sys.stdin
+    file_out = sys.stdout
+    with instrument.stage('england'):
+        england(file_in, file_out)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -0,0 +1,172 @@
+# Timing and counters for the scripts, so we can see where the time goes,
+# and which input files or stages got slower after ZOE changed something.
+#
+# Each script calls init() first.  That removes --profile from sys.argv,
+# before the script looks at its own arguments.  Without --profile, the
+# functions below do almost nothing.
+#
+#   ./jump.py --profile
+#   ./jump.py --profile=cprofile     # also a cProfile dump per input file
+#
+# The report is written when the script exits:
+#
+#   out/profile/<script>.json   everything
+#   out/profile/<script>.csv    one line per stage or input file
+#   out/profile/<script>/*.prof cProfile dumps, if asked for.
+#                               Read them with python3 -m pstats FILE
+#
+# cProfile only covers the main process.  With prevalence_digest.py --shards,
+# the worker processes are slowed down but not reported.
+#
+# Usage:
+#
+#   with instrument.stage('write'):
+#       ...
+#
+#   for path in paths:
+#       with instrument.input_file(path):      # times it, counts bytes
+#           ...
+#           instrument.count('rows_parsed', n)
+#
+#   with instrument.open_input(path) as f:     # the same, and opens it
+#       ...
+#
+# Counters are added to the current stage or file, and to the totals.
+# Don't call count() for every row in a hot loop; add up n first.
+
+import atexit
+import cProfile
+import csv
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import archive
+
+PROFILE_DIR = Path('out/profile')
+
+REPORT_FIELDS = ['kind', 'name', 'seconds', 'max_rss_mb']
+
+_enabled = False
+_cprofile = False
+_script = None
+_start = None
+# list of dicts, one per stage or input file, in order of completion
+_entries = []
+# Stack of counter dicts for the stages we are in.  [0] is the totals.
+_counters = [{}]
+
+
+def _max_rss_mb():
+    # Including child processes, e.g. prevalence_digest.py --shards.
+    # ru_maxrss is in kilobytes on Linux.
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def init(argv=None):
+    """Handle --profile.  Call this before reading sys.argv."""
+    global _enabled, _cprofile, _script, _start
+    if argv is None:
+        argv = sys.argv
+    for arg in argv[1:]:
+        if arg in ['--profile', '--profile=cprofile']:
+            _enabled = True
+            _cprofile = _cprofile or arg == '--profile=cprofile'
+    argv[1:] = [arg for arg in argv[1:]
+                if arg not in ['--profile', '--profile=cprofile']]
+    if _enabled and _script is None:
+        _script = os.path.basename(argv[0])
+        if _script.endswith('.py'):
+            _script = _script[:-len('.py')]
+        _start = time.perf_counter()
+        atexit.register(write_report)
+    return _enabled
+
+def enabled():
+    return _enabled
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    for counters in _counters:
+        counters[name] = counters.get(name, 0) + n
+
+@contextmanager
+def _entry(kind, name, profile_name=None):
+    if not _enabled:
+        yield
+        return
+    counters = {}
+    _counters.append(counters)
+    profiler = None
+    if _cprofile and profile_name:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            outdir = PROFILE_DIR / _script
+            outdir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(outdir / (profile_name + '.prof'))
+        _counters.pop()
+        entry = {'kind': kind, 'name': name, 'seconds': seconds,
+                 'max_rss_mb': _max_rss_mb()}
+        entry.update(counters)
+        _entries.append(entry)
+
+def stage(name):
+    """Time a stage of the script."""
+    return _entry('stage', name)
+
+@contextmanager
+def input_file(path):
+    """Time the processing of one input file, and count its bytes."""
+    path = str(path)
+    with _entry('file', path, os.path.basename(path)):
+        if _enabled:
+            try:
+                count('bytes_read', os.path.getsize(path))
+            except OSError:
+                pass
+        yield
+
+@contextmanager
+def open_input(path, mode='r', **kwargs):
+    """input_file(path), plus open(path).  The file may be compressed,
+    see archive.py."""
+    with input_file(path), archive.open_data(path, mode, **kwargs) as f:
+        yield f
+
+def write_report():
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    total = {'kind': 'total', 'name': _script,
+             'seconds': time.perf_counter() - _start,
+             'max_rss_mb': _max_rss_mb()}
+    total.update(_counters[0])
+    entries = _entries + [total]
+
+    with open(PROFILE_DIR / (_script + '.json'), 'w') as f:
+        json.dump({'script': _script, 'argv': sys.argv,
+                   'entries': entries}, f, indent=1)
+
+    counter_fields = []
+    for entry in entries:
+        for field in entry:
+            if field not in REPORT_FIELDS and field not in counter_fields:
+                counter_fields.append(field)
+    with open(PROFILE_DIR / (_script + '.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS + counter_fields)
+        writer.writeheader()
+        writer.writerows(entries)
+
+    print(f'{_script}: {total["seconds"]:.2f} s, '
+          f'max RSS {total["max_rss_mb"]:.1f} MB.  '
+          f'Report: {PROFILE_DIR / (_script + ".csv")}', file=sys.stderr)
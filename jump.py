@@ -1,159 +1,160 @@
 #!/usr/bin/env python3
 
-import os
 from pathlib import Path
 import csv
 from collections import OrderedDict
 import math
+import archive
+import instrument
+import prefetch
+import schema
 
 SKIP_LAST_DAYS=3
 COMPARE_LAST_DAYS=18*3
 
+def read_values(path):
+    """The total of the English regions, for each date.  None if the file
+    has no rows."""
+    with instrument.open_input(path) as f:
+        return parse_values(f, path)
+
+def parse_values(f, path):
+    """read_values(), from an open file."""
+    values = OrderedDict()
+    rows = schema.reader(f, ['date', 'region', 'mid'], path)
+
+    date = None
+    prev_date = None
+    value = 0
+    n = 0
+    for (date, region, mid) in rows:
+        n += 1
+        if date != prev_date:
+            if prev_date is not None:
+                values[date] = value
+                value = 0
+            prev_date = date
+        # Highlight splits, in prevalence_history
+        #if region not in ['North East', 'East Midlands', 'London']:
+        #    continue
+        # Ignore splits, in incidence
+        #if region not in ['East of England', 'London', 'North West','South East', 'South West']:
+        #    continue
+        if region in ['UK', 'England', 'Wales', 'Scotland', 'Northern Ireland']:
+            continue
+        value += float(mid)
+    instrument.count('rows_parsed', n)
+
+    if date is None:
+        return None # no lines. lol.
+
+    values[date] = value
+    return values
+
+def compare(prefix, prev_values, values):
+    """Compare the values from one file with the file before.
+    Returns the output row: [date, change, change2, change3]."""
+    def dates_to_compare():
+        last_dates = reversed(values.keys())
+
+        date = next(last_dates)
+        while date not in prev_values:
+            date = next(last_dates)
+
+        skip_last_days = SKIP_LAST_DAYS
+        if prefix == 'newly_sick_table_':
+            skip = 1
+
+        for _ in range(skip_last_days):
+            date = next(last_dates)
+            assert date in prev_values
+
+        for _ in range(COMPARE_LAST_DAYS):
+            if date not in prev_values:
+                return # ran out of days in previous series
+            yield date
+            try:
+                date = next(last_dates)
+            except StopIteration:
+                return # ran out of days in current series
+
+    def changes():
+        for d in dates_to_compare():
+            yield (values[d] - prev_values[d]) / prev_values[d]
+    changes = list(changes())
+
+    # change = Original metric
+    sum_squares = 0
+    for c in changes:
+        sum_squares += c * c
+    change = math.sqrt(sum_squares / (len(changes) - 1))
+
+    # change2 = Compensate for 18-day cyclic pattern,
+    # visible in many but not all recent comparisons.
+    # The pattern sums to zero,
+    # so the simplest approach is to average it away.
+    sum_squares = 0
+    rolling_sum = sum(changes[:17])
+
+    # change3 = Try to highlight the 18-day cyclic pattern.
+    # This doesn't work very well.
+    devs=[0]*18
+
+    for i in range(17, len(changes)):
+        rolling_sum += changes[i]
+        mean = rolling_sum / 18
+        sum_squares += mean * mean
+        rolling_sum -= changes[i-17]
+
+        dev = changes[i-18//2] - mean
+        devs[i % 18] += dev
+
+    change2 = math.sqrt(sum_squares / (len(changes) - 17 - 1))
+
+    devs = [dev * dev for dev in devs]
+    change3 = math.sqrt(sum(devs) / (len(devs) - 1))
+
+    date = next(reversed(values.keys()))
+    return [date, change, change2, change3]
+
 def jump(indir, prefix, outfile):
     writer = csv.writer(outfile)
 
-    paths = list(indir.glob(prefix + '*.csv'))
+    paths = archive.glob(indir, prefix + '*.csv')
     paths.sort()
-    prefix_len = len(prefix)
 
     prev_values = None
 
-    for path in paths:
-        values = OrderedDict()
-        name = path.name[prefix_len:-4]
+    for (path, f) in prefetch.open_ahead(paths):
         print(path)
-        with path.open() as f:
-            head = f.readline()
-            assert head
-            head = head.rstrip()
-            assert head
-
-            heads = head.split(',')
-            date_field = 0
-            if not heads[0]:
-                date_field = 1
-            assert heads[date_field] == 'date'
-
-            region_field = heads.index('region')
-
-            field_names = ['pop_mid', 'covid_in_pop', 'active_cases', 'perc_users']
-            for field_name in field_names:
-                try:
-                    mid_field = heads.index(field_name)
-                    break
-                except ValueError:
-                    pass
-            else:
-                raise Exception(f'{path}: could not find one of {field_names}')
-
-            date = None
-            prev_date = None
-            value = 0
-            for line in f:
-                row = line.split(',')
-                date = row[date_field]
-                if date != prev_date:
-                    if prev_date is not None:
-                        values[date] = value
-                        value = 0
-                    prev_date = date
-                region = row[region_field]
-                # Highlight splits, in prevalence_history
-                #if region not in ['North East', 'East Midlands', 'London']:
-                #    continue
-                # Ignore splits, in incidence
-                #if region not in ['East of England', 'London', 'North West','South East', 'South West']:
-                #    continue
-                if region in ['UK', 'England', 'Wales', 'Scotland', 'Northern Ireland']:
-                    continue
-                pop_mid = float(row[mid_field])
-                value += pop_mid
-
-            if date is None:
-                continue # no lines. lol.
-
-            values[date] = value
-
-            if prev_values:                
-                def dates_to_compare():
-                    last_dates = reversed(values.keys())
-
-                    date = next(last_dates)
-                    while date not in prev_values:
-                        date = next(last_dates)
-
-                    skip_last_days = SKIP_LAST_DAYS
-                    if prefix == 'newly_sick_table_':
-                        skip = 1
-
-                    for _ in range(skip_last_days):
-                        date = next(last_dates)
-                        assert date in prev_values
-
-                    for _ in range(COMPARE_LAST_DAYS):
-                        if date not in prev_values:
-                            return # ran out of days in previous series
-                        yield date
-                        try:
-                            date = next(last_dates)
-                        except StopIteration:
-                            return # ran out of days in current series
-                
-                def changes():
-                    for d in dates_to_compare():
-                        yield (values[d] - prev_values[d]) / prev_values[d]
-                changes = list(changes())
-
-                # change = Original metric
-                sum_squares = 0
-                for c in changes:
-                    sum_squares += c * c
-                change = math.sqrt(sum_squares / (len(changes) - 1))
-
-                # change2 = Compensate for 18-day cyclic pattern,
-                # visible in many but not all recent comparisons.
-                # The pattern sums to zero,
-                # so the simplest approach is to average it away.
-                sum_squares = 0
-                rolling_sum = sum(changes[:17])
-
-                # change3 = Try to highlight the 18-day cyclic pattern.
-                # This doesn't work very well.
-                devs=[0]*18
-
-                for i in range(17, len(changes)):
-                    rolling_sum += changes[i]
-                    mean = rolling_sum / 18
-                    sum_squares += mean * mean
-                    rolling_sum -= changes[i-17]
-
-                    dev = changes[i-18//2] - mean
-                    devs[i % 18] += dev
-
-                change2 = math.sqrt(sum_squares / (len(changes) - 17 - 1))
-
-                devs = [dev * dev for dev in devs]
-                change3 = math.sqrt(sum(devs) / (len(devs) - 1))
-
-                date = next(reversed(values.keys()))
-                writer.writerow([date, change, change2, change3])
-            prev_values = values
-
-outdir = Path('out/jump/')
-outdir.mkdir(parents=True, exist_ok=True)
-
-indir = Path('download/incidence/')
-with open(outdir / 'incidence.csv', 'w') as outfile:
-    jump(indir, 'incidence_', outfile)
-
-indir = Path('download/incidence_history/')
-with open(outdir / 'incidence_history.csv', 'w') as outfile:
-    jump(indir, 'incidence_history_', outfile)
-
-indir = Path('download/prevalence_history/')
-with open(outdir / 'prevalence_history.csv', 'w') as outfile:
-    jump(indir, 'prevalence_history_', outfile)
-
-indir = Path('download/newly_sick_table/')
-with open(outdir / 'newly_sick_table.csv', 'w') as outfile:
-    jump(indir, 'newly_sick_table_', outfile)
+        with instrument.input_file(path), f:
+            values = parse_values(f, path)
+        if values is None:
+            continue
+        if prev_values:
+            writer.writerow(compare(prefix, prev_values, values))
+        prev_values = values
+
+def main(outdir='out/jump/'):
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    indir = Path('download/incidence/')
+    with open(outdir / 'incidence.csv', 'w') as outfile:
+        jump(indir, 'incidence_', outfile)
+
+    indir = Path('download/incidence_history/')
+    with open(outdir / 'incidence_history.csv', 'w') as outfile:
+        jump(indir, 'incidence_history_', outfile)
+
+    indir = Path('download/prevalence_history/')
+    with open(outdir / 'prevalence_history.csv', 'w') as outfile:
+        jump(indir, 'prevalence_history_', outfile)
+
+    indir = Path('download/newly_sick_table/')
+    with open(outdir / 'newly_sick_table.csv', 'w') as outfile:
+        jump(indir, 'newly_sick_table_', outfile)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
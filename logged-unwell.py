@@ -1,16 +1,20 @@
 #!/usr/bin/env python3
 from pathlib import Path
-import csv
+import os
+import sys
 from collections import namedtuple
 
+from writer_pool import WriterPool
+import instrument
+
 OutputRow = namedtuple('OutputRow',
                        ['region', 'well', 'unwell', 'logged', 'percent_unwell'])
 
-def one_sick(path, writer):
+def one_sick(path):
     name = path.name[:-4]
     date = '-'.join([name[:-4], name[-4:-2], name[-2:]])
 
-    with path.open() as infile:   
+    with instrument.open_input(path) as infile:   
         rows = {}
         for line in infile:
             line = line.rstrip()
@@ -55,42 +59,75 @@ def one_sick(path, writer):
         del nations
         rows.append(UK)
         del UK
-        for row in rows:
-            writer.writerow((date,) + row)
+        return [(date,) + row for row in rows]
 
-def all_sick(indir, outfile):
-    writer = csv.writer(outfile)
-    writer.writerow(['date',
-                     'region',
-                     '# users who logged feeling well',
-                     '# users who logged feeling unwell',
-                     '# users who logged',
-                     '% users who logged feeling unwell'])
+HEADER = ['date',
+          'region',
+          '# users who logged feeling well',
+          '# users who logged feeling unwell',
+          '# users who logged',
+          '% users who logged feeling unwell']
 
-    paths = list(indir.glob('*.txt'))
-    paths.sort()
-    for path in paths:        
-        try:
-            one_sick(path, writer)
-        except Exception as e:
-            print (f"Error processing '{path.name}'")
-            raise
+def last_date(path):
+    """The last date in an existing output file, or None."""
+    try:
+        with open(path, 'rb') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+    if len(lines) < 2:
+        return None
+    return lines[-1].decode('utf-8').split(',', 1)[0]
 
-indir = Path('logged-unwell.txt')
-with open('out/logged-unwell.csv', 'w') as outfile:
-    all_sick(indir, outfile)
+# Output files:
+#   out/logged-unwell.csv           all regions
+#   out/logged-unwell.<region>.csv  one region, nation, or 'UK'
+#
+# By default, we only read the daily files which are newer than the last
+# date in out/logged-unwell.csv, and append to the existing outputs.
+# Use --rebuild to start again, e.g. if you corrected an old file.  If
+# out/logged-unwell.csv is missing or has no rows, we start again anyway:
+# otherwise rows would be appended twice to any per-region files which are
+# still there.
+def all_sick(indir, outdir, rebuild=False):
+    prefix = 'logged-unwell'
+    main_path = os.path.join(outdir, prefix + '.csv')
+    after = None if rebuild else last_date(main_path)
+    if after is None:
+        rebuild = True
+    after = after and after.replace('-', '')
 
+    paths = list(indir.glob('*.txt'))
+    paths.sort()
+    if after:
+        paths = [path for path in paths if path.name[:-4] > after]
 
-import os
-import sys
-def shell(script):
-    rc = os.system(script)
-    if rc != 0:
-        print(script)
-        sys.exit(1)
+    header = ','.join(HEADER).encode('utf-8') + b'\r\n'
+    with WriterPool(outdir, header, append=not rebuild,
+                    lineterminator='\r\n') as writers:
+        if rebuild:
+            # Make sure every output is re-created, even if this run
+            # only writes the header.
+            writers.flush(prefix)
+        for path in paths:
+            try:
+                rows = one_sick(path)
+            except Exception as e:
+                print (f"Error processing '{path.name}'")
+                raise
+            for row in rows:
+                writers.writerow(prefix, row)
+                # row[1] is the region
+                writers.writerow(prefix + '.' + row[1], row)
 
-shell('head -n1 out/logged-unwell.csv > out/logged-unwell.England.csv')
-shell('grep ,England, out/logged-unwell.csv >> out/logged-unwell.England.csv')
+def main():
+    args = sys.argv[1:]
+    if args not in [[], ['--rebuild']]:
+        sys.exit("Usage: ./logged-unwell.py [--rebuild]")
+    os.makedirs('out', exist_ok=True)
+    indir = Path('logged-unwell.txt')
+    all_sick(indir, 'out', rebuild=bool(args))
 
-shell('head -n1 out/logged-unwell.csv > out/logged-unwell.Scotland.csv')
-shell('grep ,Scotland, out/logged-unwell.csv >> out/logged-unwell.Scotland.csv')
+if __name__ == '__main__':
+    instrument.init()
+    main()
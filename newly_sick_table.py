@@ -1,61 +1,112 @@
 #!/usr/bin/env python3
 import csv
+import os
 from pathlib import Path
+import archive
+import fastcsv
+import instrument
 
-def sniff_regions(infile):
-    regions = []
-    read = csv.DictReader(infile)
-    row = next(read, None)
-    assert row
-    date = row.get('date')
-    assert(date)
-    start = date
-    while date == start:
-        region = row.get('region')
-        assert region
-        assert region not in regions
-        regions.append(region)
-        row = next(read, None)
-        assert row
-        date = row.get('date')
-    regions.sort()
-    infile.seek(0)
-    return regions
+COUNTRIES = ['England', 'Wales', 'Scotland', 'Northern Ireland', 'UK']
 
-def newly_sick_table(infile, outfile):
-    regions = sniff_regions(infile)
-    for country in 'England', 'Wales', 'Scotland', 'Northern Ireland', 'UK':
+def order_regions(regions):
+    regions = sorted(regions)
+    for country in COUNTRIES:
         if country in regions:
             regions.remove(country)
-            regions.append(country) 
-
-    dates = []
-    values = {}
-    for region in regions:
-        values[region] = []
-    
-    reader = csv.DictReader(infile)
+            regions.append(country)
+    return regions
+
+def pivot(infile):
+    """Read a newly_sick_table file in one pass.
+
+    Returns (regions, table), where table is date -> region -> perc_users.
+    Regions are not required to be the same on every date.
+    """
+    reader = fastcsv.reader(infile)
+    header = next(reader)
+    date_field = header.index('date')
+    region_field = header.index('region')
+    value_field = header.index('perc_users')
+
+    regions = {}
+    table = {}
     prev_date = None
+    by_region = None
     for row in reader:
-        date = row['date']
+        date = row[date_field]
         if date != prev_date:
+            by_region = table.get(date)
+            if by_region is None:
+                by_region = {}
+                table[date] = by_region
             prev_date = date
-            dates.append(date)
-        region = row['region']
-        value = float(row.get('perc_users'))
-        values[region].append(value)
+        region = row[region_field]
+        regions[region] = None
+        by_region[region] = float(row[value_field])
+    return (order_regions(regions), table)
 
+def write_pivot(regions, table, outfile):
     w = csv.writer(outfile)
     w.writerow(['date'] + regions)
-    i = 0
-    for date in dates:
-        w.writerow([date] + [values[region][i] for region in regions])
-        i += 1
-
-indir = Path('download/newly_sick_table/')
-paths = list(indir.glob('*.csv'))
-paths.sort()
-assert(paths)
-with (paths[-1].open() as csvfile_in,
-      open('out/latest_newly_sick_table.csv', 'w') as csvfile_out):
-    newly_sick_table(csvfile_in, csvfile_out)
+    for (date, by_region) in table.items():
+        w.writerow([date] + [by_region.get(region, '') for region in regions])
+
+def newly_sick_table(infile, outfile):
+    (regions, table) = pivot(infile)
+    write_pivot(regions, table, outfile)
+
+
+# Snapshot history, for the investigation in "ZOE Covid estimates and the
+# 3 day bug".  For each region, a table of nominal date x snapshot,
+# showing how each value changed in successive files.
+
+def write_history(names, history, outdir):
+    os.makedirs(outdir, exist_ok=True)
+    for region in order_regions(history):
+        by_date = history[region]
+        with open(os.path.join(outdir, region + '.csv'), 'w') as outfile:
+            w = csv.writer(outfile)
+            w.writerow(['date'] + names)
+            for date in sorted(by_date):
+                by_name = by_date[date]
+                w.writerow([date] + [by_name.get(name, '') for name in names])
+
+
+def main():
+    indir = Path('download/newly_sick_table/')
+    prefix = 'newly_sick_table_'
+    paths = archive.glob(indir, prefix + '*.csv')
+    paths.sort()
+    assert(paths)
+
+    outdir = Path('out/newly_sick_table/')
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    names = []
+    # region -> date -> name -> perc_users
+    history = {}
+    for path in paths:
+        name = archive.csv_name(path)[len(prefix):-4]
+        names.append(name)
+        with instrument.open_input(path) as csvfile_in:
+            (regions, table) = pivot(csvfile_in)
+
+        out_path = outdir / archive.csv_name(path)
+        if not out_path.exists():
+            with out_path.open('w') as csvfile_out:
+                write_pivot(regions, table, csvfile_out)
+
+        for (date, by_region) in table.items():
+            for (region, value) in by_region.items():
+                by_date = history.setdefault(region, {})
+                by_date.setdefault(date, {})[name] = value
+
+    # The last file
+    with open('out/latest_newly_sick_table.csv', 'w') as csvfile_out:
+        write_pivot(regions, table, csvfile_out)
+
+    write_history(names, history, 'out/newly_sick_table.history/')
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -0,0 +1,132 @@
+# The scripts, as a library.
+#
+#   import nova
+#
+#   with open('download/incidence/incidence_20230301.csv') as f:
+#       (dates, regions) = nova.read_incidence(f)
+#   prevalence = list(nova.calc_prevalence(iter(regions['London'])))
+#
+# None of the scripts do any work when they are imported, so most of them
+# can be imported directly, e.g. "import jump".  But Python can't import
+# the scripts with a dot or a dash in their name, like publish-date-8.py
+# or prevalence.England.py.  This loads them with underscores instead,
+# e.g. nova.publish_date_8, and collects the main functions in one place.
+#
+# Each script still has a main(), which does the same as running it.  The
+# paths are relative to the current directory, as usual.
+#
+# If you call the functions many times in one process, snapshot() saves
+# parsing the same file again.
+
+import importlib.util
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import archive
+import catalogue
+import changes as changes_
+import check_p_from_i
+import jump as jump_
+import partition as partition_
+import prevalence_digest
+import prevalence_from_incidence
+import wilson as wilson_
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+def _load(filename):
+    """Import a script by filename.  Dots and dashes in the name become
+    underscores."""
+    name = filename[:-len('.py')].replace('.', '_').replace('-', '_')
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(name, SCRIPT_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+incidence_England = _load('incidence.England.py')
+logged_unwell = _load('logged-unwell.py')
+prevalence_England = _load('prevalence.England.py')
+prevalence_UK = _load('prevalence.UK.py')
+publish_date = _load('publish-date.py')
+publish_date_2 = _load('publish-date-2.py')
+publish_date_8 = _load('publish-date-8.py')
+split_region = _load('split-region.py')
+
+# changes.py
+changes = changes_.changes
+changes_map = changes_.changes_map
+changes_table = changes_.changes_table
+
+# jump.py
+jump = jump_.jump
+
+# prevalence_from_incidence.py
+read_incidence = prevalence_from_incidence.read_incidence
+calc_prevalence = prevalence_from_incidence.calc_prevalence
+write_prevalence = prevalence_from_incidence.write_prevalence
+prevalence_dir = prevalence_from_incidence.prevalence_dir
+
+# check_p_from_i.py
+read_prevalence = check_p_from_i.read_prevalence
+check_prevalence_from_incidence = check_p_from_i.check_prevalence_from_incidence
+
+# prevalence_digest.py
+parse_file = prevalence_digest.parse_file
+digest_file = prevalence_digest.digest_file
+
+# publish-date-8.py
+pub_history = publish_date_8.pub_history
+
+# prevalence.England.py, prevalence.UK.py
+england = prevalence_England.england
+uk = prevalence_UK.uk
+
+# logged-unwell.py
+one_sick = logged_unwell.one_sick
+
+# wilson.py
+wilson = wilson_.wilson
+
+partition = partition_.partition
+Catalogue = catalogue.Catalogue
+
+
+# Parsed files, most recently used last.
+# (path, parse function) -> ((size, mtime), result)
+_snapshots = OrderedDict()
+SNAPSHOT_CACHE_SIZE = 64
+
+def snapshot(path, parse, mode='r'):
+    """parse(file) for the file at path.  If the same file was parsed
+    before, and has not changed since, returns the same result.
+
+    The result is shared, so don't modify it."""
+    path = os.fspath(path)
+    st = os.stat(path)
+    version = (st.st_size, st.st_mtime_ns)
+    key = (path, parse)
+    cached = _snapshots.get(key)
+    if cached is not None and cached[0] == version:
+        _snapshots.move_to_end(key)
+        return cached[1]
+    with archive.open_data(path, mode) as f:
+        result = parse(f)
+    _snapshots[key] = (version, result)
+    _snapshots.move_to_end(key)
+    while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+        _snapshots.popitem(last=False)
+    return result
+
+def forget():
+    """Empty the snapshot() cache."""
+    _snapshots.clear()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Split a ZOE CSV file into one file per value of some key columns, e.g.
+#
+#   ./partition.py corrected_prevalence_region_trend_20230301.csv UTLA19CD
+#   ./partition.py corrected_prevalence_age_trend_20230301.csv age_group imd
+#
+# This is a generalisation of split-region.py.  It works on any of the
+# files, including the big corrected_prevalence_*_trend_*.csv files that
+# prevalence_digest.py reads.  Then if you only want to look at one UTLA,
+# you only need to load one small file.
+#
+# The input is read once.  Output files are written to
+# out/partition/<input name>/<key columns>/, plus manifest.csv showing the
+# key values, the number of rows and the size of each output file.
+#
+# Output files are named after the key values, joined with '_'.  So that
+# two different keys never get the same name, '%', '_', '/' and control
+# characters in a value are written as %XX (like a URL), and so is a '.' at
+# the start.  An empty value is written as a lone '%'.  The manifest has the
+# values as they are.
+
+import csv
+import functools
+import io
+import os
+import sys
+
+import instrument
+from writer_pool import WriterPool, MAX_OPEN
+
+# The key columns we expect people to use.  Any column will work though.
+KEY_FIELDS = ['region', 'UTLA19CD', 'lad16cd', 'age_group', 'imd']
+
+MANIFEST_FIELDS = ['file', 'rows', 'bytes']
+
+
+# Characters which are written as %XX in file names
+_ESCAPES = {c: f'%{ord(c):02X}'
+            for c in ['%', '_', '/', '\\'] + [chr(i) for i in range(32)]}
+
+# There are only a few different values, and this is called for every row
+@functools.lru_cache(maxsize=None)
+def quote_value(value):
+    """value, as it goes in a file name.  See above."""
+    if not value:
+        return '%'
+    value = ''.join(_ESCAPES.get(c, c) for c in value)
+    if value.startswith('.'):
+        value = '%2E' + value[1:]
+    return value
+
+def partition_key(values, key_values):
+    key = '_'.join(map(quote_value, values))
+    if key not in key_values:
+        key_values[key] = values
+    return key
+
+def _partition_lines(infile, header, key_fields, writers, key_values):
+    # Fast path: the file is simple enough to split on commas.
+    fieldnames = header.decode('utf-8').rstrip('\r\n').split(',')
+    key_indexes = [fieldnames.index(field) for field in key_fields]
+    maxsplit = max(key_indexes) + 1
+
+    for line in infile:
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        if b'"' in line:
+            # Not the simple case.  Parse it properly.
+            row = next(csv.reader([line.decode('utf-8')]))
+            key = partition_key([row[i] for i in key_indexes], key_values)
+            writers.writerow(key, row)
+            continue
+        row = line.split(b',', maxsplit)
+        # The last value still has the line terminator, if it is a key
+        key = partition_key([row[i].decode('utf-8').rstrip('\r\n')
+                             for i in key_indexes],
+                            key_values)
+        # Copy the input line as-is.
+        writers.write(key, line)
+
+def _partition_csv(reader, key_fields, writers, key_values):
+    fieldnames = reader.fieldnames
+    key_indexes = [fieldnames.index(field) for field in key_fields]
+    for row in reader.reader:
+        key = partition_key([row[i] for i in key_indexes], key_values)
+        writers.writerow(key, row)
+
+def partition(infile, out_path, key_fields,
+              manifest=True, max_open=MAX_OPEN):
+    """Split infile (opened in binary mode) into out_path/<key>.csv.
+
+    Returns the WriterPool, so the caller can see the row counts and
+    filenames for each key.
+    """
+    os.makedirs(out_path, exist_ok=True)
+
+    # key -> list of key values
+    key_values = {}
+
+    header = infile.readline()
+    if b'"' not in header:
+        with WriterPool(out_path, header, max_open=max_open) as writers:
+            _partition_lines(infile, header, key_fields, writers, key_values)
+    else:
+        # e.g. "incidence table.csv", which has newlines inside the headers.
+        # These files are small, so don't worry about speed.
+        infile.seek(0)
+        text = io.TextIOWrapper(infile, encoding='utf-8', newline='')
+        reader = csv.DictReader(text)
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator='\n').writerow(reader.fieldnames)
+        header = buf.getvalue().encode('utf-8')
+        with WriterPool(out_path, header, max_open=max_open) as writers:
+            _partition_csv(reader, key_fields, writers, key_values)
+        text.detach()
+
+    if manifest:
+        with open(os.path.join(out_path, 'manifest.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(key_fields + MANIFEST_FIELDS)
+            for key in sorted(writers.filenames):
+                filename = writers.filenames[key]
+                writer.writerow(key_values[key] +
+                                [os.path.basename(filename),
+                                 writers.counts[key],
+                                 os.path.getsize(filename)])
+    return writers
+
+
+def main():
+    args = sys.argv[1:]
+    max_open = MAX_OPEN
+    if len(args) >= 2 and args[0] == '--max-open':
+        max_open = int(args[1])
+        args = args[2:]
+    if len(args) < 2:
+        print("Usage: ./partition.py [--max-open N] input.csv KEY [KEY...]")
+        print()
+        print("Split input.csv into one file per value of the KEY columns.")
+        print(f"Usual KEY columns: {', '.join(KEY_FIELDS)}")
+        print("Output files are written to out/partition/")
+        sys.exit(2)
+
+    filename = args[0]
+    key_fields = args[1:]
+    name = os.path.basename(filename)
+    if name.endswith('.csv'):
+        name = name[:-len('.csv')]
+    out_path = os.path.join('out/partition', name, '_'.join(key_fields))
+    with instrument.open_input(filename, 'rb') as infile:
+        writers = partition(infile, out_path, key_fields, max_open=max_open)
+        instrument.count('rows_parsed', sum(writers.counts.values()))
+    print(f'{out_path}: {len(writers.filenames)} files')
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
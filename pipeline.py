@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+#
+# Run all the scripts, in the right order, and only if their input files
+# have changed since the last run.
+#
+#   ./pipeline.py                  # everything that is out of date
+#   ./pipeline.py --sync           # download new files first (sync.py)
+#   ./pipeline.py jump changes     # just these (and what they depend on)
+#
+# Each stage below lists the data files it reads (glob patterns), the
+# outputs it creates, and the stages which must run before it.  The script
+# and the modules it imports from this directory are inputs too; they are
+# found by reading the import statements, so they can't get out of date.
+# A stage is out of date if any of its outputs are missing, or if the
+# "fingerprint" of its inputs has changed: the name, size and modification
+# time of every input file.
+# The fingerprints from the last successful run are saved in
+# out/pipeline/state.json.
+#
+# Stages which don't depend on each other run at the same time, e.g.
+# jump, changes and publish-date-8 all read download/incidence/ and can
+# run as soon as the download is finished.  The output of each stage is
+# saved in out/pipeline/<stage>.log, instead of mixing it up on the
+# terminal.  If a stage fails, the stages which depend on it are skipped.
+#
+# There is one prevalence_digest stage for each trend file in
+# download/corrected_prevalence/, because each one takes a while.
+
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import archive
+
+PIPELINE_DIR = 'out/pipeline/'
+STATE = 'state.json'
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# name: stage name.
+# command: script and arguments.  The script is run by this python, from
+#          the current directory, like you would run it by hand.
+# inputs: glob patterns, relative to the current directory.  The script and
+#         its modules are added by input_files().
+# outputs: files or directories.
+# after: names of stages which must finish first.
+Stage = namedtuple('Stage', ('name', 'command', 'inputs', 'outputs', 'after'))
+
+TREND_FILES = 'download/corrected_prevalence/corrected_prevalence_*_trend_*.csv'
+
+def fixed_stages():
+    return [
+        Stage('changes', ['changes.py'],
+              ['download/utla_prevalence_map/*.csv',
+               'download/lad_prevalence_map/*.csv',
+               'download-sample/incidence table/*.csv',
+               'download/incidence/*.csv',
+               'download/prevalence_history/*.csv',
+               'download/incidence_history/*.csv'],
+              ['out/changes/'], []),
+        Stage('jump', ['jump.py'],
+              ['download/incidence/*.csv',
+               'download/incidence_history/*.csv',
+               'download/prevalence_history/*.csv',
+               'download/newly_sick_table/*.csv'],
+              ['out/jump/'], []),
+        Stage('publish-date-8', ['publish-date-8.py'],
+              ['download/incidence/*.csv'],
+              ['out/publish-date-8.incidence.England.csv',
+               'out/publish-date-8.incidence.UK.csv'], []),
+        Stage('split-region', ['split-region.py'],
+              ['download/incidence/*.csv',
+               'download/prevalence_history/*.csv'],
+              ['out/publish-date.incidence.region/',
+               'out/latest_incidence.region/',
+               'out/latest_prevalence_history.region/'], []),
+        Stage('prevalence.England', ['prevalence.England.py'],
+              ['download/prevalence_history/*.csv'],
+              ['out/prevalence_history.England/',
+               'out/latest_prevalence_history.England.csv'], []),
+        Stage('prevalence.UK', ['prevalence.UK.py'],
+              ['download/prevalence_history/*.csv'],
+              ['out/prevalence_history.UK/'], []),
+        Stage('prevalence_panel', ['prevalence_panel.py'],
+              ['download/prevalence_history/*.csv'],
+              ['out/prevalence_panel/'], []),
+        Stage('prevalence_from_incidence', ['prevalence_from_incidence.py'],
+              ['download/incidence/*.csv',
+               'download/incidence_history/*.csv'],
+              ['out/prevalence_from_incidence_/',
+               'out/prevalence_from_incidence_history_/'], []),
+        Stage('revisions', ['revisions.py'],
+              ['download/incidence/*.csv'],
+              ['out/revisions/incidence/'], []),
+        Stage('check_p_from_i', ['check_p_from_i.py'],
+              ['download/prevalence_history/*.csv',
+               'out/prevalence_from_incidence_/*.csv',
+               'out/prevalence_from_incidence_history_/*.csv'],
+              ['out/check_p_from_i.txt'], ['prevalence_from_incidence']),
+        Stage('newly_sick_table', ['newly_sick_table.py'],
+              ['download/newly_sick_table/*.csv'],
+              ['out/newly_sick_table/',
+               'out/latest_newly_sick_table.csv',
+               'out/newly_sick_table.history/'], []),
+        Stage('logged-unwell', ['logged-unwell.py'],
+              ['logged-unwell.txt/*.txt'],
+              ['out/logged-unwell.csv'], []),
+        Stage('wilson', ['wilson.py'],
+              ['download-sample/incidence table/*.csv'],
+              ['out/wilson.csv'], []),
+    ]
+
+def digest_stages():
+    """One prevalence_digest stage per trend file, then check_pd and
+    geography, which read all of them."""
+    trend_files = sorted(archive.glob('.', TREND_FILES))
+    stages = []
+    digests = []
+    for path in trend_files:
+        stem = archive.csv_name(path)[:-len('.csv')]
+        name = 'prevalence_digest:' + stem
+        stages.append(Stage(name, ['prevalence_digest.py', str(path)],
+                            [str(path)],
+                            [f'out/prevalence_digest/{stem}/'], []))
+        digests.append(name)
+    if not trend_files:
+        return stages
+    stages.append(Stage('check_pd', ['check_pd.py', '--lad'],
+                        ['out/prevalence_digest/*/utla_8d_average.csv',
+                         'out/prevalence_digest/*/lad_14d_average.csv',
+                         'download/utla_prevalence_map/*.csv',
+                         'download/lad_prevalence_map/*.csv'],
+                        ['out/check_pd/'], digests))
+    stages.append(Stage('geography',
+                        ['geography.py'] + [str(path) for path in trend_files],
+                        [TREND_FILES,
+                         'download/utla_prevalence_map/*.csv',
+                         'download/lad_prevalence_map/*.csv'],
+                        ['out/geography/'], []))
+    return stages
+
+def all_stages():
+    stages = fixed_stages() + digest_stages()
+    names = set(stage.name for stage in stages)
+    for stage in stages:
+        for name in stage.after:
+            assert name in names, f'{stage.name}: unknown stage {name}'
+    return stages
+
+
+def local_imports(path):
+    """The modules in SCRIPT_DIR which the script at path imports."""
+    tree = ast.parse(path.read_bytes(), str(path))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            names.add(node.module)
+    modules = [SCRIPT_DIR / (name + '.py') for name in names]
+    return [module for module in modules if module.exists()]
+
+def modules(script):
+    """The script, and the modules in SCRIPT_DIR it uses, directly or
+    indirectly."""
+    found = set()
+    todo = [SCRIPT_DIR / script]
+    while todo:
+        path = todo.pop()
+        if path not in found:
+            found.add(path)
+            todo.extend(local_imports(path))
+    return found
+
+def input_files(stage):
+    files = modules(stage.command[0])
+    for pattern in stage.inputs:
+        # including compressed files, e.g. *.csv.gz
+        files.update(archive.glob('.', pattern))
+    return sorted(files)
+
+def fingerprint(stage):
+    """A hash of the name, size and modification time of each input,
+    and the command."""
+    h = hashlib.sha1()
+    h.update(repr(stage.command).encode('utf-8'))
+    for path in input_files(stage):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        h.update(f'{path}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8'))
+    return h.hexdigest()
+
+def outputs_exist(stage):
+    return all(os.path.exists(output) for output in stage.outputs)
+
+def is_stale(stage, state):
+    return (not outputs_exist(stage) or
+            state.get(stage.name) != fingerprint(stage))
+
+
+def read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_state(path, state):
+    tmp = str(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp, path)
+
+
+def select(stages, names):
+    """The named stages, and all the stages they depend on."""
+    by_name = {stage.name: stage for stage in stages}
+    wanted = set()
+    def add(name):
+        if name in wanted:
+            return
+        wanted.add(name)
+        for dep in by_name[name].after:
+            add(dep)
+    for name in names:
+        # 'prevalence_digest' means all of them
+        matches = [s for s in by_name if s == name or s.startswith(name + ':')]
+        if not matches:
+            raise ValueError(f'unknown stage: {name}')
+        for match in matches:
+            add(match)
+    return [stage for stage in stages if stage.name in wanted]
+
+def run_stage(stage, logdir):
+    """Run the stage.  Returns the exit status."""
+    script = SCRIPT_DIR / stage.command[0]
+    log_path = Path(logdir) / (stage.name + '.log')
+    with open(log_path, 'wb') as log:
+        result = subprocess.run([sys.executable, str(script)] + stage.command[1:],
+                                stdin=subprocess.DEVNULL,
+                                stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode
+
+def run(stages, jobs=None, force=False, dry_run=False):
+    """Run the stages which are out of date, in dependency order.
+    Returns the names of the stages which failed."""
+    os.makedirs(PIPELINE_DIR, exist_ok=True)
+    state_path = Path(PIPELINE_DIR) / STATE
+    state = read_state(state_path)
+
+    names = set(stage.name for stage in stages)
+    pending = list(stages)
+    done = set()
+    failed = []
+    ran = set()
+    running = {}
+    jobs = jobs or os.cpu_count()
+
+    with ThreadPoolExecutor(jobs) as executor:
+        while pending or running:
+            # Start what we can, of the stages whose dependencies have
+            # finished.  Keep looking until nothing changes, because
+            # skipping an up to date stage can make another one ready.
+            progress = True
+            while progress and len(running) < jobs:
+                progress = False
+                for stage in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    after = [name for name in stage.after if name in names]
+                    if any(name in failed for name in after):
+                        pending.remove(stage)
+                        failed.append(stage.name)
+                        progress = True
+                        print(f'{stage.name}: skipped, because '
+                              f'{", ".join(n for n in after if n in failed)} failed')
+                        continue
+                    if not all(name in done for name in after):
+                        continue
+                    pending.remove(stage)
+                    progress = True
+                    # A stage which ran just now changes the inputs of the
+                    # stages after it, so they are checked again here.
+                    if not (force or any(name in ran for name in after) or
+                            is_stale(stage, state)):
+                        done.add(stage.name)
+                        continue
+                    if dry_run:
+                        print(f'{stage.name}: would run {" ".join(stage.command)}')
+                        done.add(stage.name)
+                        ran.add(stage.name)
+                        continue
+                    print(f'{stage.name}: running')
+                    # Fingerprint the inputs before the stage starts, so a
+                    # file which arrives while it is running is not missed
+                    # next time.
+                    stage_fingerprint = fingerprint(stage)
+                    future = executor.submit(run_stage, stage, PIPELINE_DIR)
+                    running[future] = (stage, stage_fingerprint, time.monotonic())
+
+            if not running:
+                if pending:
+                    raise ValueError('circular dependency: ' +
+                                     ', '.join(stage.name for stage in pending))
+                continue
+            (finished, _) = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                (stage, stage_fingerprint, start) = running.pop(future)
+                elapsed = time.monotonic() - start
+                status = future.result()
+                if status == 0:
+                    print(f'{stage.name}: done in {elapsed:.1f}s')
+                    done.add(stage.name)
+                    ran.add(stage.name)
+                    state[stage.name] = stage_fingerprint
+                    write_state(state_path, state)
+                else:
+                    print(f'{stage.name}: FAILED with status {status}, '
+                          f'see {PIPELINE_DIR}{stage.name}.log')
+                    failed.append(stage.name)
+    return failed
+
+
+def usage():
+    print("Usage: ./pipeline.py [--sync [--source DIR]] [--jobs N] [--force]")
+    print("                     [--dry-run] [--list] [STAGE...]")
+    print()
+    print("Run the scripts whose input files have changed since the last run.")
+    print("--sync:     run sync.py first, to download new files.")
+    print("--jobs N:   run up to N stages at once.  Default: number of CPUs.")
+    print("--force:    run the stages even if they are up to date.")
+    print("--dry-run:  show what would be run.")
+    print("--list:     list the stages, and whether they are up to date.")
+    sys.exit(2)
+
+def main():
+    args = sys.argv[1:]
+    sync = False
+    source = None
+    jobs = None
+    force = False
+    dry_run = False
+    list_stages = False
+    names = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--sync':
+            sync = True
+        elif arg == '--source' and args:
+            source = args.pop(0)
+        elif arg == '--jobs' and args:
+            jobs = int(args.pop(0))
+        elif arg == '--force':
+            force = True
+        elif arg == '--dry-run':
+            dry_run = True
+        elif arg == '--list':
+            list_stages = True
+        elif arg.startswith('-'):
+            usage()
+        else:
+            names.append(arg)
+    if source and not sync:
+        usage()
+
+    if sync and not dry_run:
+        command = [sys.executable, str(SCRIPT_DIR / 'sync.py')]
+        if source:
+            command += ['--source', source]
+        if subprocess.run(command).returncode != 0:
+            sys.exit('sync.py failed')
+
+    stages = all_stages()
+    if names:
+        try:
+            stages = select(stages, names)
+        except ValueError as e:
+            print(e)
+            usage()
+
+    if list_stages:
+        state = read_state(Path(PIPELINE_DIR) / STATE)
+        for stage in stages:
+            mark = 'stale' if is_stale(stage, state) else 'ok'
+            after = f'  (after {", ".join(stage.after)})' if stage.after else ''
+            print(f'{mark:6} {stage.name}{after}')
+        return
+
+    failed = run(stages, jobs=jobs, force=force, dry_run=dry_run)
+    if failed:
+        sys.exit(f'Failed: {", ".join(failed)}')
+
+if __name__ == '__main__':
+    main()
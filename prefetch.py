@@ -0,0 +1,92 @@
+# Read the next few input files in the background, while the current one
+# is being processed.
+#
+# jump.py, publish-date-8.py and changes.py go through hundreds of files,
+# one after the other.  On a local disk that is fine.  But my archive is on
+# a network mount, and there most of the time was spent waiting for the
+# next file to be read.  Python can read in a thread while the main thread
+# parses, because file reads release the GIL.
+#
+#   for (path, data) in prefetch.read_ahead(paths):
+#       ...                                 # data is the bytes of the file
+#
+#   for (path, f) in prefetch.open_ahead(paths):
+#       ...                                 # f is like open(path)
+#
+# The files are yielded in the same order as paths.  Up to DEPTH files are
+# read ahead, and up to MAX_BYTES (by file size) are held in memory at once.
+# A file bigger than MAX_BYTES is still read, but then nothing else is read
+# ahead at the same time.
+#
+# The defaults can be changed with environment variables, e.g.
+#
+#   PREFETCH_DEPTH=16 PREFETCH_MB=512 ./jump.py
+#   PREFETCH_DEPTH=0 ./jump.py              # read in the main thread only
+
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import archive
+
+DEPTH = int(os.environ.get('PREFETCH_DEPTH', 4))
+MAX_BYTES = int(os.environ.get('PREFETCH_MB', 64)) * 1024 * 1024
+
+
+def read_file(path):
+    with archive.open_data(path, 'rb') as f:
+        return f.read()
+
+def read_ahead(paths, read=read_file, depth=None, max_bytes=None,
+               size=os.path.getsize):
+    """Yields (path, read(path)) for each path, in order, reading ahead in
+    background threads.
+
+    size(path) is how much memory read(path) will use, for max_bytes.
+    """
+    if depth is None:
+        depth = DEPTH
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    paths = list(paths)
+    if depth <= 0:
+        for path in paths:
+            yield (path, read(path))
+        return
+
+    with ThreadPoolExecutor(depth) as executor:
+        # (path, size, future), in order
+        pending = deque()
+        held = 0
+        i = 0
+        try:
+            while i < len(paths) or pending:
+                while i < len(paths) and len(pending) < depth:
+                    path = paths[i]
+                    try:
+                        n = size(path)
+                    except OSError:
+                        # read() will raise the error, in the right place
+                        n = 0
+                    if pending and held + n > max_bytes:
+                        break
+                    pending.append((path, n, executor.submit(read, path)))
+                    held += n
+                    i += 1
+                (path, n, future) = pending.popleft()
+                yield (path, future.result())
+                held -= n
+        finally:
+            # If the caller stops early, don't read the rest.
+            for (_, _, future) in pending:
+                future.cancel()
+
+def open_ahead(paths, mode='r', depth=None, max_bytes=None, **kwargs):
+    """Like read_ahead(), but yields (path, file).  The file is in memory,
+    and works like open(path, mode, **kwargs), including seek()."""
+    for (path, data) in read_ahead(paths, depth=depth, max_bytes=max_bytes):
+        f = io.BytesIO(data)
+        if 'b' not in mode:
+            f = io.TextIOWrapper(f, **kwargs)
+        yield (path, f)
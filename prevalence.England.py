@@ -7,6 +7,8 @@
 #    instead of using bash to run the python script hundreds of times.
 #  3. However if the order is reversed, the loop seems to save about
 #     half of the time, and the cruder parsing seems to save half again.
+#  4. The crude parsing is now in fastcsv.py, which also checks that
+#     there are no quotes, so the other scripts can use it too.
 
 # Limitations:
 #
@@ -29,18 +31,20 @@ import csv
 from pathlib import Path
 import os
 import errno
+import sys
+import archive
+import fastcsv
+import instrument
 
 def england(input_file, output_file):
     england = dict()
 
-    head = next(input_file)
-    head = head.rstrip()
-    heads = head.split(',', 3)
+    rows = fastcsv.reader(input_file)
+    heads = next(rows)
     assert heads[:3] == ['date', 'region', 'active_cases']
 
-    for line in input_file:
-        line = line.rstrip()
-        (date, region, active_cases) = line.split(',', 3)[:3]
+    for row in rows:
+        (date, region, active_cases) = row[:3]
         if region == 'England':
             sys.exit('Already shows England prevalence')
         if region in ['Wales', 'Scotland', 'Northern Ireland']:
@@ -56,26 +60,35 @@ def england(input_file, output_file):
         writer.writerow([date, england[date]])
 
 
-outdir = Path('out/prevalence_history.England/')
-outdir.mkdir(parents=True, exist_ok=True)
+def england_dir(indir, outdir):
+    """Write England totals for each file in indir which is not already
+    in outdir.  Returns the output path for the latest file."""
+    outdir.mkdir(parents=True, exist_ok=True)
 
-indir = Path('download/prevalence_history/')
-paths = list(indir.glob('*.csv'))
-paths.sort()
-for path in paths:
-    filename = path.name
-    out_path = outdir / filename
-    if out_path.exists():
-        continue
-    with (path.open() as csvfile_in,
-          out_path.open('w') as csvfile_out):
-        england(csvfile_in, csvfile_out)
+    paths = archive.glob(indir, '*.csv')
+    paths.sort()
+    for path in paths:
+        filename = archive.csv_name(path)
+        out_path = outdir / filename
+        if out_path.exists():
+            continue
+        with (instrument.open_input(path) as csvfile_in,
+              out_path.open('w') as csvfile_out):
+            england(csvfile_in, csvfile_out)
+    return out_path
+
+def main():
+    out_path = england_dir(Path('download/prevalence_history/'),
+                           Path('out/prevalence_history.England/'))
 
+    latest = 'out/latest_prevalence_history.England.csv'
+    try:
+        os.unlink(latest)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise e
+    os.symlink('../' + str(out_path), latest)
 
-latest = 'out/latest_prevalence_history.England.csv'
-try:
-    os.unlink(latest)
-except IOError as e:
-    if e.errno != errno.ENOENT:
-        raise e
-os.symlink('../' + str(out_path), latest)
+if __name__ == '__main__':
+    instrument.init()
+    main()
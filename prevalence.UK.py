@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import csv
+import sys
 from pathlib import Path
+import archive
+import instrument
 
 def uk(input_file, output_file):
     uk = dict()
@@ -27,16 +30,25 @@ def uk(input_file, output_file):
     for date in dates:
         writer.writerow([date, uk[date]])
 
-outdir = Path('out/prevalence_history.UK/')
-outdir.mkdir(parents=True, exist_ok=True)
-
-indir = Path('download/prevalence_history/')
-paths = list(indir.glob('*.csv'))
-for path in paths:
-    filename = path.name
-    out_path = outdir / filename
-    if out_path.exists():
-        continue
-    with (path.open() as csvfile_in,
-          out_path.open('w') as csvfile_out):
-        uk(csvfile_in, csvfile_out)
+def uk_dir(indir, outdir):
+    """Write UK totals for each file in indir which is not already in
+    outdir."""
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    paths = archive.glob(indir, '*.csv')
+    for path in paths:
+        filename = archive.csv_name(path)
+        out_path = outdir / filename
+        if out_path.exists():
+            continue
+        with (instrument.open_input(path) as csvfile_in,
+              out_path.open('w') as csvfile_out):
+            uk(csvfile_in, csvfile_out)
+
+def main():
+    uk_dir(Path('download/prevalence_history/'),
+           Path('out/prevalence_history.UK/'))
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -9,11 +9,20 @@
 # where the date value never decreases.
 
 import csv
+import multiprocessing
 import os
 import os.path
+import shutil
 import sys
+import tempfile
+import zlib
 from collections import namedtuple
 
+import archive
+import fastcsv
+import instrument
+from writer_pool import WriterPool
+
 if sys.version_info < (3, 7):
     sys.exit('This script is designed to run on python 3.7 or higher')
 
@@ -26,31 +35,94 @@ KEY_FIELDS = [
     'age_group',    # age group
     'imd']          # index of material deprivation (1 to 3)
 Keys = namedtuple('Keys', KEY_FIELDS)
-Record = namedtuple('Record', ('keys', 'values'))
-
-
-def parse_values(row):
-    values = {}
-
-    def read_float(field):
-        assert field in row
-        assert row[field] != ''
-        value = float(row[field])
-        assert value >= 0.0
-        values[field] = value
 
-    def read_int(field):
-        assert field in row
-        assert row[field] != ''
-        value = float(row[field])
-        value_int = int(value)
-        assert value_int == value
-        assert value_int >= 0
-        values[field] = value_int
+# The values in each row, in this order.  Each row is parsed into a plain
+# list, not a dict, and the digests add up lists with the same layout.
+# On the big trend files, allocating a dict per row (or six) was where
+# most of the time went.
+VALUE_FIELDS = [
+    'respondent_count',
+    'unhealthy_count',
+    'unhealthy_unk_count',
+    'predicted_covid_positive_count',
+    'predicted_covid_positive_prob',
+    'population',
+    'corrected_covid_positive',
+    'corrected_covid_positive_prob',
+    'factor',
+    'factor_prob',
+    '+ symptom_based']
+(RESPONDENT_COUNT,
+ UNHEALTHY_COUNT,
+ UNHEALTHY_UNK_COUNT,
+ PREDICTED_COVID_POSITIVE_COUNT,
+ PREDICTED_COVID_POSITIVE_PROB,
+ POPULATION,
+ CORRECTED_COVID_POSITIVE,
+ CORRECTED_COVID_POSITIVE_PROB,
+ FACTOR,
+ FACTOR_PROB,
+ SYMPTOM_BASED) = range(len(VALUE_FIELDS))
+
+# Values which are added up by add_values().  factor and factor_prob are
+# not, they are ratios.  A total keeps them from its first row.
+SUM_INDEXES = [i for (i, field) in enumerate(VALUE_FIELDS)
+               if field not in ['factor', 'factor_prob']]
+
+# The columns of the input file which we read.  Their positions are found
+# once, from the header.
+INPUT_FIELDS = KEY_FIELDS + [
+    'gender',
+    'respondent_count',
+    'unhealthy_count',
+    'unhealthy_unk_count',
+    'predicted_covid_positive_count',
+    'predicted_covid_positive_prob',
+    'population',
+    'corrected_covid_positive',
+    'corrected_covid_positive_prob',
+    'factor',
+    'factor_prob']
+Columns = namedtuple('Columns', INPUT_FIELDS)
+
+# keys: Keys
+# lsoa_count: the 'gender' field, see Digest.add()
+# values: list, in the order of VALUE_FIELDS
+Record = namedtuple('Record', ('keys', 'lsoa_count', 'values'))
+
+
+def find_columns(header):
+    """The position of each of INPUT_FIELDS in the header row."""
+    missing = [field for field in INPUT_FIELDS if field not in header]
+    if missing:
+        raise Exception(f'missing fields: {missing}')
+    return Columns(*(header.index(field) for field in INPUT_FIELDS))
+
+def read_float(s):
+    assert s != ''
+    value = float(s)
+    assert value >= 0.0
+    return value
+
+def read_int(s):
+    assert s != ''
+    value = float(s)
+    value_int = int(value)
+    assert value_int == value
+    assert value_int >= 0
+    return value_int
+
+def values_dict(values):
+    """values, as a dict.  For error messages."""
+    return dict(zip(VALUE_FIELDS, values))
+
+
+def parse_values(row, c):
+    """Returns (lsoa_count, values) for a row, given the Columns c."""
 
     # We deal with this field later.  Don't worry about it in this function.
     # Spoiler: it is nothing to do with gender.
-    read_int('gender')
+    lsoa_count = read_int(row[c.gender])
 
     # The number of users who responded in the last 7 days.
     # This number of days is consistent with:
@@ -60,34 +132,34 @@ def parse_values(row):
     #  3. Comparing the unhealthy/respondent fraction to the daily numbers in
     #     newly_sick_table*.csv, around the sharp edges from the anomaly here:
     #     https://sourcejedi.github.io/2022/08/24/zoe-covid-3-day-bug.html
-    read_int('respondent_count')
+    respondent_count = read_int(row[c.respondent_count])
 
     # The number of users in the last 7 days, who logged feeling "unwell"
     # in their most recent response.
-    read_int('unhealthy_count')
+    unhealthy_count = read_int(row[c.unhealthy_count])
 
     # Used in u_fraction (below).  Does not directly correspond to
     # official explanations.
-    read_int('unhealthy_unk_count')
+    unhealthy_unk_count = read_int(row[c.unhealthy_unk_count])
 
     # The number of unwell responders who are predicted to have covid,
     # based on a symptom model.
-    read_int('predicted_covid_positive_count')
+    predicted_covid_positive_count = read_int(row[c.predicted_covid_positive_count])
 
     # *_prob fields feel like red herrings.  We can see some relationships,
     # but I can't connect them to anything outside this file.
-    read_float('predicted_covid_positive_prob')
+    predicted_covid_positive_prob = read_float(row[c.predicted_covid_positive_prob])
 
     # Overall population for this strata, from census or whatever.
     # These are treated as fixed, across the whole time series.
-    read_int('population')
+    population = read_int(row[c.population])
 
     # (In theory you could have issues e.g. if the population increased.
     #  I guess you would discard supernumerary respondents, selected randomly.)
-    assert values['respondent_count'] <= values['population']
+    assert respondent_count <= population
 
-    assert values['unhealthy_count'] <= values['respondent_count']
-    assert values['unhealthy_unk_count'] <= values['unhealthy_count']
+    assert unhealthy_count <= respondent_count
+    assert unhealthy_unk_count <= unhealthy_count
 
     # I can think of one hypothesis for unhealthy_unk_count.  In June 2022,
     # ZOE transitioned to a new reporting method.  This requires setting up a
@@ -134,18 +206,18 @@ def parse_values(row):
     # opt in to the new method?  It's as if that number is somehow not
     # available, and we're using a crude approximation instead.
 
-    if values['unhealthy_count']:
-        u_fraction = values['unhealthy_unk_count'] / values['unhealthy_count']
+    if unhealthy_count:
+        u_fraction = unhealthy_unk_count / unhealthy_count
     else:
         u_fraction = 1
 
     # Until 2022-06-22, unhealthy_unk_count is usually the same as
     # unhealthy_count, or one less.
-    if row['date'] < '20220622':
-        if values['unhealthy_count'] >= 10:
+    if row[c.date] < '20220622':
+        if unhealthy_count >= 10:
             assert u_fraction >= 0.8
 
-    assert values['predicted_covid_positive_count'] <= values['unhealthy_unk_count']
+    assert predicted_covid_positive_count <= unhealthy_unk_count
 
     # Estimate of symptomatic prevalence in the population.  If you look at
     # corrected_prevalence_region_*.csv and add it up for a region, it matches
@@ -176,20 +248,20 @@ def parse_values(row):
     # the daily report says "Estimate not available", and
     # this cuts a small notch in the UK total prevalence graph on the website.
 
-    if values['unhealthy_unk_count'] == 0 or row['factor'] == 'inf':
-        assert row['corrected_covid_positive'] == ''
-        values['corrected_covid_positive'] = 0.0
+    if unhealthy_unk_count == 0 or row[c.factor] == 'inf':
+        assert row[c.corrected_covid_positive] == ''
+        corrected_covid_positive = 0.0
     else:
-        read_float('corrected_covid_positive')
+        corrected_covid_positive = read_float(row[c.corrected_covid_positive])
 
     # It is not bounded by population, at least for individual strata.
-    #assert values['corrected_covid_positive'] <= values['population']
+    #assert corrected_covid_positive <= population
 
-    if values['unhealthy_unk_count'] == 0:
-        assert row['corrected_covid_positive_prob'] == ''
-        values['corrected_covid_positive_prob'] = 0.0
+    if unhealthy_unk_count == 0:
+        assert row[c.corrected_covid_positive_prob] == ''
+        corrected_covid_positive_prob = 0.0
     else:
-        read_float('corrected_covid_positive_prob')
+        corrected_covid_positive_prob = read_float(row[c.corrected_covid_positive_prob])
 
     # If you look at rows with the same (date, region) in
     # corrected_prevalence_region_*.csv, factor is always the same.
@@ -205,64 +277,77 @@ def parse_values(row):
     # corrected_covid_positive, factor, and factor_prob.
     #
     # The change in factor is proportional to the change in factor_prob.
-    read_float('factor')
-    read_float('factor_prob')
+    factor = read_float(row[c.factor])
+    factor_prob = read_float(row[c.factor_prob])
 
-    if values['predicted_covid_positive_count'] == 0 or values['population'] == 0:
+    if predicted_covid_positive_count == 0 or population == 0:
         # This includes all cases where respondent_count == 0, or
         # u_fraction == 0.  In these cases corrected_covid_positive
         # should be unknown, indeed the file shows it as empty (not 0.0).
         # However, ZOE *do* treat it as 0.0 when adding up;
         # this is simplest to implement but could cause issues.
-        assert values['corrected_covid_positive'] == 0
+        assert corrected_covid_positive == 0
     else:
         # factor == (corrected_covid_positive / predicted_covid_positive_count) *
         #           (respondent_count * u_fraction / population)
-        assert abs(values['factor'] -
-                   (values['corrected_covid_positive'] / values['predicted_covid_positive_count']) *
-                   (values['respondent_count'] * u_fraction / values['population'])) < 1e-11
+        assert abs(factor -
+                   (corrected_covid_positive / predicted_covid_positive_count) *
+                   (respondent_count * u_fraction / population)) < 1e-11
 
-    if values['respondent_count'] == 0 or u_fraction == 0 or values['population'] == 0:
+    if respondent_count == 0 or u_fraction == 0 or population == 0:
         # So predicted_covid_positive_prob is linked to respondent_count,
         # even though it can be higher (and it can be over 10 times the
         # value of unhealthy_count).
-        assert values['predicted_covid_positive_prob'] == 0
-        assert values['corrected_covid_positive_prob'] == 0
+        assert predicted_covid_positive_prob == 0
+        assert corrected_covid_positive_prob == 0
     else:
-        assert abs(values['predicted_covid_positive_prob'] / (values['respondent_count'] * u_fraction) -
-                   values['corrected_covid_positive_prob'] / values['population']) < 1e-11
+        assert abs(predicted_covid_positive_prob / (respondent_count * u_fraction) -
+                   corrected_covid_positive_prob / population) < 1e-11
 
     # Following the pattern above, here's how you scale
     # predicted_covid_positive_count up to the whole population.
-    values['+ symptom_based'] = 0
-    if values['predicted_covid_positive_count'] != 0:        
-        values['+ symptom_based'] = (values['predicted_covid_positive_count'] *
-            values['population'] / (values['respondent_count'] * u_fraction))
-    
-    return values
+    symptom_based = 0
+    if predicted_covid_positive_count != 0:
+        symptom_based = (predicted_covid_positive_count *
+            population / (respondent_count * u_fraction))
+
+    return (lsoa_count,
+            [respondent_count,
+             unhealthy_count,
+             unhealthy_unk_count,
+             predicted_covid_positive_count,
+             predicted_covid_positive_prob,
+             population,
+             corrected_covid_positive,
+             corrected_covid_positive_prob,
+             factor,
+             factor_prob,
+             symptom_based])
 
 
 def parse_file(infile):
-    csv_in = csv.DictReader(infile)
+    csv_in = fastcsv.reader(infile)
+    header = next(csv_in)
+    c = find_columns(header)
+    key_columns = c[:len(KEY_FIELDS)]
+    intern = sys.intern
     for row in csv_in:
-        keys = Keys(*(sys.intern(row[key]) for key in KEY_FIELDS))
+        keys = Keys(*[intern(row[i]) for i in key_columns])
         try:
-            values = parse_values(row)
-        except AssertionError:
+            (lsoa_count, values) = parse_values(row, c)
+        except (AssertionError, ValueError):
             print("ERROR parsing or checking row:")
-            print(row)
+            print(dict(zip(header, row)))
             print()
             raise
-    
-        yield Record(keys, values)
+
+        yield Record(keys, lsoa_count, values)
 
 def add_values(a, b):
-    for (key, value) in b.items():
-        if key in ['factor', 'factor_prob']:
-            if a[key] != b[key]:
-                a[key] == ''
-        else:
-            a[key] = a[key] + b[key]
+    """Add the values b to the totals a, in place.  factor and factor_prob
+    keep the value from a."""
+    for i in SUM_INDEXES:
+        a[i] += b[i]
 
 # https://www.mikulskibartosz.name/wilson-score-in-python-example/
 from math import sqrt
@@ -275,37 +360,36 @@ def wilson(p, n, z = 1.96):
     upper_bound = (centre_adjusted_probability + z*adjusted_standard_deviation) / denominator
     return (lower_bound, upper_bound)
 
-def main(infile, name):
-    name = os.path.basename(filename)
-    if name.endswith('.csv'):
-        name = name[:-len('.csv')]
-
-    # Nested dictionaries: date -> region -> values
-    digest_region = {}
-    # date -> age_group -> values
-    digest_age = {}
-    # (region, utla) -> date -> values
-    digest_utla = {}
-    # (region, lad) -> date -> values
-    # Note ZOE data says there are 3 LAD's that belong to more than one UTLA.
-    # I assume they resolve this in the simplest possible way as implied here.
-    # I haven't checked, but it won't make much difference.
-    digest_lad = {}
-    # (date, imd) -> values
-    digest_imd = {}
-    # (date, age, imd) -> values
-    digest_age_imd = {}
-    # (region, utla, lad, imd) -> lsoa_count
-    digest_lsoa = {}
-    # (region, utla, date) -> total population of strata in which
-    # corrected_covid_postive_count is well-defined, which requires
-    # unhealthy_unk_count > 0.  When there is no information,
-    # ZOE assume zero cases.
-    digest_utla_defined_pop = {}
-    # (region, date) -> defined_pop
-    digest_region_defined_pop = {}
-
-    for (keys, values) in parse_file(infile):
+class Digest:
+    def __init__(self):
+        # Nested dictionaries: date -> region -> values
+        self.region = {}
+        # date -> age_group -> values
+        self.age = {}
+        # (region, utla) -> date -> values
+        self.utla = {}
+        # (region, lad) -> date -> values
+        # Note ZOE data says there are 3 LAD's that belong to more than one UTLA.
+        # I assume they resolve this in the simplest possible way as implied here.
+        # I haven't checked, but it won't make much difference.
+        self.lad = {}
+        # (date, imd) -> values
+        self.imd = {}
+        # (date, age, imd) -> values
+        self.age_imd = {}
+        # (region, utla, lad, imd) -> lsoa_count
+        self.lsoa = {}
+        # (region, utla, date) -> total population of strata in which
+        # corrected_covid_postive_count is well-defined, which requires
+        # unhealthy_unk_count > 0.  When there is no information,
+        # ZOE assume zero cases.
+        self.utla_defined_pop = {}
+        # (region, date) -> defined_pop
+        self.region_defined_pop = {}
+
+        self.value_fields = VALUE_FIELDS
+
+    def add(self, keys, lsoa_count, values):
         # The column labeled 'gender' obeys the rule defined below.
         # Note this means it is invariant by date.
         #
@@ -313,319 +397,632 @@ def main(infile, name):
         # for each (region, utla, lad, imd).  The IMD of each ZOE user
         # is estimated from their LSOA.
         keys_lsoa = (keys.region, keys.UTLA19CD, keys.lad16cd, keys.imd)
-        lsoa_count = values['gender']
 
-        v = digest_lsoa.get(keys_lsoa, None)
+        v = self.lsoa.get(keys_lsoa, None)
         if v is None:
             v = lsoa_count
-            digest_lsoa[keys_lsoa] = v
+            self.lsoa[keys_lsoa] = v
         else:
             if v != lsoa_count:
                 print ("Inconsistent value in field 'gender' (which is not gender)")
                 print ("keys = ", keys)
-                print ("values = ", values)
+                print ("value = ", lsoa_count)
                 print ("Expected value = ", v)
                 sys.exit(1)
-        # Get rid of it.
-        del values['gender']
 
         keys_utla_date = (keys.region, keys.UTLA19CD, keys.date)
-        v = digest_utla_defined_pop.get(keys_utla_date, None)
+        v = self.utla_defined_pop.get(keys_utla_date, None)
         if v is None:
             v = 0
-            digest_utla_defined_pop[keys_utla_date] = v
-        if values['unhealthy_unk_count'] > 0:
-            v += values['population']
-            digest_utla_defined_pop[keys_utla_date] = v
+            self.utla_defined_pop[keys_utla_date] = v
+        if values[UNHEALTHY_UNK_COUNT] > 0:
+            v += values[POPULATION]
+            self.utla_defined_pop[keys_utla_date] = v
 
         keys_region_date = (keys.region, keys.date)
-        v = digest_region_defined_pop.get(keys_region_date, None)
+        v = self.region_defined_pop.get(keys_region_date, None)
         if v is None:
             v = 0
-            digest_region_defined_pop[keys_region_date] = v
-        if values['unhealthy_unk_count'] > 0:
-            v += values['population']
-            digest_region_defined_pop[keys_region_date] = v
+            self.region_defined_pop[keys_region_date] = v
+        if values[UNHEALTHY_UNK_COUNT] > 0:
+            v += values[POPULATION]
+            self.region_defined_pop[keys_region_date] = v
 
-        v = digest_region.get(keys.date, None)
+        v = self.region.get(keys.date, None)
         if v is None:
             v = {}
-            digest_region[keys.date] = v
+            self.region[keys.date] = v
         v2 = v.get(keys.region)
         if v2 is None:
-            v2 = dict(values)
+            v2 = list(values)
             v[keys.region] = v2
         else:
             add_values(v2, values)
 
-        v = digest_age.get(keys.date, None)
+        v = self.age.get(keys.date, None)
         if v is None:
             v = {}
-            digest_age[keys.date] = v
+            self.age[keys.date] = v
         v2 = v.get(keys.age_group)
         if v2 is None:
-            v2 = dict(values)
+            v2 = list(values)
             v[keys.age_group] = v2
         else:
             add_values(v2, values)
 
         keys_utla = (keys.region, keys.UTLA19CD)
-        v = digest_utla.get(keys_utla, None)
+        v = self.utla.get(keys_utla, None)
         if v is None:
             v = {}
-            digest_utla[keys_utla] = v
+            self.utla[keys_utla] = v
         v2 = v.get(keys.date, None)
         if v2 is None:
-            v2 = dict(values)
+            v2 = list(values)
             v[keys.date] = v2
         else:
             add_values(v2, values)
 
         keys_lad = (keys.region, keys.lad16cd)
-        v = digest_lad.get(keys_lad, None)
+        v = self.lad.get(keys_lad, None)
         if v is None:
             v = {}
-            digest_lad[keys_lad] = v
+            self.lad[keys_lad] = v
         v2 = v.get(keys.date, None)
         if v2 is None:
-            v2 = dict(values)
+            v2 = list(values)
             v[keys.date] = v2
         else:
             add_values(v2, values)
 
         keys_imd = (keys.date, keys.imd)
-        v = digest_imd.get(keys_imd, None)
+        v = self.imd.get(keys_imd, None)
         if v is None:
-            v = dict(values)
-            digest_imd[keys_imd] = v
+            v = list(values)
+            self.imd[keys_imd] = v
         else:
             add_values(v, values)
 
         keys_age_imd = (keys.date, keys.age_group, keys.imd)
-        v = digest_age_imd.get(keys_age_imd, None)
+        v = self.age_imd.get(keys_age_imd, None)
         if v is None:
-            v = dict(values)
-            digest_age_imd[keys_age_imd] = v
+            v = list(values)
+            self.age_imd[keys_age_imd] = v
         else:
             add_values(v, values)
 
-    value_fields = list(values.keys())
-    ZERO_VALUES = {field:0 for field in value_fields}
-
-    outdir = f'out/prevalence_digest/{name}/'
-    os.makedirs(outdir, exist_ok=True)
-
-    first_by_age = next(iter(digest_age.values()))
+    def merge(self, other):
+        """Add in the digest of another set of rows.
+
+        The rows must not overlap, e.g. they come from different UTLAs.
+        Only the small digests are merged, not utla or lad.
+        """
+        def merge_nested(a, b):
+            for (k1, by_k2) in b.items():
+                v = a.get(k1)
+                if v is None:
+                    a[k1] = by_k2
+                    continue
+                for (k2, values) in by_k2.items():
+                    v2 = v.get(k2)
+                    if v2 is None:
+                        v[k2] = values
+                    else:
+                        add_values(v2, values)
+
+        def merge_flat(a, b):
+            for (k, values) in b.items():
+                v = a.get(k)
+                if v is None:
+                    a[k] = values
+                else:
+                    add_values(v, values)
+
+        def merge_count(a, b):
+            for (k, count) in b.items():
+                a[k] = a.get(k, 0) + count
+
+        merge_nested(self.region, other.region)
+        merge_nested(self.age, other.age)
+        merge_flat(self.imd, other.imd)
+        merge_flat(self.age_imd, other.age_imd)
+        merge_count(self.region_defined_pop, other.region_defined_pop)
+        self.lsoa.update(other.lsoa)
+
+
+def digest_file(infile):
+    digest = Digest()
+    rows = 0
+    for (keys, lsoa_count, values) in parse_file(infile):
+        digest.add(keys, lsoa_count, values)
+        rows += 1
+    instrument.count('rows_parsed', rows)
+    return digest
+
+
+def write_digest(digest, name, outdir):
+    """Write the small digests, and check them."""
+    value_fields = digest.value_fields
+    ZERO_VALUES = [0] * len(value_fields)
+
+    first_by_age = next(iter(digest.age.values()))
     age_groups = list(first_by_age.keys())
 
     with open(outdir + 'age.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date', 'age_group'] + value_fields +
                          ['+ response_rate'])
-        for (date, by_age) in digest_age.items():
+        for (date, by_age) in digest.age.items():
             for (age_group, values) in by_age.items():
-                response_rate = values['respondent_count'] / values['population']
-                csv_out.writerow([date, age_group] + list(values.values()) + [response_rate])
+                response_rate = values[RESPONDENT_COUNT] / values[POPULATION]
+                csv_out.writerow([date, age_group] + values + [response_rate])
 
     with open(outdir + 'age_group_to_covid_rate.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date'] + age_groups)
-        for (date, by_age) in digest_age.items():
-            covid_rates = [values['corrected_covid_positive'] / values['population']
+        for (date, by_age) in digest.age.items():
+            covid_rates = [values[CORRECTED_COVID_POSITIVE] / values[POPULATION]
                            for values in by_age.values()]
             csv_out.writerow([date] + covid_rates)
 
     with open(outdir + 'age_group_to_u_fraction.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date'] + age_groups)
-        for (date, by_age) in digest_age.items():
-            u_fractions = [values['unhealthy_unk_count'] / values['unhealthy_count']
+        for (date, by_age) in digest.age.items():
+            u_fractions = [values[UNHEALTHY_UNK_COUNT] / values[UNHEALTHY_COUNT]
                            for values in by_age.values()]
             csv_out.writerow([date] + u_fractions)
 
     with open(outdir + 'age_group_to_response_rate.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date'] + age_groups)
-        for (date, by_age) in digest_age.items():
-            response_rates = [values['respondent_count'] / values['population']
+        for (date, by_age) in digest.age.items():
+            response_rates = [values[RESPONDENT_COUNT] / values[POPULATION]
                               for values in by_age.values()]
             csv_out.writerow([date] + response_rates)
 
     if name.startswith('corrected_prevalence_age_trend_'):
-        for (date, by_age) in digest_age.items():
+        for (date, by_age) in digest.age.items():
             for (age_group, values) in by_age.items():
                 try:
-                    if values['factor'] == float('inf'):
+                    if values[FACTOR] == float('inf'):
                         continue
 
-                    assert values['corrected_covid_positive'] <= values['population']
+                    assert values[CORRECTED_COVID_POSITIVE] <= values[POPULATION]
 
-                    assert abs(values['factor'] -
-                        (values['corrected_covid_positive'] / values['+ symptom_based'])) < 1e-11
+                    assert abs(values[FACTOR] -
+                        (values[CORRECTED_COVID_POSITIVE] / values[SYMPTOM_BASED])) < 1e-11
 
-                    assert abs(values['factor_prob'] -
-                        (values['corrected_covid_positive'] / values['corrected_covid_positive_prob'])) < 1e-11
+                    assert abs(values[FACTOR_PROB] -
+                        (values[CORRECTED_COVID_POSITIVE] / values[CORRECTED_COVID_POSITIVE_PROB])) < 1e-11
                 except AssertionError:
                     print ('Inconsistent values for age_group: ', age_group, date)
-                    print (values)
+                    print (values_dict(values))
                     raise
 
     with open(outdir + 'region.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date', 'region'] + value_fields +
                          ['+ defined_population_fraction'])
-        for (date, by_region) in digest_region.items():
-            en = dict(ZERO_VALUES)
-            uk = dict(ZERO_VALUES)
+        for (date, by_region) in digest.region.items():
+            en = list(ZERO_VALUES)
+            uk = list(ZERO_VALUES)
             for (region, values) in by_region.items():
                 key = (region, date)
-                defined_pop_fraction = digest_region_defined_pop[key] / values['population']
-                csv_out.writerow([date, region] + list(values.values()) +
+                defined_pop_fraction = digest.region_defined_pop[key] / values[POPULATION]
+                csv_out.writerow([date, region] + values +
                                  [defined_pop_fraction])
                 add_values(uk, values)
                 if region not in ['Wales', 'Scotland', 'Northern Ireland']:
                     add_values(en, values)
-            csv_out.writerow([date, 'England'] + list(en.values()))
-            csv_out.writerow([date, 'UK'] + list(uk.values()))
+            csv_out.writerow([date, 'England'] + en)
+            csv_out.writerow([date, 'UK'] + uk)
 
     if name.startswith('corrected_prevalence_region_trend_'):
-        for (date, by_region) in digest_region.items():
+        for (date, by_region) in digest.region.items():
             for (region, values) in by_region.items():
                 try:
-                    if values['factor'] == float('inf'):
+                    if values[FACTOR] == float('inf'):
                        continue
 
-                    assert values['corrected_covid_positive'] <= values['population']
+                    assert values[CORRECTED_COVID_POSITIVE] <= values[POPULATION]
 
-                    assert abs(values['factor'] -
-                        (values['corrected_covid_positive'] / values['+ symptom_based'])) < 1e-11
+                    assert abs(values[FACTOR] -
+                        (values[CORRECTED_COVID_POSITIVE] / values[SYMPTOM_BASED])) < 1e-11
 
-                    assert abs(values['factor_prob'] -
-                        (values['corrected_covid_positive'] / values['corrected_covid_positive_prob'])) < 1e-11
+                    assert abs(values[FACTOR_PROB] -
+                        (values[CORRECTED_COVID_POSITIVE] / values[CORRECTED_COVID_POSITIVE_PROB])) < 1e-11
                 except AssertionError:
                     print ('Inconsistent values for region: ', region, date)
-                    print (values)
+                    print (values_dict(values))
                     raise
 
     with open(outdir + 'imd.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date', 'imd'] + value_fields + ['+ response_rate'])
-        for ((date, imd), values) in digest_imd.items():
-            response_rate = values['respondent_count'] / values['population']
-            csv_out.writerow([date, imd] + list(values.values())+ [response_rate])
+        for ((date, imd), values) in digest.imd.items():
+            response_rate = values[RESPONDENT_COUNT] / values[POPULATION]
+            csv_out.writerow([date, imd] + values+ [response_rate])
 
     with open(outdir + 'age_imd.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['date', 'age_group', 'imd'] + value_fields + ['+ response_rate'])
-        for ((date, age_group, imd), values) in digest_age_imd.items():
-            response_rate = values['respondent_count'] / values['population']
-            csv_out.writerow([date, age_group, imd] + list(values.values()) + [response_rate])
+        for ((date, age_group, imd), values) in digest.age_imd.items():
+            response_rate = values[RESPONDENT_COUNT] / values[POPULATION]
+            csv_out.writerow([date, age_group, imd] + values + [response_rate])
 
     with open(outdir + 'lsoa_count.csv', 'w') as outfile:
         csv_out = csv.writer(outfile)
         csv_out.writerow(['region', 'UTLA19CD', 'lad16cd', 'imd', '+ LSOA_count'])
-        for ((region, utla, lad, imd), lsoa_count) in digest_lsoa.items():
+        for ((region, utla, lad, imd), lsoa_count) in digest.lsoa.items():
             csv_out.writerow([region, utla, lad, imd, lsoa_count])
 
-    # age_trend would give different results, which don't match anything.
-    # These are big files, so only bother if they're going to match.
-    if name.startswith('corrected_prevalence_region_trend_'):
-        with open(outdir + 'utla.csv', 'w') as outfile:
-            csv_out = csv.writer(outfile)
+
+def write_utla(digest, outdir, header=True):
+    value_fields = digest.value_fields
+    ZERO_VALUES = [0] * len(value_fields)
+
+    with open(outdir + 'utla.csv', 'w') as outfile:
+        csv_out = csv.writer(outfile)
+        if header:
             csv_out.writerow(['region', 'UTLA19CD', 'date'] + value_fields +
                              ['+ defined_population_fraction'])
-            for ((region, utla), by_date) in digest_utla.items():
-                for (date, values) in by_date.items():
-                    key = (region, utla, date)
-                    defined_pop_fraction = digest_utla_defined_pop[key] / values['population']
-                    csv_out.writerow([region, utla, date] + list(values.values()) +
-                                     [defined_pop_fraction])
-
-        # 8-day average matches estimates on the official map and "watch list".
-        # This is an off-by-one error: it is documented as a 7 day average.
-        with open(outdir + 'utla_8d_average.csv', 'w') as outfile:
-            csv_out = csv.writer(outfile)
+        for ((region, utla), by_date) in digest.utla.items():
+            for (date, values) in by_date.items():
+                key = (region, utla, date)
+                defined_pop_fraction = digest.utla_defined_pop[key] / values[POPULATION]
+                csv_out.writerow([region, utla, date] + values +
+                                 [defined_pop_fraction])
+
+    # 8-day average matches estimates on the official map and "watch list".
+    # This is an off-by-one error: it is documented as a 7 day average.
+    with open(outdir + 'utla_8d_average.csv', 'w') as outfile:
+        csv_out = csv.writer(outfile)
+        if header:
             csv_out.writerow(['region', 'UTLA19CD', 'date'] +
                             value_fields +
                             ['+ covid_rate',
                              '+ covid_rate_lo', '+ covid_rate_hi'])
-            for ((region, utla), by_date) in digest_utla.items():
-                by_date = list(by_date.items())
-                N=8
-                for i in range(N-1, len(by_date)):
-                    totals = dict(ZERO_VALUES)
-                    for j in range(i-(N-1), i+1):
-                        add_values(totals, by_date[j][1])
-                    values = { key:value / N for (key, value) in totals.items() }
-
-                    values['+ covid_rate'] = values['corrected_covid_positive'] / values['population']
-                    # Note lack of u_fraction.  But this is what matches, sigh.
-                    # Also, calculating it *after* multiplying by factor sounds
-                    # like a big problem to me?
-                    (values['+ covid_rate_lo'],
-                     values['+ covid_rate_hi']) = (
-                        wilson(values['+ covid_rate'],
-                            values['respondent_count']))
-
-                    csv_out.writerow([region, utla, by_date[i][0]] + list(values.values()))
-
-        # As documented, 14-day average matches the local case graph in the app.
-        # Except that the app shifts everything back and then adds 6 further days.
-        # Perhaps the last day is based on an 8-day average, for example.
-        # The app does not show confidence intervals, although the backend does
-        # calculate confidence intervals using the same method as the watch list.
-        with open(outdir + 'lad_14d_average.csv', 'w') as outfile:
-            csv_out = csv.writer(outfile)
-            csv_out.writerow(['region', 'LAD16CD', 'date'] +
-                            value_fields +
-                            ['+ covid_rate',
-                             '+ covid_rate_lo', '+ covid_rate_hi'])
-            for ((region, lad), by_date) in digest_lad.items():
-                by_date = list(by_date.items())
-                N=14
-                for i in range(N-1, len(by_date)):
-                    totals = dict(ZERO_VALUES)
-                    for j in range(i-(N-1), i+1):
-                        add_values(totals, by_date[j][1])
-                    values = { key:value / N for (key, value) in totals.items() }
-
-                    values['+ covid_rate'] = values['corrected_covid_positive'] / values['population']
-                    # Note lack of u_fraction.  But this is what matches, sigh.
-                    # Also, calculating it *after* multiplying by factor sounds
-                    # like a big problem to me?
-                    (values['+ covid_rate_lo'],
-                     values['+ covid_rate_hi']) = (
-                        wilson(values['+ covid_rate'],
-                            values['respondent_count']))
-
-                    csv_out.writerow([region, lad, by_date[i][0]] + list(values.values()))
-
-
-#     for ((region, utla), by_date) in digest_utla.items():
+        for ((region, utla), by_date) in digest.utla.items():
+            by_date = list(by_date.items())
+            N=8
+            for i in range(N-1, len(by_date)):
+                totals = list(ZERO_VALUES)
+                for j in range(i-(N-1), i+1):
+                    add_values(totals, by_date[j][1])
+                values = [value / N for value in totals]
+
+                covid_rate = values[CORRECTED_COVID_POSITIVE] / values[POPULATION]
+                # Note lack of u_fraction.  But this is what matches, sigh.
+                # Also, calculating it *after* multiplying by factor sounds
+                # like a big problem to me?
+                (covid_rate_lo, covid_rate_hi) = wilson(covid_rate,
+                                                        values[RESPONDENT_COUNT])
+                values += [covid_rate, covid_rate_lo, covid_rate_hi]
+
+                csv_out.writerow([region, utla, by_date[i][0]] + values)
+
+#     for ((region, utla), by_date) in digest.utla.items():
 #         for (date, values) in by_date.items():
 #             try:
 #                 # Although this assertion does not hold for individual strata,
 #                 # there have not been any breaches in the UTLA totals
 #                 # in the region_trend file.  Only in the age_trend file.
-#                 #assert values['corrected_covid_positive'] <= values['population']
+#                 #assert values[CORRECTED_COVID_POSITIVE] <= values[POPULATION]
 #                 
 #                 # These assertions do *not* hold for UTLA's.
-#                 #assert values['predicted_covid_positive_prob'] <= values['respondent_count']
-#                 #assert values['predicted_covid_positive_prob'] <= values['unhealthy_count']
-#                 #assert values['corrected_covid_positive_prob'] <= values['population']
+#                 #assert values[PREDICTED_COVID_POSITIVE_PROB] <= values[RESPONDENT_COUNT]
+#                 #assert values[PREDICTED_COVID_POSITIVE_PROB] <= values[UNHEALTHY_COUNT]
+#                 #assert values[CORRECTED_COVID_POSITIVE_PROB] <= values[POPULATION]
 #             except AssertionError:
 #                 print ('Inconsistent values for UTLA: ', region, utla, date)
-#                 print (values)
+#                 print (values_dict(values))
 #                 raise
 
 
+def write_lad(digest, outdir, header=True, mode='w'):
+    value_fields = digest.value_fields
+    ZERO_VALUES = [0] * len(value_fields)
+
+    # As documented, 14-day average matches the local case graph in the app.
+    # Except that the app shifts everything back and then adds 6 further days.
+    # Perhaps the last day is based on an 8-day average, for example.
+    # The app does not show confidence intervals, although the backend does
+    # calculate confidence intervals using the same method as the watch list.
+    with open(outdir + 'lad_14d_average.csv', mode) as outfile:
+        csv_out = csv.writer(outfile)
+        if header:
+            csv_out.writerow(['region', 'LAD16CD', 'date'] +
+                            value_fields +
+                            ['+ covid_rate',
+                             '+ covid_rate_lo', '+ covid_rate_hi'])
+        for ((region, lad), by_date) in digest.lad.items():
+            by_date = list(by_date.items())
+            N=14
+            for i in range(N-1, len(by_date)):
+                totals = list(ZERO_VALUES)
+                for j in range(i-(N-1), i+1):
+                    add_values(totals, by_date[j][1])
+                values = [value / N for value in totals]
+
+                covid_rate = values[CORRECTED_COVID_POSITIVE] / values[POPULATION]
+                # Note lack of u_fraction.  But this is what matches, sigh.
+                # Also, calculating it *after* multiplying by factor sounds
+                # like a big problem to me?
+                (covid_rate_lo, covid_rate_hi) = wilson(covid_rate,
+                                                        values[RESPONDENT_COUNT])
+                values += [covid_rate, covid_rate_lo, covid_rate_hi]
+
+                csv_out.writerow([region, lad, by_date[i][0]] + values)
+
+
+def main(infile, name):
+    name = archive.csv_name(name)
+    if name.endswith('.csv'):
+        name = name[:-len('.csv')]
+
+    with instrument.stage('digest'):
+        digest = digest_file(infile)
+
+    outdir = f'out/prevalence_digest/{name}/'
+    os.makedirs(outdir, exist_ok=True)
+
+    with instrument.stage('write'):
+        write_digest(digest, name, outdir)
+
+        # age_trend would give different results, which don't match anything.
+        # These are big files, so only bother if they're going to match.
+        if name.startswith('corrected_prevalence_region_trend_'):
+            write_utla(digest, outdir)
+            write_lad(digest, outdir)
+
+
+# Out-of-core mode, for files which are too big to digest in memory.
+#
+# 1. Split the input rows by UTLA, into a number of temporary shard files.
+# 2. Digest each shard separately, in parallel.  Each shard writes its own
+#    part of the UTLA and LAD outputs, and only hands back the small
+#    digests (region, age, imd...).
+# 3. Merge the small digests and write them out.  Concatenate the UTLA and
+#    LAD outputs.
+#
+# Peak memory is then bounded by the largest shard.  A few LADs belong to
+# more than one UTLA, so they can be split across shards.  The shards hand
+# back their partial totals for those LADs, which are merged at the end.
+#
+# factor and factor_prob are not added up, they keep the value from the
+# first input row (see add_values()).  They are not always the same for
+# every row in a stratum, and the first row of a total may be in any
+# shard.  So while splitting, I note which shard has the first row of
+# each (date, region, age_group, imd), in input order.  That tells us
+# which shard has the first row of each region, age, imd and age_imd
+# total, and the merged totals take factor and factor_prob from that
+# shard.  It also puts the merged totals back in input order.
+#
+# The summed values can still differ in the last few digits.  Floating
+# point addition is not associative, and the totals which cover more than
+# one shard (region, age, imd, and the split LADs) are added up in a
+# different order: each shard is summed, and then the shard totals are
+# added.  UTLA values are the same, because each UTLA is in one shard.
+# The rows of utla*.csv, lad*.csv and lsoa_count.csv come out in a
+# different order.
+
+def shard_of(utla, shards):
+    return zlib.crc32(utla.encode('utf-8')) % shards
+
+def split_shards(infile, shard_dir, shards):
+    """Returns (list of (shard, path), set of (region, lad) which appear in
+    more than one shard, FirstShards)."""
+    header = infile.readline()
+    fieldnames = header.decode('utf-8').rstrip('\r\n').split(',')
+    date_field = fieldnames.index('date')
+    region_field = fieldnames.index('region')
+    utla_field = fieldnames.index('UTLA19CD')
+    lad_field = fieldnames.index('lad16cd')
+    age_field = fieldnames.index('age_group')
+    imd_field = fieldnames.index('imd')
+    maxsplit = max(date_field, region_field, utla_field, lad_field,
+                   age_field, imd_field) + 1
+
+    # (region, lad) -> shard, or None if it appears in more than one.
+    lad_shards = {}
+    # utla -> shard.  Saves on hashing.
+    utla_shards = {}
+    # (date, region, age_group, imd) -> shard of the first row, in input
+    # order.
+    first_shards = {}
+    with WriterPool(shard_dir, header) as writers:
+        for line in infile:
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            assert b'"' not in line
+            row = line.split(b',', maxsplit)
+            utla = row[utla_field]
+            shard = utla_shards.get(utla)
+            if shard is None:
+                shard = shard_of(utla.decode('utf-8'), shards)
+                utla_shards[utla] = shard
+            keys_lad = (row[region_field], row[lad_field])
+            s = lad_shards.get(keys_lad, shard)
+            if s != shard:
+                s = None
+            lad_shards[keys_lad] = s
+            keys = (row[date_field], row[region_field], row[age_field],
+                    row[imd_field])
+            if keys not in first_shards:
+                first_shards[keys] = shard
+            writers.write(str(shard), line)
+    # After close(), which creates the files for shards that were still
+    # in the buffers.
+    shard_paths = [(int(shard), path)
+                   for (shard, path) in writers.filenames.items()]
+
+    split_lads = set((region.decode('utf-8'), lad.decode('utf-8'))
+                     for ((region, lad), s) in lad_shards.items() if s is None)
+    return (shard_paths, split_lads, FirstShards(first_shards))
+
+class FirstShards:
+    """Which shard has the first input row of each small digest total.
+
+    Each attribute is key -> shard, with the keys in input order.  The
+    keys are the same as in Digest, except that region and age are not
+    nested: (date, region) and (date, age_group).
+    """
+
+    def __init__(self, first_shards):
+        self.region = {}
+        self.age = {}
+        self.imd = {}
+        self.age_imd = {}
+        for (keys, shard) in first_shards.items():
+            (date, region, age_group, imd) = [
+                sys.intern(key.decode('utf-8')) for key in keys]
+            self.region.setdefault((date, region), shard)
+            self.age.setdefault((date, age_group), shard)
+            self.imd.setdefault((date, imd), shard)
+            self.age_imd.setdefault((date, age_group, imd), shard)
+
+    def take_factors(self, digest, shard, shard_digest):
+        """Copy factor and factor_prob into the merged digest, from the
+        totals where this shard has the first row."""
+        def take(a, b):
+            a[FACTOR] = b[FACTOR]
+            a[FACTOR_PROB] = b[FACTOR_PROB]
+
+        for ((date, region), s) in self.region.items():
+            if s == shard:
+                take(digest.region[date][region],
+                     shard_digest.region[date][region])
+        for ((date, age_group), s) in self.age.items():
+            if s == shard:
+                take(digest.age[date][age_group],
+                     shard_digest.age[date][age_group])
+        for (k, s) in self.imd.items():
+            if s == shard:
+                take(digest.imd[k], shard_digest.imd[k])
+        for (k, s) in self.age_imd.items():
+            if s == shard:
+                take(digest.age_imd[k], shard_digest.age_imd[k])
+
+    def sort(self, digest):
+        """Put the merged totals in input order."""
+        def sort_nested(a, order):
+            result = {}
+            for (k1, k2) in order:
+                result.setdefault(k1, {})[k2] = a[k1][k2]
+            return result
+
+        digest.region = sort_nested(digest.region, self.region)
+        digest.age = sort_nested(digest.age, self.age)
+        digest.imd = {k: digest.imd[k] for k in self.imd}
+        digest.age_imd = {k: digest.age_imd[k] for k in self.age_imd}
+
+def digest_shard(args):
+    (shard_path, outdir, region_trend, split_lads) = args
+    with open(shard_path) as infile:
+        digest = digest_file(infile)
+    os.remove(shard_path)
+
+    split = Digest()
+    if region_trend:
+        write_utla(digest, outdir, header=False)
+        for keys_lad in split_lads:
+            if keys_lad in digest.lad:
+                split.lad[keys_lad] = digest.lad.pop(keys_lad)
+        write_lad(digest, outdir, header=False)
+    # Don't send the big digests back.
+    digest.utla = {}
+    digest.utla_defined_pop = {}
+    digest.lad = split.lad
+    return digest
+
+def main_sharded(infile, name, shards, jobs):
+    name = archive.csv_name(name)
+    if name.endswith('.csv'):
+        name = name[:-len('.csv')]
+    region_trend = name.startswith('corrected_prevalence_region_trend_')
+
+    outdir = f'out/prevalence_digest/{name}/'
+    os.makedirs(outdir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix='shards-', dir=outdir) as tmpdir:
+        with instrument.stage('split'):
+            (shard_paths, split_lads, first_shards) = split_shards(
+                infile, tmpdir, shards)
+
+        args = []
+        for (i, (shard, shard_path)) in enumerate(shard_paths):
+            shard_outdir = os.path.join(tmpdir, f'out{i}/')
+            os.makedirs(shard_outdir)
+            args.append((shard_path, shard_outdir, region_trend, split_lads))
+
+        digest = Digest()
+        with (instrument.stage('digest shards'),
+              multiprocessing.Pool(jobs) as pool):
+            shard_digests = pool.imap(digest_shard, args)
+            for ((shard, _), shard_digest) in zip(shard_paths, shard_digests):
+                digest.merge(shard_digest)
+                first_shards.take_factors(digest, shard, shard_digest)
+                for (keys_lad, by_date) in shard_digest.lad.items():
+                    v = digest.lad.setdefault(keys_lad, {})
+                    for (date, values) in by_date.items():
+                        v2 = v.get(date)
+                        if v2 is None:
+                            v[date] = values
+                        else:
+                            add_values(v2, values)
+
+        first_shards.sort(digest)
+
+        with instrument.stage('write'):
+            write_digest(digest, name, outdir)
+
+            if region_trend:
+                # Header lines
+                empty = Digest()
+                write_utla(empty, outdir)
+                write_lad(empty, outdir)
+                # The merged LAD's are written after the others, but within
+                # each LAD the dates are in order.
+                for (keys_lad, by_date) in digest.lad.items():
+                    digest.lad[keys_lad] = dict(sorted(by_date.items()))
+
+                for filename in ['utla.csv', 'utla_8d_average.csv', 'lad_14d_average.csv']:
+                    with open(outdir + filename, 'ab') as outfile:
+                        for (_, shard_outdir, _, _) in args:
+                            with open(shard_outdir + filename, 'rb') as shard_file:
+                                shutil.copyfileobj(shard_file, outfile)
+                write_lad(digest, outdir, header=False, mode='a')
+
+
+def usage():
+    print("Usage: ./prevalence_digest.py [--shards N [--jobs J]] input.csv")
+    print()
+    print("Create digests of corrected_prevalence_*_trend_*.csv from covid-public-data")
+    print("Output files are written to out/prevalence_digest/")
+    print()
+    print("--shards N: split the input by UTLA into N temporary files, and")
+    print("            digest them separately.  Uses less memory.  Summed")
+    print("            values can differ in the last digits, see the comments.")
+    print("--jobs J:   digest J shards in parallel.  Default: number of CPUs.")
+    sys.exit(2)
+
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: ./prevalence_digest.py input.csv")
-        print()
-        print("Create digests of corrected_prevalence_*_trend_*.csv from covid-public-data")
-        print("Output files are written to out/prevalence_digest/")
-        sys.exit(2)
-    filename = sys.argv[1]
-    with (open(filename) as infile):
-        main(infile, filename)
+    instrument.init()
+    args = sys.argv[1:]
+    shards = None
+    jobs = None
+    while len(args) > 1 and args[0] in ['--shards', '--jobs']:
+        if args[0] == '--shards':
+            shards = int(args[1])
+        else:
+            jobs = int(args[1])
+        args = args[2:]
+    if len(args) != 1 or (jobs is not None and shards is None):
+        usage()
+    filename = args[0]
+    if shards:
+        with instrument.open_input(filename, 'rb') as infile:
+            main_sharded(infile, filename, shards, jobs)
+    else:
+        with instrument.open_input(filename) as infile:
+            main(infile, filename)
@@ -11,6 +11,9 @@ import csv
 import math
 import sys
 from pathlib import Path
+import archive
+import instrument
+import schema
 
 RECOVERY_STR = """0
 0
@@ -60,11 +63,11 @@ def read_incidence(infile):
     regions = {}
     dates = []
     
-    csv_in = csv.DictReader(infile)
-    for row in csv_in:
-        region = row['region']
-        date = row['date']
-        incidence = float(row.get('pop_mid') or row.get('covid_in_pop'))
+    columns = schema.read_columns(infile, ['date', 'region'], floats=['mid'])
+    instrument.count('rows_parsed', len(columns['date']))
+    for (date, region, incidence) in zip(columns['date'],
+                                         columns['region'],
+                                         columns['mid'].tolist()):
         v = regions.get(region, None)
         if v is None:
             v = []
@@ -106,39 +109,35 @@ def write_prevalence(file_in, file_out):
             csv_out.writerow([dates[i+eaten], region, prevalences[region][i]])
 
 
+def prevalence_dir(indir, prefix, outdir):
+    """Calculate prevalence for each file in indir which is not already in
+    outdir.  Returns the new output paths."""
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    written = []
+    paths = archive.glob(indir, prefix + '*.csv')
+    paths.sort()
+    for path in paths:
+        filename = archive.csv_name(path)[len(prefix):]
+        out_path = outdir / filename
+        if out_path.exists():
+            continue
+        print (path.name)
+        with (instrument.open_input(path) as csvfile_in,
+              out_path.open('w') as csvfile_out):
+            write_prevalence(csvfile_in, csvfile_out)
+        written.append(out_path)
+    return written
+
+def main():
+    prevalence_dir(Path('download/incidence/'), 'incidence_',
+                   Path('out/prevalence_from_incidence_/'))
+    prevalence_dir(Path('download/incidence_history/'), 'incidence_history_',
+                   Path('out/prevalence_from_incidence_history_/'))
+
+
 init_recovery()
 
-outdir = Path('out/prevalence_from_incidence_/')
-outdir.mkdir(parents=True, exist_ok=True)
-
-indir = Path('download/incidence/')
-prefix = 'incidence_'
-paths = list(indir.glob(prefix + '*.csv'))
-paths.sort()
-for path in paths:
-    filename = path.name[len(prefix):]
-    out_path = outdir / filename
-    if out_path.exists():
-        continue
-    print (path.name)
-    with (path.open() as csvfile_in,
-          out_path.open('w') as csvfile_out):
-        write_prevalence(csvfile_in, csvfile_out)
-
-
-outdir = Path('out/prevalence_from_incidence_history_/')
-outdir.mkdir(parents=True, exist_ok=True)
-
-indir = Path('download/incidence_history/')
-prefix = 'incidence_history_'
-paths = list(indir.glob(prefix + '*.csv'))
-paths.sort()
-for path in paths:
-    filename = path.name[len(prefix):]
-    out_path = outdir / filename
-    if out_path.exists():
-        continue
-    print (path.name)
-    with (path.open() as csvfile_in,
-          out_path.open('w') as csvfile_out):
-        write_prevalence(csvfile_in, csvfile_out)
+if __name__ == '__main__':
+    instrument.init()
+    main()
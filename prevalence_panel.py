@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Collect every prevalence_history_*.csv into one long-format "panel":
+#
+#   (snapshot, nominal date, region) -> active_cases
+#
+# Each prevalence_history file repeats the whole history, so looking at how
+# one nominal date was revised means opening hundreds of files.  With the
+# panel it is just a slice, e.g.
+#
+#   ./prevalence_panel.py 2022-01-05 England
+#
+# prints England prevalence for 2022-01-05, as published on each day.
+#
+# The panel is append-only.  Successive runs only read new snapshot files.
+#
+# Output files in out/prevalence_panel/:
+#
+#   snapshots.csv   Index: one line per snapshot, with its first row and
+#                   number of rows in the arrays below.
+#   regions.txt     Region names.  The line number is the region id.
+#   lag.u2          uint16 per row.  Nominal date, delta-encoded as the
+#                   number of days before the snapshot date.
+#   region.u1       uint8 per row.  Region id.
+#   value.f8        float64 per row.  Or value.f4 (float32), if the panel
+#                   was created with --float32.
+
+import csv
+import datetime
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import archive
+import fastcsv
+import instrument
+
+PANEL_DIR = 'out/prevalence_panel/'
+INDEX_FIELDS = ['snapshot', 'date', 'start', 'count']
+
+NATIONS = ['Wales', 'Scotland', 'Northern Ireland']
+
+
+def parse_date(date):
+    return datetime.date.fromisoformat(date)
+
+def parse_name_date(name):
+    # e.g. '20230701' or '20230701-20230704-0720Z'
+    return datetime.date(int(name[:4]), int(name[4:6]), int(name[6:8]))
+
+
+class Panel:
+    def __init__(self, path, dtype=None):
+        self.path = Path(path)
+        # Nothing is written until the first append()
+        self._prepared = False
+
+        self.snapshots = []
+        index_path = self.path / 'snapshots.csv'
+        if index_path.exists():
+            with index_path.open() as f:
+                for row in csv.DictReader(f):
+                    row['start'] = int(row['start'])
+                    row['count'] = int(row['count'])
+                    self.snapshots.append(row)
+        self.names = set(row['snapshot'] for row in self.snapshots)
+
+        self.regions = []
+        regions_path = self.path / 'regions.txt'
+        if regions_path.exists():
+            with regions_path.open() as f:
+                self.regions = [line.rstrip('\n') for line in f]
+        self.region_ids = {region: i for (i, region) in enumerate(self.regions)}
+
+        # The dtype of values is fixed when the panel is created.
+        if (self.path / 'value.f4').exists():
+            self.value_name = 'value.f4'
+        elif (self.path / 'value.f8').exists() or dtype is None:
+            self.value_name = 'value.f8'
+        else:
+            self.value_name = 'value.' + {np.float32: 'f4', np.float64: 'f8'}[dtype]
+        self.value_dtype = {'value.f4': np.float32,
+                            'value.f8': np.float64}[self.value_name]
+        if dtype is not None and dtype != self.value_dtype:
+            print(f'{self.path / self.value_name} already exists, so values '
+                  f'are stored as {np.dtype(self.value_dtype).name}, not '
+                  f'{np.dtype(dtype).name}.  Delete {self.path} to change it.',
+                  file=sys.stderr)
+
+        self.rows = 0
+        if self.snapshots:
+            last = self.snapshots[-1]
+            self.rows = last['start'] + last['count']
+
+    def _arrays(self):
+        return [('lag.u2', np.uint16),
+                ('region.u1', np.uint8),
+                (self.value_name, self.value_dtype)]
+
+    def _prepare(self):
+        """Create the panel directory, or tidy it up, before appending."""
+        if self._prepared:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._truncate()
+        self._prepared = True
+
+    def _truncate(self):
+        # The index is written last.  If we were interrupted while appending,
+        # throw away any rows which did not make it into the index.
+        for (name, dtype) in self._arrays():
+            path = self.path / name
+            with path.open('ab') as f:
+                f.truncate(self.rows * np.dtype(dtype).itemsize)
+
+    def region_id(self, region):
+        i = self.region_ids.get(region)
+        if i is None:
+            i = len(self.regions)
+            assert i < 256
+            self.regions.append(region)
+            self.region_ids[region] = i
+            with (self.path / 'regions.txt').open('a') as f:
+                f.write(region + '\n')
+        return i
+
+    def append(self, name, infile):
+        self._prepare()
+        snapshot_date = parse_name_date(name)
+
+        columns = fastcsv.read_columns(infile, ['date', 'region'],
+                                       floats=['active_cases'])
+        values = columns['active_cases']
+
+        lags = []
+        region_ids = []
+        # Dates repeat for every region, so only convert each date once.
+        prev_date = None
+        lag = None
+        for (date, region) in zip(columns['date'], columns['region']):
+            if date != prev_date:
+                lag = (snapshot_date - parse_date(date)).days
+                assert 0 <= lag < 65536
+                prev_date = date
+            lags.append(lag)
+            region_ids.append(self.region_id(region))
+
+        instrument.count('rows_parsed', len(values))
+        arrays = [np.array(lags, dtype=np.uint16),
+                  np.array(region_ids, dtype=np.uint8),
+                  values.astype(self.value_dtype)]
+        for ((filename, _), array) in zip(self._arrays(), arrays):
+            with (self.path / filename).open('ab') as f:
+                f.write(array.tobytes())
+
+        row = {'snapshot': name,
+               'date': snapshot_date.isoformat(),
+               'start': self.rows,
+               'count': len(values)}
+        index_path = self.path / 'snapshots.csv'
+        new_index = not index_path.exists()
+        with index_path.open('a', newline='') as f:
+            writer = csv.DictWriter(f, INDEX_FIELDS)
+            if new_index:
+                writer.writeheader()
+            writer.writerow(row)
+        self.snapshots.append(row)
+        self.names.add(name)
+        self.rows += len(values)
+
+    def load(self):
+        """Map the arrays into memory.  Returns (lag, region, value)."""
+        arrays = []
+        for (filename, dtype) in self._arrays():
+            path = self.path / filename
+            if self.rows == 0:
+                arrays.append(np.zeros(0, dtype=dtype))
+            else:
+                arrays.append(np.memmap(path, dtype=dtype, mode='r',
+                                        shape=(self.rows,)))
+        return arrays
+
+    def published(self, date, region):
+        """Value for one nominal date, as published in each snapshot.
+
+        region can also be 'England' or 'UK'; these are summed from the
+        regions, like prevalence.England.py and prevalence.UK.py.
+
+        Yields (snapshot, value) pairs, in order of snapshot date.
+        Snapshots which do not include the nominal date are skipped.
+        """
+        if region == 'UK':
+            wanted = list(range(len(self.regions)))
+        elif region == 'England':
+            wanted = [i for (i, r) in enumerate(self.regions)
+                      if r not in NATIONS]
+        else:
+            wanted = [self.region_ids[region]]
+        wanted = np.array(wanted, dtype=np.uint8)
+
+        (lag, region_id, value) = self.load()
+        date = parse_date(date)
+        snapshots = sorted(self.snapshots, key=lambda s: (s['date'], s['snapshot']))
+        for s in snapshots:
+            want_lag = (parse_date(s['date']) - date).days
+            if want_lag < 0:
+                continue
+            start = s['start']
+            end = start + s['count']
+            mask = ((lag[start:end] == want_lag) &
+                    np.isin(region_id[start:end], wanted))
+            if not mask.any():
+                continue
+            yield (s['snapshot'], float(value[start:end][mask].sum()))
+
+
+def update(panel, indir, prefix):
+    paths = archive.glob(indir, prefix + '*.csv')
+    paths.sort()
+    for path in paths:
+        name = archive.csv_name(path)[len(prefix):-4]
+        if name in panel.names:
+            continue
+        print(path)
+        with instrument.open_input(path) as infile:
+            panel.append(name, infile)
+
+
+def main():
+    args = sys.argv[1:]
+    dtype = None
+    if args and args[0] == '--float32':
+        dtype = np.float32
+        args = args[1:]
+    if len(args) > 2:
+        print("Usage: ./prevalence_panel.py [--float32]")
+        print("       ./prevalence_panel.py DATE [REGION]")
+        print()
+        print("Update out/prevalence_panel/ from download/prevalence_history/.")
+        print("Or show the value for nominal DATE, as published on each day.")
+        print("REGION defaults to England.")
+        sys.exit(2)
+
+    panel = Panel(PANEL_DIR, dtype)
+    if not args:
+        update(panel, Path('download/prevalence_history/'), 'prevalence_history_')
+        return
+
+    if not panel.snapshots:
+        sys.exit(f"No panel in {PANEL_DIR}.  Run ./prevalence_panel.py first.")
+    date = args[0]
+    region = args[1] if len(args) > 1 else 'England'
+    if region not in ['England', 'UK'] and region not in panel.region_ids:
+        print(f"Unknown region: {region}")
+        print("Known regions: " + ", ".join(['England', 'UK'] + panel.regions))
+        sys.exit(2)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['snapshot', 'active_cases'])
+    for (snapshot, value) in panel.published(date, region):
+        writer.writerow([snapshot, value])
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from pathlib import Path
-import mmap
+import archive
+import instrument
 
 class PublishDate:
     __slots__ = ('out_uk', 'out_en')
@@ -28,27 +29,27 @@ class PublishDate:
         indir = Path('download/incidence/')
         prefix = 'incidence_'
         
-        paths = list(indir.glob(prefix + '*.csv'))
+        paths = archive.glob(indir, prefix + '*.csv')
         paths.sort()
 
         for path in paths:
             # Use all files after method change v5
-            if path.name < 'incidence_20211003.csv':
+            if archive.csv_name(path) < 'incidence_20211003.csv':
                 continue
             # Header line
-            if path.name == 'incidence_20211003.csv':
-                with path.open('rb') as infile:
+            if archive.csv_name(path) == 'incidence_20211003.csv':
+                with archive.open_data(path, 'rb') as infile:
                     header = next(infile)
                     for out_en in self.out_en:
                         out_en.write(header)
                     for out_uk in self.out_uk:
                         out_uk.write(header)
 
-            with path.open('rb') as infile:
+            with instrument.open_input(path, 'rb') as infile:
                 # You *could* do this efficiently
                 # without mmap, but why bother?
+                data = archive.map_data(infile)
                 def reversed_lines():
-                    data = mmap.mmap(infile.fileno(), 0, prot=mmap.PROT_READ)
                     j = len(data)
                     i = data.rfind(b'\n', 0, j)
                     yield data[i+1:j]
@@ -71,5 +72,10 @@ class PublishDate:
                         line = next(lines)
                     out_uk.write(line)
 
-with PublishDate() as publish_date:
-    publish_date.run()
+def main():
+    with PublishDate() as publish_date:
+        publish_date.run()
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -1,86 +1,115 @@
 #!/usr/bin/env python3
 
-import os
 from pathlib import Path
-import itertools
-import csv
-import mmap
+import archive
+import instrument
+import prefetch
+import schema
 
 N=9
 
+HEADER = b','.join([b'file'] + [str(i).encode('ascii')
+                                 for i in range(0, -N, -1)]) + b'\n'
+
+# Only the last few dates in each file are needed.  So read the header
+# line, and the last TAIL_BYTES of the file.  If that is not enough, fall
+# back to the whole file.  (A compressed file has to be decompressed from
+# the start, but only the tail is kept.)
+TAIL_BYTES = 64 * 1024
+
+def read_tail(path):
+    """Returns (header line, end of the file, True if that is all of it).
+    The end of the file starts at the start of a line."""
+    with archive.open_data(path, 'rb') as f:
+        head = f.readline()
+        (tail, whole) = archive.read_tail(f, TAIL_BYTES)
+    if not whole:
+        # Drop the first line, which may be cut off.
+        i = tail.find(b'\n')
+        tail = tail[i+1:] if i >= 0 else b''
+    return (head, tail, whole)
+
+def reversed_lines(data):
+    j = len(data)
+    i = data.rfind(b'\n', 0, j)
+    yield data[i+1:j]
+    while i >= 0:
+        j = i
+        i = data.rfind(b'\n', 0, j)
+        yield data[i+1:j+1]
+
+def last_values(data, region, mid_field):
+    """The last N values for region, latest first."""
+    values = []
+    n = 0
+    for line in reversed_lines(data):
+        n += 1
+        row = line.split(b',')
+        if region not in row:
+            continue
+        values.append(row[mid_field])
+        if len(values) == N:
+            break
+    instrument.count('rows_parsed', n)
+    return values
+
+REGIONS = [b'England', b'UK']
+
+def pub_history_file(path, name, out_en, out_uk, tail=None):
+    """Write one line to each output, for the last N dates in path.
+    tail is read_tail(path), if you have already read it."""
+    with instrument.input_file(path):
+        (head, data, whole) = tail or read_tail(path)
+        head = head.decode('utf-8')
+        assert head
+        head = head.rstrip()
+        assert head
+
+        heads = head.split(',')
+        # date and region are not used, but should be there
+        (_, _, mid_field) = schema.resolve(heads, ['date', 'region', 'mid'],
+                                           path)
+
+        values = [last_values(data, region, mid_field) for region in REGIONS]
+        if not whole and any(len(v) < N for v in values):
+            # Not enough lines in the tail.
+            # You *could* do this efficiently
+            # without mmap, but why bother?
+            with archive.open_data(path, 'rb') as f:
+                data = archive.map_data(f)
+                values = [last_values(data, region, mid_field)
+                          for region in REGIONS]
+
+        for (v, outfile) in zip(values, [out_en, out_uk]):
+            line = b','.join([name.encode('ascii')] + v)
+            outfile.write(line)
+            outfile.write(b'\n')
+
 def pub_history(indir, prefix, out_en, out_uk):
-    heads = [b'file'] + [str(i).encode('ascii') for i in range(0, -N, -1)]
-    header = b','.join(heads) + b'\n'
     for outfile in out_en, out_uk:
-        outfile.write(header)
+        outfile.write(HEADER)
 
-    paths = list(indir.glob(prefix + '*.csv'))
+    paths = archive.glob(indir, prefix + '*.csv')
     paths.sort()
     prefix_len = len(prefix)
 
-    for path in paths:
-        name = path.name[prefix_len:-4]
+    # Read the next few files while we work on this one.
+    tails = prefetch.read_ahead(paths, read=read_tail,
+                                size=lambda path: TAIL_BYTES)
+    for (path, tail) in tails:
+        name = archive.csv_name(path)[prefix_len:-4]
         print(path)
-        with path.open() as f:
-            head = f.readline()
-            assert head
-            head = head.rstrip()
-            assert head
-
-            heads = head.split(',')
-            date_field = 0
-            if not heads[0]:
-                date_field = 1
-            assert heads[date_field] == 'date'
-            
-            region_field = heads.index('region')
-
-            field_names = ['pop_mid', 'covid_in_pop']
-            for field_name in field_names:
-                try:
-                    mid_field = heads.index(field_name)
-                    break
-                except ValueError:
-                    pass
-            else:
-                raise Exception(f'{path}: could not find one of {field_names}')
+        pub_history_file(path, name, out_en, out_uk, tail)
 
-            # You *could* do this efficiently
-            # without mmap, but why bother?
-            def reversed_lines():
-                data = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
-                j = len(data)
-                i = data.rfind(b'\n', 0, j)
-                yield data[i+1:j]
-                while i >= 0:
-                    j = i
-                    i = data.rfind(b'\n', 0, j)
-                    yield data[i+1:j+1]
-
-            def reversed_values(region):
-                lines = reversed_lines()
-                while True:
-                    line = next(lines)
-                    if line is None:
-                        return
-
-                    row = line.split(b',')
-                    if region not in row:
-                        continue
-
-                    yield row[mid_field]
-
-            for (region, outfile) in [(b'England', out_en), (b'UK', out_uk)]:
-                values_iter = reversed_values(region)
-                values = list(itertools.islice(values_iter, N))
-                line = b','.join([name.encode('ascii')] + values)
-                outfile.write(line)
-                outfile.write(b'\n')
-
-outdir = Path('out/')
-outdir.mkdir(parents=True, exist_ok=True)
-
-indir = Path('download/incidence/')
-with (open(outdir / 'publish-date-8.incidence.England.csv', 'wb') as out_en,
-      open(outdir / 'publish-date-8.incidence.UK.csv', 'wb') as out_uk):
-    pub_history(indir, 'incidence_', out_en, out_uk)
+def main(outdir='out/'):
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    indir = Path('download/incidence/')
+    with (open(outdir / 'publish-date-8.incidence.England.csv', 'wb') as out_en,
+          open(outdir / 'publish-date-8.incidence.UK.csv', 'wb') as out_uk):
+        pub_history(indir, 'incidence_', out_en, out_uk)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
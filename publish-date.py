@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 from pathlib import Path
-import mmap
+import archive
+import instrument
 
 def publish_date(indir, prefix,
                  out_en5, out_uk5,
                  out_en6, out_uk6):
 
-    paths = list(indir.glob(prefix + '*.csv'))
+    paths = archive.glob(indir, prefix + '*.csv')
     paths.sort()
 
     out_en = out_en5
@@ -14,27 +15,27 @@ def publish_date(indir, prefix,
 
     for path in paths:
         # Use all files after method change v5
-        if path.name < 'incidence_20211003.csv':
+        if archive.csv_name(path) < 'incidence_20211003.csv':
             continue
         # Header line
-        if path.name == 'incidence_20211003.csv':
-            with path.open('rb') as infile:
+        if archive.csv_name(path) == 'incidence_20211003.csv':
+            with archive.open_data(path, 'rb') as infile:
                 header = next(infile)
                 out_en.write(header)
                 out_uk.write(header)
-        if path.name == 'incidence_20230201.csv':
+        if archive.csv_name(path) == 'incidence_20230201.csv':
             out_en = out_en6
             out_uk = out_uk6
-            with path.open('rb') as infile:
+            with archive.open_data(path, 'rb') as infile:
                 header = next(infile)
                 out_en.write(header)
                 out_uk.write(header)
 
-        with path.open('rb') as infile:
+        with instrument.open_input(path, 'rb') as infile:
             # You *could* do this efficiently
             # without mmap, but why bother?
+            data = archive.map_data(infile)
             def reversed_lines():
-                data = mmap.mmap(infile.fileno(), 0, prot=mmap.PROT_READ)
                 j = len(data)
                 i = data.rfind(b'\n', 0, j)
                 yield data[i+1:j]
@@ -55,11 +56,16 @@ def publish_date(indir, prefix,
                 line = next(lines)
             out_uk.write(line)
 
-indir = Path('download/incidence/')
-with (open('out/publish-date.incidence.England.v5.csv', 'wb') as out_en5,
-      open('out/publish-date.incidence.England.v6.csv', 'wb') as out_en6,
-      open('out/publish-date.incidence.UK.v5.csv', 'wb') as out_uk5,
-      open('out/publish-date.incidence.UK.v6.csv', 'wb') as out_uk6):
-    publish_date(indir, 'incidence_',
-                 out_en5, out_uk5,
-                 out_en6, out_uk6)
+def main():
+    indir = Path('download/incidence/')
+    with (open('out/publish-date.incidence.England.v5.csv', 'wb') as out_en5,
+          open('out/publish-date.incidence.England.v6.csv', 'wb') as out_en6,
+          open('out/publish-date.incidence.UK.v5.csv', 'wb') as out_uk5,
+          open('out/publish-date.incidence.UK.v6.csv', 'wb') as out_uk6):
+        publish_date(indir, 'incidence_',
+                     out_en5, out_uk5,
+                     out_en6, out_uk6)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+#
+# How much do ZOE revise the latest days, and what will the latest days
+# probably look like once they have been revised?
+#
+#   ./revisions.py                          # incidence, lags 0 to 14
+#   ./revisions.py --lags 21 --window 56 prevalence_history
+#
+# publish-date-8.py keeps the last 9 values from each incidence file, for
+# England and the UK, to look at retrospective changes, e.g. delayed PCR
+# results.  This keeps the same thing for every region and more days, as a
+# "revision triangle":
+#
+#   triangle[region, date, lag]   the value for the date, in the file where
+#                                 it was `lag` days before the latest date
+#   final[region, date]           the value in the latest file with the date
+#
+# Lag is counted from the latest date in each file, like publish-date-8.py,
+# not from the date of the file.  The gap between those two has changed
+# from version to version (see "Offset" in out/changes/incidence.txt).
+# If there is more than one version of a file, the last version counts.
+#
+# The revision factor for each region and lag is
+#
+#   sum(final) / sum(triangle at that lag)
+#
+# over the last WINDOW dates which are "settled", i.e. their final value
+# is from a file where they were more than LAGS days old.  The nowcast is
+# the latest file, with each value multiplied by the factor for its lag.
+# ZOE changed their model several times, so only recent dates are used.
+#
+# Output files in out/revisions/<series>/:
+#
+#   triangle.csv   date, region, final, lag_0 ... lag_N.  The triangle
+#                  itself.  Empty where a date was not published at a lag.
+#   factors.csv    region, lag, factor, number of dates it is based on
+#   nowcast.csv    the last LAGS+1 dates of the latest file, for each
+#                  region: published value, factor, nowcast
+#   state.npz,     the arrays, regions and files read so far, so the next
+#   state.txt      run only reads the new files.  Delete them (or use
+#                  --rebuild) if an older file changes.
+#
+# It is all arrays, so most of the time is reading the files.  watch.py
+# adds each new incidence file as it arrives.
+
+import csv
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import archive
+from catalogue import Catalogue
+import instrument
+import prefetch
+import schema
+
+SERIES = {
+    'incidence': ('download/incidence/', 'incidence_'),
+    'incidence_history': ('download/incidence_history/', 'incidence_history_'),
+    'prevalence_history': ('download/prevalence_history/',
+                           'prevalence_history_'),
+}
+
+OUT_DIR = Path('out/revisions/')
+
+DEFAULT_LAGS = 14
+DEFAULT_WINDOW = 28
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class Triangle:
+    """The revision triangle for one series, built up one file at a time.
+
+    Dates are stored as day numbers since 1970-01-01.  Date index 0 is
+    first_day.  Missing values are NaN."""
+
+    def __init__(self, lags=DEFAULT_LAGS):
+        self.lags = lags
+        self.regions = []
+        self.region_ids = {}
+        # Names of the files added, in order
+        self.snapshots = []
+        self.first_day = 0
+        # Latest date in the last file added
+        self.latest_day = None
+        self.values = np.full((0, 0, lags + 1), np.nan)
+        self.final = np.full((0, 0), np.nan)
+        # The lag of each final value, in the file it came from
+        self.final_lag = np.zeros((0, 0), dtype=np.int32)
+
+    def region_id(self, region):
+        i = self.region_ids.get(region)
+        if i is None:
+            i = len(self.regions)
+            self.regions.append(region)
+            self.region_ids[region] = i
+        return i
+
+    def _grow(self, first_day, last_day):
+        """Make room for all the regions, and the dates first_day to
+        last_day."""
+        (n_regions, n_days) = self.final.shape
+        if n_days == 0:
+            self.first_day = first_day
+        before = max(self.first_day - first_day, 0)
+        after = max(last_day - (self.first_day + n_days - 1), 0)
+        more_regions = len(self.regions) - n_regions
+        if not (before or after or more_regions):
+            return
+        pad = [(0, more_regions), (before, after)]
+        self.values = np.pad(self.values, pad + [(0, 0)],
+                             constant_values=np.nan)
+        self.final = np.pad(self.final, pad, constant_values=np.nan)
+        self.final_lag = np.pad(self.final_lag, pad)
+        self.first_day -= before
+
+    def add(self, name, columns):
+        """Add one file, read with
+        schema.read_columns(f, ['date', 'region'], floats=['mid'])."""
+        self.snapshots.append(name)
+        values = columns['mid']
+        if not len(values):
+            return
+        days = (np.array(columns['date'], dtype='datetime64[D]') -
+                EPOCH).astype(np.int64)
+        region_id = self.region_id
+        region_ids = np.array([region_id(region)
+                               for region in columns['region']],
+                              dtype=np.int64)
+
+        latest = int(days.max())
+        self._grow(int(days.min()), latest)
+        lag = latest - days
+        i = days - self.first_day
+        self.final[region_ids, i] = values
+        self.final_lag[region_ids, i] = lag
+        recent = lag <= self.lags
+        self.values[region_ids[recent], i[recent], lag[recent]] = values[recent]
+        self.latest_day = latest
+
+    def factors(self, window=DEFAULT_WINDOW):
+        """Returns (factor, count), arrays of [region, lag].  factor is NaN
+        where there is nothing to base it on."""
+        settled = (self.final_lag > self.lags) & ~np.isnan(self.final)
+        shape = (len(self.regions), self.lags + 1)
+        if not settled.any():
+            return (np.full(shape, np.nan), np.zeros(shape, dtype=np.int64))
+        day = np.arange(settled.shape[1])
+        last = day[settled.any(axis=0)].max()
+        use = settled & (day > last - window)
+
+        # [region, date, lag]
+        use = use[:, :, np.newaxis] & ~np.isnan(self.values)
+        final_sum = np.where(use, self.final[:, :, np.newaxis], 0).sum(axis=1)
+        published_sum = np.where(use, self.values, 0).sum(axis=1)
+        count = use.sum(axis=1)
+        factor = np.full(shape, np.nan)
+        np.divide(final_sum, published_sum, out=factor,
+                  where=(count > 0) & (published_sum != 0))
+        return (factor, count)
+
+    def date(self, i):
+        return str(EPOCH + self.first_day + i)
+
+
+# Saving and loading, for the next run
+
+def state_paths(out_dir):
+    return (out_dir / 'state.npz', out_dir / 'state.txt')
+
+def save(triangle, out_dir):
+    (npz_path, txt_path) = state_paths(out_dir)
+    tmp = npz_path.with_name('state.tmp.npz')
+    np.savez(tmp, values=triangle.values, final=triangle.final,
+             final_lag=triangle.final_lag)
+    tmp.replace(npz_path)
+    # The text file is written last, and says which arrays go with it
+    tmp = txt_path.with_name('state.txt.tmp')
+    with tmp.open('w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['lags', triangle.lags])
+        writer.writerow(['first_day', triangle.first_day])
+        writer.writerow(['latest_day', triangle.latest_day])
+        writer.writerow(['rows', len(triangle.regions), triangle.final.shape[1]])
+        writer.writerow(['regions'] + triangle.regions)
+        writer.writerow(['snapshots'] + triangle.snapshots)
+    tmp.replace(txt_path)
+
+def load(out_dir, lags):
+    """The saved Triangle, or an empty one if there is none (or it was made
+    with different lags)."""
+    triangle = Triangle(lags)
+    (npz_path, txt_path) = state_paths(out_dir)
+    if not txt_path.exists():
+        return triangle
+    with txt_path.open(newline='') as f:
+        state = {row[0]: row[1:] for row in csv.reader(f)}
+    if int(state['lags'][0]) != lags:
+        return triangle
+    with np.load(npz_path) as arrays:
+        if arrays['final'].shape != tuple(map(int, state['rows'])):
+            return triangle
+        triangle.values = arrays['values']
+        triangle.final = arrays['final']
+        triangle.final_lag = arrays['final_lag']
+    triangle.first_day = int(state['first_day'][0])
+    if state['latest_day'][0]:
+        triangle.latest_day = int(state['latest_day'][0])
+    for region in state['regions']:
+        triangle.region_id(region)
+    triangle.snapshots = state['snapshots']
+    return triangle
+
+
+def add_snapshot(triangle, snapshot, f=None):
+    """Add a catalogue.Snapshot.  f is the file, if it is already open."""
+    path = snapshot.path
+    print(path)
+    with instrument.input_file(path), (f or archive.open_data(path)) as f:
+        columns = schema.read_columns(f, ['date', 'region'], floats=['mid'],
+                                      path=path)
+    instrument.count('rows_parsed', len(columns['mid']))
+    triangle.add(snapshot.name, columns)
+
+def update(triangle, indir, prefix):
+    """Add the files which are not in the triangle yet.  Returns the
+    triangle, which is a new one if the files it had are not the first
+    ones any more."""
+    catalogue = Catalogue(indir, prefix)
+    names = [snapshot.name for snapshot in catalogue]
+    if names[:len(triangle.snapshots)] != triangle.snapshots:
+        triangle = Triangle(triangle.lags)
+    new = catalogue.snapshots[len(triangle.snapshots):]
+    files = prefetch.open_ahead([snapshot.path for snapshot in new])
+    for (snapshot, (_, f)) in zip(new, files):
+        add_snapshot(triangle, snapshot, f)
+    return triangle
+
+
+def number(x):
+    return '' if np.isnan(x) else float(x)
+
+def write(triangle, out_dir, window=DEFAULT_WINDOW):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    lags = range(triangle.lags + 1)
+
+    with open(out_dir / 'triangle.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'region', 'final'] +
+                        [f'lag_{lag}' for lag in lags])
+        (n_regions, n_days) = triangle.final.shape
+        for i in range(n_days):
+            date = triangle.date(i)
+            for (r, region) in enumerate(triangle.regions):
+                final = triangle.final[r, i]
+                if np.isnan(final):
+                    continue
+                writer.writerow([date, region, float(final)] +
+                                [number(v) for v in triangle.values[r, i]])
+
+    (factor, count) = triangle.factors(window)
+    with open(out_dir / 'factors.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['region', 'lag', 'factor', 'dates'])
+        for (r, region) in enumerate(triangle.regions):
+            for lag in lags:
+                writer.writerow([region, lag, number(factor[r, lag]),
+                                 int(count[r, lag])])
+
+    with open(out_dir / 'nowcast.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'region', 'lag', 'published', 'factor',
+                         'nowcast'])
+        if triangle.latest_day is not None:
+            for lag in lags:
+                i = triangle.latest_day - lag - triangle.first_day
+                if i < 0:
+                    break
+                date = triangle.date(i)
+                for (r, region) in enumerate(triangle.regions):
+                    published = triangle.values[r, i, lag]
+                    if np.isnan(published):
+                        continue
+                    writer.writerow([date, region, lag, float(published),
+                                     number(factor[r, lag]),
+                                     number(published * factor[r, lag])])
+
+    save(triangle, out_dir)
+
+
+def main():
+    args = sys.argv[1:]
+    lags = DEFAULT_LAGS
+    window = DEFAULT_WINDOW
+    rebuild = False
+    while args and args[0].startswith('--'):
+        if args[0] == '--lags' and len(args) > 1:
+            lags = int(args[1])
+            args = args[2:]
+        elif args[0] == '--window' and len(args) > 1:
+            window = int(args[1])
+            args = args[2:]
+        elif args[0] == '--rebuild':
+            rebuild = True
+            args = args[1:]
+        else:
+            args = ['--help']
+            break
+    if len(args) > 1 or (args and args[0] not in SERIES):
+        print("Usage: ./revisions.py [--lags N] [--window DAYS] [--rebuild]"
+              " [SERIES]")
+        print()
+        print("Build the revision triangle for SERIES (default: incidence),")
+        print("and the average revision factor for each lag up to N")
+        print(f"(default {DEFAULT_LAGS}), from the last DAYS settled dates"
+              f" (default {DEFAULT_WINDOW}).")
+        print("Output files are written to out/revisions/SERIES/")
+        print()
+        print("SERIES: " + ", ".join(SERIES))
+        sys.exit(2)
+
+    series = args[0] if args else 'incidence'
+    (indir, prefix) = SERIES[series]
+    out_dir = OUT_DIR / series
+    if rebuild:
+        triangle = Triangle(lags)
+    else:
+        triangle = load(out_dir, lags)
+    with instrument.stage('read'):
+        triangle = update(triangle, Path(indir), prefix)
+    with instrument.stage('write'):
+        write(triangle, out_dir, window)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -0,0 +1,146 @@
+# The columns of the ZOE files, whatever they are called this week.
+#
+# ZOE rename columns from time to time.  The central estimate in
+# incidence_*.csv was pop_mid up to v3, and covid_in_pop since v4.  The
+# confidence limits have been covid_in_pop_lolim and covid_in_pop_lo.
+# incidence_*.csv also has an unnamed first column (the row number).  Each
+# script used to keep its own list of names to try.  Now they ask for a
+# canonical name, and this finds the column:
+#
+#   for (date, region, mid) in schema.reader(f, ['date', 'region', 'mid']):
+#       ...
+#
+#   columns = schema.read_columns(f, ['date', 'region'], floats=['mid'])
+#   (date_field, mid_field) = schema.resolve(header, ['date', 'mid'])
+#   name = schema.field_name(header, 'lo')      # the name, or None
+#
+# Names which are not in ALIASES are just looked up as they are, e.g.
+# 'population'.
+#
+# The readers only split each line as far as the last column asked for, and
+# only the float columns asked for are converted.  v4+ incidence files have
+# 17 columns, and most scripts want 3 of them.
+#
+# If ZOE change the names again, add the new name to ALIASES, and the new
+# header to HEADERS.  A header which is not in HEADERS still works, as long
+# as ALIASES knows its names.
+
+import itertools
+from operator import itemgetter
+
+import fastcsv
+
+# Canonical name -> the names ZOE have used for it, in order of preference
+ALIASES = {
+    'index': [''],
+    'date': ['date'],
+    'region': ['region', 'nhser19nm'],
+    # The central estimate: number of people, or percentage for
+    # newly_sick_table
+    'mid': ['pop_mid', 'covid_in_pop', 'active_cases', 'perc_users'],
+    'lo': ['pop_low', 'covid_in_pop_lo', 'covid_in_pop_lolim',
+           'active_cases_lolim'],
+    'up': ['pop_up', 'covid_in_pop_up', 'covid_in_pop_uplim',
+           'active_cases_uplim'],
+}
+
+# The headers seen so far.  See also bench.py, which writes files like them.
+HEADERS = [
+    # incidence v1
+    ',date,region,pop_mid,pop_low,pop_up,mil_mid,mil_low,mil_up',
+    # incidence v2, v3
+    ',date,region,pop_mid,pop_low,pop_up,100k_mid,100k_low,100k_up',
+    # incidence v4+
+    ',date,region,tested,tested_positive,population,active_users,newly_sick,'
+    'covid_in_pop,covid_in_pop_lo,covid_in_pop_up,'
+    'covid_in_100k,covid_in_100k_lolim,covid_in_100k_uplim,'
+    'covid_in_mil,covid_in_mil_lolim,covid_in_mil_uplim',
+    # incidence_history
+    'date,region,covid_in_pop,covid_in_pop_lolim,covid_in_pop_uplim,'
+    'covid_in_100k,covid_in_100k_lolim,covid_in_100k_uplim',
+    # incidence_history from 20210722
+    'date,region,covid_in_pop,covid_in_pop_lo,covid_in_pop_up,'
+    'covid_in_100k,covid_in_100k_lolim,covid_in_100k_uplim',
+    # prevalence_history
+    'date,region,active_cases',
+    # prevalence_history from 20220211
+    'date,region,active_cases,active_cases_lolim,active_cases_uplim',
+    # newly_sick_table
+    'date,region,perc_users',
+]
+
+
+def canonical(header):
+    """Canonical name -> index in header, for the names which are there."""
+    columns = {}
+    for (name, aliases) in ALIASES.items():
+        for alias in aliases:
+            if alias in header:
+                columns[name] = header.index(alias)
+                break
+    return columns
+
+# tuple(header) -> canonical(header).  Starts with HEADERS, and new headers
+# are added as they are seen, so each one is only worked out once.
+_schemas = {tuple(header.split(',')): canonical(header.split(','))
+            for header in HEADERS}
+
+def find(header, field):
+    """The index in header (a list of column names) of field, or None."""
+    key = tuple(header)
+    columns = _schemas.get(key)
+    if columns is None:
+        columns = canonical(header)
+        _schemas[key] = columns
+    if field in ALIASES:
+        return columns.get(field)
+    if field in header:
+        return header.index(field)
+    return None
+
+def resolve(header, fields, path=None):
+    """The index in header of each of fields."""
+    indexes = [find(header, field) for field in fields]
+    for (field, i) in zip(fields, indexes):
+        if i is None:
+            raise Exception(f'{path}: could not find one of '
+                            f'{ALIASES.get(field, [field])}')
+    return indexes
+
+def field_name(header, field):
+    """The name of the column in header for field, or None."""
+    i = find(header, field)
+    return None if i is None else header[i]
+
+def reader(f, fields, path=None):
+    """Yields a tuple of the values of fields, for each row of f (a text
+    file).  The values are strings.  An empty file has no rows, and is not
+    an error."""
+    line = f.readline()
+    if not line:
+        return
+    if '"' in line:
+        # A quoted header, e.g. incidence table_*.csv
+        rows = fastcsv.reader(itertools.chain([line], f))
+        header = next(rows)
+    else:
+        header = line.rstrip('\r\n').split(',')
+        rows = None
+    indexes = resolve(header, fields, path)
+    if rows is None:
+        rows = fastcsv.reader(f, max(indexes, default=-1) + 1)
+
+    if len(indexes) == 1:
+        [i] = indexes
+        get = lambda row: (row[i],)
+    else:
+        get = itemgetter(*indexes)
+    for row in rows:
+        if row:
+            yield get(row)
+
+def read_columns(f, fields, floats=(), path=None):
+    """fastcsv.read_columns(), with canonical names."""
+    return fastcsv.read_columns(
+        f, fields, floats,
+        resolve=lambda header, names: resolve(header, names, path))
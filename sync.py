@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#
+# Download ZOE files into download/.  A Python version of fetch.sh.
+#
+#   ./sync.py                      # from the real buckets, using gsutil
+#   ./sync.py --source DIR         # from a local copy of the buckets
+#
+# With --source, DIR stands in for gs://, e.g. the incidence files are
+# DIR/covid-public-data/csv/incidence_*.csv.  This is useful for tests,
+# or if you have a mirror on another machine.
+#
+# Differences from fetch.sh:
+#
+#  1. Only missing or changed files are downloaded.  The size, upload time
+#     and checksum (if available) of each file is recorded in
+#     download/manifest.csv.  Only sync.py reads the manifest.  The other
+#     scripts find the files by name (see catalogue.py), and decide what
+#     is new from their own outputs.
+#  2. If a file has changed since we downloaded it, the old file is kept.
+#     The new version is saved alongside it, with the upload time added to
+#     the name, e.g. incidence_20230501-upload-08T13:10Z.csv.  ZOE do
+#     sometimes re-upload files on the same day, or even days later.
+#  3. Files are written to a temporary name and then renamed, so an
+#     interrupted download never leaves a partial file.
+#  4. Several files are downloaded at once.
+
+import base64
+import csv
+import datetime
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import archive
+import instrument
+
+DOWNLOAD_DIR = 'download'
+MANIFEST = 'manifest.csv'
+
+# (object pattern, download subdirectory).  {dates} is filled in below.
+SERIES = [
+    ('covid-public-data/csv/incidence_{dates}.csv', 'incidence'),
+    ('covid-public-data/csv/RevisedStats/prevalence_history_{dates}.csv', 'prevalence_history'),
+    ('covid-public-data/csv/RevisedStats/incidence_history_{dates}.csv', 'incidence_history'),
+    ('covid-public-data/csv/utla_prevalence_map_{dates}.csv', 'utla_prevalence_map'),
+    ('covid-public-data/csv/lad_prevalence_map_{dates}.csv', 'lad_prevalence_map'),
+    ('terraform-covid-website-data-prod/personalized_assets/backup_files/newly_sick_table_{dates}.csv', 'newly_sick_table'),
+]
+
+# name: object name, relative to the root of the source.
+# updated: upload time, as an ISO 8601 string in UTC.
+# checksum: base64 MD5 like Google Cloud Storage uses, or None if unknown.
+Object = namedtuple('Object', ('name', 'size', 'updated', 'checksum'))
+
+MANIFEST_FIELDS = ['file', 'object', 'size', 'updated', 'checksum']
+
+
+def md5_base64(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return base64.b64encode(h.digest()).decode('ascii')
+
+
+class LocalSource:
+    """A local directory, standing in for gs://"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def list(self, pattern):
+        (dirname, glob) = pattern.rsplit('/', 1)
+        d = self.root / dirname
+        objects = []
+        for path in sorted(d.glob(glob)):
+            st = path.stat()
+            updated = datetime.datetime.fromtimestamp(
+                int(st.st_mtime), datetime.timezone.utc)
+            objects.append(Object(f'{dirname}/{path.name}', st.st_size,
+                                  updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                  md5_base64(path)))
+        return objects
+
+    def download(self, obj, dest):
+        shutil.copyfile(self.root / obj.name, dest)
+
+
+class GsutilSource:
+    """Google Cloud Storage, using gsutil from google-cloud-sdk."""
+
+    def list(self, pattern):
+        # Output lines look like:
+        #     123456  2023-03-20T18:05:12Z  gs://covid-public-data/csv/...
+        #  TOTAL: ...
+        out = subprocess.run(['gsutil', 'ls', '-l', 'gs://' + pattern],
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            # e.g. no files for the dates yet
+            if 'matched no objects' in out.stderr:
+                return []
+            sys.stderr.write(out.stderr)
+            out.check_returncode()
+        objects = []
+        for line in out.stdout.splitlines():
+            fields = line.split()
+            if len(fields) != 3 or not fields[2].startswith('gs://'):
+                continue
+            (size, updated, url) = fields
+            objects.append(Object(url[len('gs://'):], int(size), updated, None))
+        return objects
+
+    def download(self, obj, dest):
+        subprocess.run(['gsutil', '-q', 'cp', 'gs://' + obj.name, str(dest)],
+                       check=True)
+
+
+def read_manifest(path):
+    manifest = {}
+    try:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                row['size'] = int(row['size'])
+                row['checksum'] = row['checksum'] or None
+                manifest[row['file']] = row
+    except FileNotFoundError:
+        pass
+    return manifest
+
+def write_manifest(path, manifest):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.DictWriter(f, MANIFEST_FIELDS)
+        writer.writeheader()
+        for file in sorted(manifest):
+            writer.writerow(manifest[file])
+    os.replace(tmp, path)
+
+def changed(obj, row):
+    if obj.checksum and row['checksum']:
+        return obj.checksum != row['checksum']
+    return obj.size != row['size'] or obj.updated != row['updated']
+
+def upload_name(filename, updated):
+    # e.g. incidence_20230501.csv, 2023-05-08T13:10:02Z
+    #  ->  incidence_20230501-upload-08T13:10Z.csv
+    stem = filename[:-len('.csv')]
+    return f'{stem}-upload-{updated[8:10]}T{updated[11:16]}Z.csv'
+
+
+def plan(source, download_dir, manifest, dates):
+    """Returns a list of (object, local file) to download."""
+    todo = []
+    for (pattern, subdir) in SERIES:
+        pattern = pattern.format(dates=dates)
+        objects = source.list(pattern)
+        # Every version of an object which we already have.
+        versions = {}
+        for row in manifest.values():
+            versions.setdefault(row['object'], []).append(row)
+
+        for obj in objects:
+            filename = obj.name.rsplit('/', 1)[1]
+            file = f'{subdir}/{filename}'
+            have = versions.get(obj.name)
+            if not have:
+                path = archive.find(Path(download_dir) / file)
+                if path:
+                    # Downloaded before we had a manifest, e.g. by fetch.sh.
+                    # Assume it's the same version, unless the size differs.
+                    # If compact.py has compressed it, we can't tell.
+                    size = obj.size
+                    if not archive.compression(path):
+                        size = path.stat().st_size
+                    row = {'file': file, 'object': obj.name,
+                           'size': size,
+                           'updated': obj.updated, 'checksum': None}
+                    manifest[file] = row
+                    if not changed(obj, row):
+                        continue
+                    have = [row]
+                else:
+                    todo.append((obj, file))
+                    continue
+            if any(not changed(obj, row) for row in have):
+                continue
+            # A new upload of a file we already have.  Keep both.
+            todo.append((obj, f'{subdir}/{upload_name(filename, obj.updated)}'))
+    return todo
+
+def fetch(source, obj, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.parent / f'.{path.name}.tmp'
+    source.download(obj, tmp)
+    os.replace(tmp, path)
+
+def sync(source, download_dir=DOWNLOAD_DIR, dates=None, jobs=8, dry_run=False):
+    if dates is None:
+        dates = '202[3-9]*'
+        # It may have been compressed by compact.py
+        if not archive.find(Path(download_dir) /
+                            'lad_prevalence_map/lad_prevalence_map_20221231.csv'):
+            dates = '202*'
+
+    manifest_path = Path(download_dir) / MANIFEST
+    manifest = read_manifest(manifest_path)
+    with instrument.stage('list'):
+        todo = plan(source, download_dir, manifest, dates)
+
+    for (obj, file) in todo:
+        print(f'{obj.name} -> {file}')
+    if dry_run:
+        return todo
+
+    def task(item):
+        (obj, file) = item
+        fetch(source, obj, Path(download_dir) / file)
+        return item
+
+    try:
+        with (instrument.stage('download'),
+              ThreadPoolExecutor(max_workers=jobs) as pool):
+            for (obj, file) in pool.map(task, todo):
+                instrument.count('files_downloaded')
+                instrument.count('bytes_downloaded', obj.size)
+                manifest[file] = {'file': file, 'object': obj.name,
+                                  'size': obj.size, 'updated': obj.updated,
+                                  'checksum': obj.checksum}
+    finally:
+        # Record whatever we managed to download.
+        Path(download_dir).mkdir(parents=True, exist_ok=True)
+        write_manifest(manifest_path, manifest)
+    return todo
+
+
+def main():
+    args = sys.argv[1:]
+    source = None
+    jobs = 8
+    dry_run = False
+    while args:
+        if args[0] == '--source' and len(args) > 1:
+            source = LocalSource(args[1])
+            args = args[2:]
+        elif args[0] == '--jobs' and len(args) > 1:
+            jobs = int(args[1])
+            args = args[2:]
+        elif args[0] == '--dry-run':
+            dry_run = True
+            args = args[1:]
+        else:
+            print("Usage: ./sync.py [--source DIR] [--jobs N] [--dry-run]")
+            print()
+            print("Download new and changed ZOE files into download/.")
+            print("DIR is a local directory to use instead of gs://")
+            sys.exit(2)
+    if source is None:
+        source = GsutilSource()
+    sync(source, jobs=jobs, dry_run=dry_run)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
@@ -0,0 +1,5 @@
+# The scripts are in the directory above, and are imported as modules.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
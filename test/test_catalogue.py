@@ -0,0 +1,48 @@
+import datetime
+import re
+from pathlib import Path
+
+import archive
+import catalogue
+
+SAMPLE = Path(__file__).parent.parent / 'download-sample'
+
+# The only names in download-sample which are just a note
+NOTES = {'morning', 'overwritten-maybe-v6'}
+
+
+def test_parse_name():
+    t = datetime.datetime
+    d = datetime.date(2023, 7, 6)
+    assert catalogue.parse_name('20230706') == (d, None, '')
+    assert catalogue.parse_name('20230706-1800') == (d, t(2023, 7, 6, 18, 0), '')
+    assert catalogue.parse_name('20230706-2100Z') == (d, t(2023, 7, 6, 21, 0), '')
+    assert catalogue.parse_name('20230706-08T0900') == (d, t(2023, 7, 8, 9, 0), '')
+    assert catalogue.parse_name('20230706-02T0900') == (d, t(2023, 8, 2, 9, 0), '')
+    assert (catalogue.parse_name('20230706-upload-08T13:10Z') ==
+            (d, t(2023, 7, 8, 13, 10), ''))
+    for name in ['20230706-20230710-0735Z', '20230706-20230710T0735Z',
+                 '20230706-20230710T-0735Z']:
+        assert catalogue.parse_name(name) == (d, t(2023, 7, 10, 7, 35), '')
+    assert catalogue.parse_name('20230706-20230710') == (d, t(2023, 7, 10), '')
+    for name in ['20230706-download-20230710', '20230706-download-2023-07-10']:
+        assert catalogue.parse_name(name) == (d, t(2023, 7, 10), 'download')
+    assert catalogue.parse_name('20230706-morning') == (d, None, 'morning')
+
+def test_sample_names():
+    # Every name with more than a date is understood, apart from the notes
+    for path in SAMPLE.glob('*/*.csv*'):
+        name = archive.csv_name(path)
+        name = re.search(r'_(\d{8}.*)\.csv$', name).group(1)
+        (date, upload, variant) = catalogue.parse_name(name)
+        if variant in NOTES:
+            continue
+        assert variant in ['', 'download'], path
+        assert (upload is None) == (name == name[:8]), path
+
+def test_final():
+    c = catalogue.Catalogue(SAMPLE / 'prevalence_history', 'prevalence_history_')
+    versions = c.versions(datetime.date(2023, 7, 6))
+    assert [v.name for v in versions] == ['20230706-download-20230708',
+                                          '20230706-20230710T-0735Z']
+    assert c.is_final(versions[-1])
@@ -0,0 +1,25 @@
+import numpy as np
+
+import columnar
+
+
+def test_convert_dates():
+    expected = np.array(['2023-03-01', '2021-12-31'], dtype='datetime64[D]')
+    for values in [['2023-03-01', '2021-12-31'], ['20230301', '20211231']]:
+        (kind, array) = columnar.convert('date', values)
+        assert kind == 'date'
+        assert (array == expected).all()
+
+def test_convert_not_dates():
+    # Only columns with 'date' in the name are dates
+    (kind, array) = columnar.convert('name', ['20230301'])
+    assert kind == 'int'
+
+def test_convert_types():
+    assert columnar.convert('n', ['1', '2'])[0] == 'int'
+    (kind, array) = columnar.convert('x', ['1.5', ''])
+    assert kind == 'float'
+    assert array[0] == 1.5 and np.isnan(array[1])
+    (kind, (codes, categories)) = columnar.convert('region', ['a', 'b', 'a'])
+    assert kind == 'string'
+    assert list(categories[codes]) == ['a', 'b', 'a']
@@ -0,0 +1,60 @@
+import csv
+import io
+
+import numpy as np
+import pytest
+
+import fastcsv
+
+SIMPLE = 'date,region,active_cases\n2023-07-01,London,1.5\n\n2023-07-01,Wales,2\n'
+
+# Like the header of "incidence table_*.csv": quotes, with a comma and a
+# newline inside the names.
+QUOTED = ('"region","# total\ntests","population, total"\r\n'
+          'London,10,8908081\r\n'
+          '"Wales, not England",N/A,3138631\r\n'
+          'Scotland,5,5438100\r\n')
+
+
+def test_reader():
+    assert list(fastcsv.reader(io.StringIO(SIMPLE))) == [
+        ['date', 'region', 'active_cases'],
+        ['2023-07-01', 'London', '1.5'],
+        [],
+        ['2023-07-01', 'Wales', '2'],
+    ]
+    assert list(fastcsv.reader(io.StringIO(SIMPLE), 1))[1] == [
+        '2023-07-01', 'London,1.5']
+
+def test_reader_quoted():
+    # The same as the csv module, from the first quote on
+    expected = list(csv.reader(io.StringIO(QUOTED, newline='')))
+    assert list(fastcsv.reader(io.StringIO(QUOTED, newline=''))) == expected
+    assert expected[0] == ['region', '# total\ntests', 'population, total']
+    # Quotes part way through the file
+    data = 'a,b\n1,2\n"3,4",5\n6,7\n'
+    assert list(fastcsv.reader(io.StringIO(data, newline=''))) == [
+        ['a', 'b'], ['1', '2'], ['3,4', '5'], ['6', '7']]
+
+def test_dict_reader():
+    rows = list(fastcsv.DictReader(io.StringIO('a,b\n1\n\n1,2,3\n')))
+    assert rows == [{'a': '1', 'b': None}, {'a': '1', 'b': '2', None: ['3']}]
+
+def test_read_columns():
+    columns = fastcsv.read_columns(io.StringIO(SIMPLE), ['region'],
+                                   floats=['active_cases'])
+    assert columns['region'] == ['London', 'Wales']
+    assert columns['active_cases'].dtype == np.float64
+    assert list(columns['active_cases']) == [1.5, 2.0]
+
+def test_read_columns_quoted():
+    columns = fastcsv.read_columns(io.StringIO(QUOTED, newline=''),
+                                   ['region', '# total\ntests'],
+                                   floats=['population, total'])
+    assert columns['region'] == ['London', 'Wales, not England', 'Scotland']
+    assert columns['# total\ntests'] == ['10', 'N/A', '5']
+    assert list(columns['population, total']) == [8908081, 3138631, 5438100]
+
+def test_read_columns_missing():
+    with pytest.raises(KeyError, match='nope'):
+        fastcsv.read_columns(io.StringIO(SIMPLE), ['nope'])
@@ -0,0 +1,47 @@
+import shutil
+from pathlib import Path
+
+import archive
+import compact
+import history_store
+
+SAMPLE = Path(__file__).resolve().parent.parent / 'download-sample'
+
+
+def test_split_blocks():
+    data = (b'date,region,active_cases\n'
+            b'2021-05-04,London,1.5\n'
+            b'2021-05-04,Wales,2\r\n'
+            b'2021-05-05,London,3\n'
+            b'2021-05-05,Wales,4')
+    blocks = history_store.split_blocks(data)
+    assert [date for (date, _) in blocks] == ['', '2021-05-04', '2021-05-05']
+    assert b''.join(block for (_, block) in blocks) == data
+
+def test_split_blocks_no_date():
+    data = b'a,b\n1,2\n3,4\n'
+    blocks = history_store.split_blocks(data)
+    assert b''.join(block for (_, block) in blocks) == data
+    assert history_store.split_blocks(b'') == []
+
+def test_split_blocks_sample():
+    for path in sorted((SAMPLE / 'prevalence_history').glob('*.csv'))[:3]:
+        data = path.read_bytes()
+        blocks = history_store.split_blocks(data)
+        assert b''.join(block for (_, block) in blocks) == data
+
+def test_add_compact_read(tmp_path):
+    originals = {}
+    for path in sorted((SAMPLE / 'prevalence_history').glob('*.csv'))[:3]:
+        shutil.copy(path, tmp_path)
+        originals[path.name] = path.read_bytes()
+
+    history_store.add(tmp_path)
+    compact.compact([tmp_path])
+    assert (tmp_path / history_store.STORE_DIR / 'index.csv').exists()
+
+    for (name, data) in originals.items():
+        path = archive.find(tmp_path / name)
+        assert archive.compression(path) == history_store.SUFFIX
+        with archive.open_data(path, 'rb') as f:
+            assert f.read() == data
@@ -0,0 +1,50 @@
+import csv
+import io
+
+import partition
+
+
+def key(*values):
+    return partition.partition_key(list(values), {})
+
+def test_partition_key():
+    assert key('East of England') == 'East of England'
+    assert key('E06000001', '3') == 'E06000001_3'
+    # Joining with '_' must not make different keys the same
+    assert key('a_b', 'c') != key('a', 'b_c')
+    assert key('a', '') != key('a_', '') != key('a%', '')
+    # Nothing which could be another directory, or a hidden file
+    for values in [['/etc/passwd'], ['..'], ['.'], ['.x'], ['a\nb']]:
+        name = key(*values)
+        assert '/' not in name and '\n' not in name
+        assert not name.startswith('.')
+    # Empty values are allowed
+    assert key('') == '%'
+    assert key('', '') == '%_%'
+
+def test_partition_key_values():
+    key_values = {}
+    a = partition.partition_key(['a_b', 'c'], key_values)
+    b = partition.partition_key(['a', 'b_c'], key_values)
+    assert key_values == {a: ['a_b', 'c'], b: ['a', 'b_c']}
+
+def test_partition(tmp_path):
+    data = (b'date,region\r\n'
+            b'2023-07-01,London\r\n'
+            b'2023-07-01,\r\n'
+            b'2023-07-02,London\r\n'
+            b'2023-07-02,"a_b"\r\n')
+    writers = partition.partition(io.BytesIO(data), tmp_path, ['region'])
+    assert writers.counts == {'London': 2, '%': 1, 'a%5Fb': 1}
+    assert (tmp_path / 'London.csv').read_bytes() == (
+        b'date,region\r\n'
+        b'2023-07-01,London\r\n'
+        b'2023-07-02,London\r\n')
+    with open(tmp_path / 'manifest.csv', newline='') as f:
+        manifest = list(csv.reader(f))
+    assert [row[:3] for row in manifest] == [
+        ['region', 'file', 'rows'],
+        ['', '%.csv', '1'],
+        ['London', 'London.csv', '2'],
+        ['a_b', 'a%5Fb.csv', '1'],
+    ]
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+import prefetch
+
+
+def test_read_ahead_order():
+    # The later files are read faster, but still come out in order
+    paths = list(range(8))
+    def read(path):
+        time.sleep((len(paths) - path) * 0.005)
+        return path * 10
+    for depth in [0, 1, 4]:
+        result = list(prefetch.read_ahead(paths, read=read, depth=depth,
+                                          size=lambda path: 1))
+        assert result == [(path, path * 10) for path in paths]
+
+def test_read_ahead_stop():
+    # If the caller stops early, the rest are not read
+    paths = list(range(100))
+    lock = threading.Lock()
+    read_paths = []
+    def read(path):
+        with lock:
+            read_paths.append(path)
+        time.sleep(0.01)
+        return path
+    files = prefetch.read_ahead(paths, read=read, depth=2,
+                                size=lambda path: 1)
+    assert next(files) == (0, 0)
+    files.close()
+    # The ones already started are finished, but no more
+    assert len(read_paths) <= 3
+    assert sorted(read_paths) == list(range(len(read_paths)))
+
+def test_read_ahead_max_bytes():
+    # Only one big file is held at once
+    lock = threading.Lock()
+    reading = []
+    most = 0
+    def read(path):
+        nonlocal most
+        with lock:
+            reading.append(path)
+            most = max(most, len(reading))
+        time.sleep(0.005)
+        with lock:
+            reading.remove(path)
+        return path
+    result = list(prefetch.read_ahead(range(6), read=read, depth=4,
+                                      max_bytes=100, size=lambda path: 100))
+    assert result == [(path, path) for path in range(6)]
+    assert most == 1
+
+def test_read_ahead_error():
+    # An error is raised when its file comes up, not before
+    def read(path):
+        if path == 2:
+            raise OSError('bad file')
+        return path
+    files = prefetch.read_ahead(range(4), read=read, depth=4,
+                                size=lambda path: 1)
+    assert next(files) == (0, 0)
+    assert next(files) == (1, 1)
+    with pytest.raises(OSError, match='bad file'):
+        next(files)
+
+def test_open_ahead(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'{i}.csv'
+        path.write_text(f'a,b\n{i},x\n')
+        paths.append(path)
+    for (path, f) in prefetch.open_ahead(paths, depth=2):
+        with f:
+            assert f.readline() == 'a,b\n'
+            f.seek(0)
+            assert f.read() == path.read_text()
@@ -0,0 +1,75 @@
+import argparse
+import csv
+import math
+
+import bench
+import prevalence_digest
+
+# The small digests.  Their rows are in the same order, sharded or not.
+SMALL = ['region.csv', 'age.csv', 'imd.csv', 'age_imd.csv',
+         'age_group_to_covid_rate.csv', 'age_group_to_u_fraction.csv',
+         'age_group_to_response_rate.csv']
+# One row per UTLA or LAD, in shard order
+BIG = ['utla.csv', 'utla_8d_average.csv', 'lad_14d_average.csv',
+       'lsoa_count.csv']
+
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+def same_value(a, b):
+    try:
+        (a, b) = (float(a), float(b))
+    except ValueError:
+        return a == b
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+
+def assert_same_rows(rows, sharded_rows, filename):
+    assert len(rows) == len(sharded_rows), filename
+    for (row, sharded_row) in zip(rows, sharded_rows):
+        assert len(row) == len(sharded_row), filename
+        assert all(same_value(a, b) for (a, b) in zip(row, sharded_row)), (
+            filename, row, sharded_row)
+
+def test_sharded_same(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(seed=1, last='2023-03-01', snapshots=1,
+                              trend_days=16, utla=12, lad=20)
+    gen = bench.Generator(tmp_path, args)
+    gen.generate_trend()
+    path = gen.trend_path
+    # Different factors within each (date, region), so it matters which
+    # row the age and imd totals take them from.  Only where
+    # parse_values() doesn't check them, and not in the first row, which
+    # region.csv is checked against.
+    rows = read_rows(path)
+    header = rows[0]
+    (date, region, ccp, factor, factor_prob) = [
+        header.index(field) for field in
+        ['date', 'region', 'corrected_covid_positive', 'factor', 'factor_prob']]
+    seen = set()
+    for (i, row) in enumerate(rows[1:]):
+        keys = (row[date], row[region])
+        if keys in seen and row[ccp] == '':
+            row[factor] = repr(float(row[factor]) * (1 + i % 7))
+            row[factor_prob] = repr(float(row[factor_prob]) * (1 + i % 5))
+        seen.add(keys)
+    with open(path, 'w', newline='') as f:
+        csv.writer(f, lineterminator='\n').writerows(rows)
+
+    name = path.name[:-len('.csv')]
+    outdir = tmp_path / 'out/prevalence_digest' / name
+    with open(path) as infile:
+        prevalence_digest.main(infile, str(path))
+    unsharded = outdir.rename(tmp_path / 'unsharded')
+    with open(path, 'rb') as infile:
+        prevalence_digest.main_sharded(infile, str(path), shards=5, jobs=1)
+
+    for filename in SMALL + BIG:
+        rows = read_rows(unsharded / filename)
+        sharded_rows = read_rows(outdir / filename)
+        if filename in BIG:
+            rows.sort()
+            sharded_rows.sort()
+        assert_same_rows(rows, sharded_rows, filename)
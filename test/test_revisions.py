@@ -0,0 +1,73 @@
+import numpy as np
+
+import revisions
+
+
+def snapshot(dates, values, regions=('London', 'Wales')):
+    """Columns like schema.read_columns(), for each region on each date."""
+    columns = {'date': [], 'region': [], 'mid': []}
+    for (date, by_region) in zip(dates, values):
+        for (region, value) in zip(regions, by_region):
+            columns['date'].append(date)
+            columns['region'].append(region)
+            columns['mid'].append(value)
+    columns['mid'] = np.array(columns['mid'], dtype=np.float64)
+    return columns
+
+def test_add():
+    t = revisions.Triangle(lags=2)
+    t.add('a', snapshot(['2023-07-01', '2023-07-02'], [[1, 10], [2, 20]]))
+    # A later file, which starts later, and revises 2023-07-02
+    t.add('b', snapshot(['2023-07-02', '2023-07-03'], [[3, 30], [4, 40]]))
+    assert t.snapshots == ['a', 'b']
+    assert t.regions == ['London', 'Wales']
+    assert t.date(0) == '2023-07-01'
+    assert t.latest_day == t.first_day + 2
+    london = t.region_ids['London']
+    # [date, lag]
+    assert np.array_equal(t.values[london], [[np.nan, 1, np.nan],
+                                             [2, 3, np.nan],
+                                             [4, np.nan, np.nan]],
+                          equal_nan=True)
+    assert list(t.final[london]) == [1, 3, 4]
+    assert list(t.final_lag[london]) == [1, 1, 0]
+
+def test_add_earlier():
+    # A file which starts before the first one grows the triangle backwards
+    t = revisions.Triangle(lags=1)
+    t.add('a', snapshot(['2023-07-05'], [[5, 50]]))
+    t.add('b', snapshot(['2023-07-03', '2023-07-04'], [[3, 30], [4, 40]]))
+    assert t.date(0) == '2023-07-03'
+    assert list(t.final[t.region_ids['Wales']]) == [30, 40, 50]
+
+def test_add_empty():
+    t = revisions.Triangle()
+    t.add('a', snapshot([], []))
+    assert t.snapshots == ['a']
+    assert t.latest_day is None
+
+def test_factors():
+    t = revisions.Triangle(lags=1)
+    dates = [f'2023-07-{day:02}' for day in range(1, 11)]
+    # Each date is first published at half its final value
+    for n in range(1, len(dates) + 1):
+        values = [[day, 10 * day] for day in range(1, n + 1)]
+        values[-1] = [n / 2, 10 * n / 2]
+        t.add(str(n), snapshot(dates[:n], values))
+    (factor, count) = t.factors(window=28)
+    # Settled: final value from a file where the date was more than 1 day
+    # old, i.e. the dates up to 2023-07-08
+    assert count.tolist() == [[8, 8], [8, 8]]
+    assert np.allclose(factor[:, 0], 2)
+    assert np.allclose(factor[:, 1], 1)
+    # Only the last 3 settled dates
+    (factor, count) = t.factors(window=3)
+    assert count.tolist() == [[3, 3], [3, 3]]
+
+def test_factors_nothing_settled():
+    t = revisions.Triangle(lags=3)
+    t.add('a', snapshot(['2023-07-01'], [[1, 2]]))
+    (factor, count) = t.factors()
+    assert factor.shape == (2, 4)
+    assert np.isnan(factor).all()
+    assert not count.any()
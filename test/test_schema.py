@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+import schema
+
+
+@pytest.mark.parametrize('header', schema.HEADERS)
+def test_resolve_headers(header):
+    header = header.split(',')
+    (date, region) = schema.resolve(header, ['date', 'region'])
+    assert header[date] == 'date'
+    assert header[region] == 'region'
+    [mid] = schema.resolve(header, ['mid'])
+    assert header[mid] in schema.ALIASES['mid']
+    # Where there are confidence limits, they are found too, and they are
+    # not the central estimate.
+    for field in ['lo', 'up']:
+        i = schema.find(header, field)
+        if i is not None:
+            assert header[i] in schema.ALIASES[field]
+            assert i != mid
+
+def test_resolve_names():
+    incidence_v4 = schema.HEADERS[2].split(',')
+    assert schema.field_name(incidence_v4, 'mid') == 'covid_in_pop'
+    assert schema.field_name(incidence_v4, 'lo') == 'covid_in_pop_lo'
+    assert schema.field_name(incidence_v4, 'index') == ''
+    # Not in ALIASES
+    assert schema.field_name(incidence_v4, 'population') == 'population'
+    prevalence = schema.HEADERS[5].split(',')
+    assert schema.field_name(prevalence, 'lo') is None
+
+def test_resolve_unknown_header():
+    # A header which is not in HEADERS
+    header = ['region', 'extra', 'date', 'active_cases']
+    assert schema.resolve(header, ['date', 'region', 'mid']) == [2, 0, 3]
+
+def test_resolve_missing():
+    with pytest.raises(Exception, match='could not find'):
+        schema.resolve(['date', 'region'], ['mid'], 'x.csv')
+
+def test_reader():
+    data = ',date,region,pop_mid,pop_low\n0,2020-09-01,London,5.5,1\n'
+    rows = list(schema.reader(io.StringIO(data), ['region', 'mid']))
+    assert rows == [('London', '5.5')]
+    rows = list(schema.reader(io.StringIO(data), ['mid']))
+    assert rows == [('5.5',)]
+
+def test_reader_empty():
+    assert list(schema.reader(io.StringIO(''), ['date'])) == []
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+#
+# Keep out/ up to date, as new files arrive in download/.
+#
+#   ./watch.py                  # look for new files every minute
+#   ./watch.py --interval 10    # every 10 seconds
+#   ./watch.py --once           # bring everything up to date, and exit
+#
+# Run sync.py (or fetch.sh) from cron as usual, and leave this running.
+#
+# At the start, this does the same work as running the scripts.  After
+# that, when a new file arrives, only the new file is read.  What the
+# scripts would have worked out from the older files is kept in memory:
+# the totals from the last file for jump.py, the state of the changes.py
+# trackers, the prevalence panel, the maps for check_pd.py.  So a new
+# incidence file gives
+#
+#   out/publish-date-8.incidence.*.csv    one more line
+#   out/jump/incidence.csv                one more line
+#   out/changes/incidence.txt             a new paragraph, if anything changed
+#   out/prevalence_from_incidence_/       one more file, which is then checked
+#   out/revisions/incidence/              the triangle, updated
+#
+# in a second or so, instead of the minutes it takes to run the scripts.
+#
+# It polls, because inotify is not in the standard library, and looking at
+# a few directories once a minute costs nothing.  Files should appear all
+# at once: sync.py downloads to a temporary name and then renames.
+#
+# New files are expected to come after the old ones, both in name order
+# (which jump.py and publish-date-8.py use) and in catalogue.py order
+# (which changes.py uses).  If not, e.g. a re-upload of an older day, or
+# if an old file changes or disappears, the outputs for that series are
+# rebuilt from scratch.  Same if something fails: it is reported, and the
+# series is rebuilt on the next poll.
+#
+# Only the corrected_prevalence_region_trend_*.csv files are digested,
+# because those are the ones check_pd.py can check.
+
+import csv
+import io
+import os
+import sys
+import time
+import traceback
+from functools import partial
+from pathlib import Path
+
+import archive
+from catalogue import Catalogue, make_snapshot, sort_key
+import changes
+import check_p_from_i
+import check_pd
+import instrument
+import jump
+import newly_sick_table
+import nova
+import prefetch
+import prevalence_digest
+import prevalence_from_incidence
+import prevalence_panel
+import revisions
+
+DEFAULT_INTERVAL = 60
+
+
+def write_text(path, text):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with tmp.open('w') as f:
+        f.write(text)
+    tmp.replace(path)
+
+
+# Outputs.  Each one has
+#
+#   rebuild(indir, prefix)  do it all again, from every file
+#   add(snapshot)           a new file, which comes after all the others
+
+class Changes:
+    """out/changes/<series>.txt, using a tracker from changes.py."""
+
+    def __init__(self, track, out_path):
+        self.track = track
+        self.out_path = out_path
+
+    def rebuild(self, indir, prefix):
+        self.buffer = io.StringIO()
+        self.tracker = self.track(self.buffer)
+        next(self.tracker)
+        self.last = None
+        catalogue = Catalogue(indir, prefix)
+        files = prefetch.open_ahead([snapshot.path for snapshot in catalogue])
+        for (snapshot, (path, infile)) in zip(catalogue, files):
+            self.tracker.send((snapshot, infile))
+            self.last = snapshot.name
+        self.write()
+
+    def add(self, snapshot):
+        self.tracker.send((snapshot, archive.open_data(snapshot.path)))
+        self.last = snapshot.name
+        self.write()
+
+    def write(self):
+        # The file ends with the name of the last snapshot.  See
+        # changes.track_all().
+        text = self.buffer.getvalue()
+        if self.last is not None:
+            text += f'{self.last}\n'
+        write_text(self.out_path, text)
+
+class Jump:
+    """out/jump/<series>.csv.  Keeps the totals from the last file."""
+
+    def __init__(self, prefix, out_path):
+        self.prefix = prefix
+        self.out_path = Path(out_path)
+
+    def rebuild(self, indir, prefix):
+        self.out_path.parent.mkdir(parents=True, exist_ok=True)
+        self.prev_values = None
+        with open(self.out_path, 'w') as outfile:
+            writer = csv.writer(outfile)
+            paths = sorted(archive.glob(indir, prefix + '*.csv'))
+            for (path, f) in prefetch.open_ahead(paths):
+                self._add(path, f, writer)
+
+    def add(self, snapshot):
+        with open(self.out_path, 'a') as outfile:
+            self._add(snapshot.path, archive.open_data(snapshot.path),
+                      csv.writer(outfile))
+
+    def _add(self, path, f, writer):
+        print(path)
+        with instrument.input_file(path), f:
+            values = jump.parse_values(f, path)
+        if values is None:
+            return
+        if self.prev_values:
+            writer.writerow(jump.compare(self.prefix, self.prev_values, values))
+        self.prev_values = values
+
+class PubHistory:
+    """out/publish-date-8.incidence.{England,UK}.csv"""
+
+    def __init__(self, en_path, uk_path):
+        self.en_path = en_path
+        self.uk_path = uk_path
+
+    def rebuild(self, indir, prefix):
+        with (open(self.en_path, 'wb') as out_en,
+              open(self.uk_path, 'wb') as out_uk):
+            nova.pub_history(indir, prefix, out_en, out_uk)
+
+    def add(self, snapshot):
+        print(snapshot.path)
+        with (open(self.en_path, 'ab') as out_en,
+              open(self.uk_path, 'ab') as out_uk):
+            nova.publish_date_8.pub_history_file(snapshot.path, snapshot.name,
+                                                 out_en, out_uk)
+
+class Rerun:
+    """Call a function again, for each new file.  For outputs which already
+    skip the files they have done, like prevalence_from_incidence.py, or
+    which are cheap anyway."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def rebuild(self, indir, prefix):
+        self.function()
+
+    def add(self, snapshot):
+        self.function()
+
+class Revisions:
+    """out/revisions/<series>/.  Keeps the revision triangle in memory."""
+
+    def __init__(self, series):
+        self.out_dir = revisions.OUT_DIR / series
+
+    def rebuild(self, indir, prefix):
+        self.triangle = revisions.update(
+            revisions.Triangle(revisions.DEFAULT_LAGS), indir, prefix)
+        revisions.write(self.triangle, self.out_dir)
+
+    def add(self, snapshot):
+        revisions.add_snapshot(self.triangle, snapshot)
+        revisions.write(self.triangle, self.out_dir)
+
+class Maps:
+    """The maps for check_pd.py, kept in memory."""
+
+    def __init__(self, code_field):
+        self.code_field = code_field
+        self.maps = []
+
+    def rebuild(self, indir, prefix):
+        self.maps = check_pd.read_maps(indir, prefix, self.code_field)
+
+    def add(self, snapshot):
+        self.maps.append(check_pd.Map(snapshot, self.code_field))
+
+class Digests:
+    """out/prevalence_digest/, for each trend file which is not done yet."""
+
+    def rebuild(self, indir, prefix):
+        for path in sorted(archive.glob(indir, prefix + '*.csv')):
+            self._digest(path)
+
+    def add(self, snapshot):
+        self._digest(snapshot.path)
+
+    def _digest(self, path):
+        stem = archive.csv_name(path)[:-len('.csv')]
+        if (Path('out/prevalence_digest') / stem).exists():
+            return
+        print(path)
+        with instrument.open_input(path) as infile:
+            prevalence_digest.main(infile, str(path))
+
+
+class Series:
+    """The files indir/prefix*.csv, and the outputs which depend on them."""
+
+    def __init__(self, name, indir, prefix, outputs):
+        self.name = name
+        self.indir = Path(indir)
+        self.prefix = prefix
+        self.outputs = outputs
+        self.forget()
+
+    def forget(self):
+        # path -> (size, mtime) when we last looked
+        self.known = {}
+        self.last = None
+
+    def scan(self):
+        """Returns (new snapshots, in order; True if we need to rebuild)."""
+        current = {}
+        for path in archive.glob(self.indir, self.prefix + '*.csv'):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            current[path] = (st.st_size, st.st_mtime_ns)
+
+        new = [make_snapshot(path, self.prefix)
+               for path in current if path not in self.known]
+        new.sort(key=sort_key)
+        changed = any(current.get(path) != version
+                      for (path, version) in self.known.items())
+        self.known = current
+
+        if not new:
+            return ([], changed)
+        by_name = sorted(snapshot.path.name for snapshot in new)
+        in_order = ([snapshot.path.name for snapshot in new] == by_name and
+                    (self.last is None or
+                     (new[0].path.name > self.last.path.name and
+                      sort_key(new[0]) > sort_key(self.last))))
+        rebuild = changed or not in_order or self.last is None
+        self.last = new[-1] if in_order else max(
+            (make_snapshot(path, self.prefix) for path in current), key=sort_key)
+        return (new, rebuild)
+
+    def update(self):
+        """Update the outputs.  Returns True if there was anything new."""
+        (new, rebuild) = self.scan()
+        if rebuild:
+            for output in self.outputs:
+                output.rebuild(self.indir, self.prefix)
+        else:
+            for snapshot in new:
+                for output in self.outputs:
+                    output.add(snapshot)
+        return bool(new) or rebuild
+
+
+class Watcher:
+    def __init__(self):
+        self.utla_maps = Maps('UTLA19CD')
+        self.lad_maps = Maps('lad16cd')
+        self.panel = prevalence_panel.Panel(prevalence_panel.PANEL_DIR)
+        self.checked = check_p_from_i.read_checked()
+
+        def prevalence_dir(indir, prefix, outdir):
+            return partial(prevalence_from_incidence.prevalence_dir,
+                           Path(indir), prefix, Path(outdir))
+
+        self.series = [
+            Series('incidence', 'download/incidence/', 'incidence_', [
+                Changes(changes.track_changes, 'out/changes/incidence.txt'),
+                Jump('incidence_', 'out/jump/incidence.csv'),
+                PubHistory('out/publish-date-8.incidence.England.csv',
+                           'out/publish-date-8.incidence.UK.csv'),
+                Rerun(prevalence_dir('download/incidence/', 'incidence_',
+                                     'out/prevalence_from_incidence_/')),
+                Revisions('incidence'),
+            ]),
+            Series('incidence_history', 'download/incidence_history/',
+                   'incidence_history_', [
+                Changes(changes.track_changes,
+                        'out/changes/incidence_history.txt'),
+                Jump('incidence_history_', 'out/jump/incidence_history.csv'),
+                Rerun(prevalence_dir('download/incidence_history/',
+                                     'incidence_history_',
+                                     'out/prevalence_from_incidence_history_/')),
+            ]),
+            Series('prevalence_history', 'download/prevalence_history/',
+                   'prevalence_history_', [
+                Changes(changes.track_changes,
+                        'out/changes/prevalence_history.txt'),
+                Jump('prevalence_history_', 'out/jump/prevalence_history.csv'),
+                Rerun(nova.prevalence_England.main),
+                Rerun(nova.prevalence_UK.main),
+                Rerun(partial(prevalence_panel.update, self.panel,
+                              Path('download/prevalence_history/'),
+                              'prevalence_history_')),
+            ]),
+            Series('newly_sick_table', 'download/newly_sick_table/',
+                   'newly_sick_table_', [
+                Jump('newly_sick_table_', 'out/jump/newly_sick_table.csv'),
+                Rerun(newly_sick_table.main),
+            ]),
+            Series('utla_prevalence_map', 'download/utla_prevalence_map/',
+                   'utla_prevalence_map_', [
+                Changes(changes.track_map, 'out/changes/utla_prevalence_map.txt'),
+                self.utla_maps,
+            ]),
+            Series('lad_prevalence_map', 'download/lad_prevalence_map/',
+                   'lad_prevalence_map_', [
+                Changes(changes.track_map, 'out/changes/lad_prevalence_map.txt'),
+                self.lad_maps,
+            ]),
+            Series('corrected_prevalence', 'download/corrected_prevalence/',
+                   'corrected_prevalence_region_trend_', [
+                Digests(),
+            ]),
+        ]
+
+    def check_p_from_i(self):
+        check_p_from_i.check_incidence(
+            self.checked, Path('download/prevalence_history/'),
+            Path('out/prevalence_from_incidence_/'))
+        check_p_from_i.check_incidence_history(
+            self.checked, Path('download/prevalence_history/'),
+            Path('out/prevalence_from_incidence_history_/'))
+        check_p_from_i.write_checked(self.checked)
+
+    def check_pd(self):
+        # Every digest is checked again, against all the maps.  There are
+        # only a few digests, and the maps are already in memory.
+        prefix = 'corrected_prevalence_region_trend_'
+        for path in sorted(Path('out/prevalence_digest/').glob(prefix + '*/')):
+            check_pd.check_digest(path, prefix, self.utla_maps.maps,
+                                  self.lad_maps.maps)
+
+    def poll(self):
+        """Look for new files, and update the outputs.  Returns the names
+        of the series which had new files."""
+        updated = set()
+        for series in self.series:
+            try:
+                if series.update():
+                    updated.add(series.name)
+            except Exception:
+                traceback.print_exc()
+                print(f'{series.name}: failed.  Will try again next time.')
+                series.forget()
+
+        checks = [
+            (self.check_p_from_i,
+             ['incidence', 'incidence_history', 'prevalence_history']),
+            (self.check_pd,
+             ['utla_prevalence_map', 'lad_prevalence_map',
+              'corrected_prevalence']),
+        ]
+        for (check, names) in checks:
+            if not updated.intersection(names):
+                continue
+            try:
+                check()
+            except Exception:
+                traceback.print_exc()
+                print(f'{check.__name__}: failed.')
+        return updated
+
+
+def usage():
+    print("Usage: ./watch.py [--interval SECONDS] [--once]")
+    print()
+    print("Update out/ whenever new files arrive in download/.")
+    print(f"--interval: how often to look.  Default: {DEFAULT_INTERVAL} seconds.")
+    print("--once:     bring everything up to date, then exit.")
+    sys.exit(2)
+
+def main():
+    args = sys.argv[1:]
+    interval = DEFAULT_INTERVAL
+    once = False
+    while args:
+        arg = args.pop(0)
+        if arg == '--interval' and args:
+            interval = float(args.pop(0))
+        elif arg == '--once':
+            once = True
+        else:
+            usage()
+
+    os.makedirs('out', exist_ok=True)
+    watcher = Watcher()
+    try:
+        while True:
+            start = time.monotonic()
+            updated = watcher.poll()
+            if updated:
+                elapsed = time.monotonic() - start
+                print(f'{time.strftime("%Y-%m-%d %H:%M:%S")}: updated '
+                      f'{", ".join(sorted(updated))} in {elapsed:.1f}s')
+                sys.stdout.flush()
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
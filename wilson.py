@@ -2,6 +2,10 @@
 
 import csv
 from pathlib import Path
+import archive
+import fastcsv
+import instrument
+import schema
 
 # https://www.mikulskibartosz.name/wilson-score-in-python-example/
 from math import sqrt
@@ -24,10 +28,10 @@ def run(indir, outfile):
 
     prefix = 'incidence table_'
     prefix_len = len(prefix)
-    paths = list(indir.glob(prefix + '*.csv'))
+    paths = archive.glob(indir, prefix + '*.csv')
     paths.sort()
     for path in paths:
-            name = path.name[prefix_len:-4]
+            name = archive.csv_name(path)[prefix_len:-4]
 
             # hack. this thing is about methods v1 to v3
             # and the initial incidence tables for v4 were broken anyway
@@ -36,13 +40,13 @@ def run(indir, outfile):
                 break
 
             date = '-'.join([name[:-4], name[-4:-2], name[-2:]])
-            with path.open() as f:
-                read = csv.DictReader(f)
-                def get_region(row):
-                    return row.get('region') or row.get('nhser19nm')
+            with instrument.open_input(path) as f:
+                read = fastcsv.DictReader(f)
+                region_field = schema.field_name(read.fieldnames, 'region')
+                assert region_field
 
                 for row in read:
-                    region = get_region(row)
+                    region = row[region_field]
                     cases = int(row.get('est. daily\ncases'))
                     cases_lo = int(row.get('est. daily\ncases\n95% lower lim.'))
                     cases_up = int(row.get('est. daily\ncases\n95% upper lim.'))
@@ -67,9 +71,14 @@ def run(indir, outfile):
                                      percent(p, p_lo),
                                      percent(p, p_up)])
 
-outdir = Path('out/')
-outdir.mkdir(parents=True, exist_ok=True)
+def main(outdir='out/'):
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
 
-indir = Path('download-sample/incidence table/')
-with open(outdir / 'wilson.csv', 'w') as outfile:
-    run(indir, outfile)
+    indir = Path('download-sample/incidence table/')
+    with open(outdir / 'wilson.csv', 'w') as outfile:
+        run(indir, outfile)
+
+if __name__ == '__main__':
+    instrument.init()
+    main()
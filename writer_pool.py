@@ -0,0 +1,139 @@
+# Write lines to many output files at once, e.g. one file per region.
+#
+# Splitting by UTLA or LAD means hundreds of output files.  Keeping them
+# all open can hit the limit on open files, and writing one row at a time
+# is slow.  So:
+#
+#  1. Lines are buffered in memory for each output, and written out in
+#     large chunks.
+#  2. At most max_open files are kept open.  When we need another one, the
+#     least recently used file is closed.  It is re-opened in append mode
+#     if it is needed again.
+#
+# Lines are handled as bytes.  If you already have a line from the input
+# file, you can write it out as-is, without parsing and re-encoding CSV.
+#
+# writerow() ends lines with lineterminator, '\n' by default, to match the
+# lines copied by write() from the ZOE files.  Don't mix line endings in one
+# file.
+#
+# Normally existing output files are overwritten.  With append=True, lines
+# are added to the end of existing files, and the header is only written
+# to new (or empty) files.
+
+import csv
+import io
+import os
+from collections import OrderedDict
+
+MAX_OPEN = 64
+BUFFER_SIZE = 256 * 1024
+MAX_BUFFERED = 64 * 1024 * 1024
+
+
+class WriterPool:
+    def __init__(self, path, header,
+                 max_open=MAX_OPEN,
+                 buffer_size=BUFFER_SIZE,
+                 max_buffered=MAX_BUFFERED,
+                 append=False,
+                 lineterminator='\n'):
+        self.path = path
+        self.header = header
+        self.append = append
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.max_buffered = max_buffered
+
+        # key -> list of lines
+        self.buffers = {}
+        # key -> total length of buffered lines
+        self.sizes = {}
+        self.buffered = 0
+        # key -> open file, in order of use.
+        self.files = OrderedDict()
+        # key -> output filename, for every file we have created
+        self.filenames = {}
+        # key -> number of lines, not counting the header
+        self.counts = {}
+
+        # For writerow().  Encoding via a csv.writer is slow-ish, but not
+        # as slow as creating a new csv.writer for every row.
+        self._csv_buf = io.StringIO()
+        self._csv = csv.writer(self._csv_buf, lineterminator=lineterminator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.csv')
+
+    def write(self, key, line):
+        """Append one line (bytes, including the line terminator)."""
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = []
+            self.buffers[key] = buf
+            self.sizes[key] = 0
+            self.counts.setdefault(key, 0)
+        buf.append(line)
+        self.counts[key] += 1
+        size = self.sizes[key] + len(line)
+        self.sizes[key] = size
+        self.buffered += len(line)
+        if size >= self.buffer_size:
+            self.flush(key)
+        elif self.buffered >= self.max_buffered:
+            self.flush_all()
+
+    def writerow(self, key, row):
+        """Append one row, encoded as CSV."""
+        self._csv_buf.seek(0)
+        self._csv_buf.truncate()
+        self._csv.writerow(row)
+        self.write(key, self._csv_buf.getvalue().encode('utf-8'))
+
+    def _open(self, key):
+        f = self.files.get(key)
+        if f is not None:
+            self.files.move_to_end(key)
+            return f
+
+        while len(self.files) >= self.max_open:
+            (_, old) = self.files.popitem(last=False)
+            old.close()
+
+        if key in self.filenames:
+            f = open(self.filenames[key], 'ab')
+        else:
+            filename = self.filename(key)
+            f = open(filename, 'ab' if self.append else 'wb')
+            if f.tell() == 0:
+                f.write(self.header)
+            self.filenames[key] = filename
+        self.files[key] = f
+        return f
+
+    def flush(self, key):
+        buf = self.buffers.get(key)
+        if not buf and key in self.filenames:
+            return
+        f = self._open(key)
+        if buf:
+            f.write(b''.join(buf))
+            buf.clear()
+            self.buffered -= self.sizes[key]
+            self.sizes[key] = 0
+
+    def flush_all(self):
+        for key in list(self.buffers):
+            self.flush(key)
+
+    def close(self):
+        self.flush_all()
+        for f in self.files.values():
+            f.close()
+        self.files.clear()